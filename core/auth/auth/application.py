@@ -3,19 +3,23 @@ import base64
 import copy
 import datetime
 import os
+from timeit import default_timer
 
 from autobahn import wamp
 from autobahn.wamp.exception import ApplicationError
-from jwt import encode as jwt_encode, decode as jwt_decode, DecodeError, ExpiredSignatureError
+from jwt import encode as jwt_encode, decode as jwt_decode, get_unverified_header, DecodeError, ExpiredSignatureError, InvalidTokenError
 from oauthlib import oauth2
 from oauthlib.common import generate_client_id as generate_secret
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+from twisted.internet.task import LoopingCall
 
 from auth.user_repository import UserRepository, PermissionType
+from mdstudio.api.capability import load_request_key
 from mdstudio.api.converter import convert_obj_to_json
 from mdstudio.api.endpoint import endpoint
 from mdstudio.api.scram import SCRAM
 from mdstudio.component.impl.core import CoreComponentSession
+from mdstudio.deferred.limiter import ConcurrencyLimiter, LimitExceeded
 from mdstudio.deferred.chainable import chainable
 from mdstudio.deferred.return_value import return_value
 from mdstudio.util.exception import MDStudioException
@@ -25,10 +29,13 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 
-from mdstudio.utc import now
 from mdstudio.service.model import Model
 from .oauth.request_validator import OAuthRequestValidator
 from .authorizer import Authorizer
+from .identity_cache import SessionIdentityCache, CredentialCache
+from .permission_index import PermissionIndex
+from .signing_keys import SigningKeyRing
+from .usage import UsageStatistics
 
 
 #@todo: allot of unfinished code in this class!
@@ -44,23 +51,99 @@ class AuthComponent(CoreComponentSession):
         self.db_initialized = False
         self.authorizer = Authorizer()
         self.oauth_backend_server = oauth2.BackendApplicationServer(OAuthRequestValidator(self))
-        self.user_repository = UserRepository(self.db)
+        # Without an in-memory index, permissions are looked up in the shared permissions collection
+        permission_index_size = self.component_config.settings.get('permissionIndexSize', 1024)
+        self.permission_index = PermissionIndex(permission_index_size) if permission_index_size else None
+        self.identity_cache = SessionIdentityCache(self.component_config.settings.get('identityCacheSize', 4096),
+                                                   self.component_config.settings.get('identityCacheTtl', 300))
+        self.credential_cache = CredentialCache(self.component_config.settings.get('credentialCacheSize', 1024),
+                                                self.component_config.settings.get('credentialCacheTtl', 30))
+        self.user_repository = UserRepository(self.db, self.permission_index, self.identity_cache, self.credential_cache)
+
+        # Smooths out reconnect storms, each authid has at most one credential lookup in flight
+        self.login_limiter = ConcurrencyLimiter(self.component_config.settings.get('loginConcurrency', 16),
+                                                max_queue=self.component_config.settings.get('loginQueue', 1024),
+                                                queue_timeout=self.component_config.settings.get('loginQueueTimeout', 30))
+        self.max_logins_per_authid = self.component_config.settings.get('loginMaxPerAuthid', 32)
+        self._login_lookups = {}
+
+        # Tokens live at most as long as the longest capability
+        retention = max(self.component_config.settings.get('maxCapabilityLifetime', 600), 60)
+        self.signing_keys = SigningKeyRing(self.db, self.component_config.settings.get('keyRotationInterval', 86400), retention)
+        self.signing_keys_refresher = LoopingCall(self.refresh_signing_keys)
+        self.usage = UsageStatistics(self.db, self.component_config.settings.get('usageMaxUris', 10000),
+                                     self.component_config.settings.get('usageFlushWindow', 8))
+        self.usage_flusher = LoopingCall(self.usage.flush)
+
+        configured_keys = self.component_config.settings.get('signingKeys', None)
+        if configured_keys:
+            self.signing_keys.configure(configured_keys)
+        else:
+            # The shared keys are stored in the database, which is not available until the db component is up
+            self.signing_keys.generate()
 
     @chainable
     def _on_join(self):
-        self.jwt_key = generate_secret()
+        yield self.on_event(self.on_session_leave, u'wamp.session.on_leave')
+        yield self.on_event(self.on_status, u'mdstudio.auth.endpoint.ring0.status')
         yield super(AuthComponent, self)._on_join()
 
-    @wamp.register(u'mdstudio.auth.endpoint.sign', options=wamp.RegisterOptions(details_arg='details'))
+    def on_session_leave(self, session_id, *args, **kwargs):
+        self.identity_cache.forget_session(session_id)
+
+    @chainable
+    def refresh_signing_keys(self):
+        try:
+            yield self.signing_keys.refresh()
+        except Exception as e:
+            self.log.warn('Could not refresh the signing keys: {message}', message=str(e))
+
+    @wamp.register(u'mdstudio.auth.endpoint.sign', options=wamp.RegisterOptions(details_arg='details', invoke='roundrobin'))
     @chainable
     def sign_claims(self, claims, details=None):
+        claims = yield self._resolve_claims(claims, details)
+
+        if claims is None:
+            return_value(None)
+
+        return_value(self._encode_claims(claims, datetime.timedelta(minutes=1)))
+
+    @wamp.register(u'mdstudio.auth.endpoint.sign-capability', options=wamp.RegisterOptions(details_arg='details', invoke='roundrobin'))
+    @chainable
+    def sign_capability(self, claims, lifetime=None, request_key=None, details=None):
+        if isinstance(claims, dict) and 'requestHash' in claims:
+            raise MDStudioException('A capability cannot be bound to a single request')
+
+        try:
+            load_request_key(request_key)
+        except Exception:
+            raise MDStudioException('A capability should be bound to a valid request key')
+
+        max_lifetime = self.component_config.settings.get('maxCapabilityLifetime', 600)
+        lifetime = min(lifetime or max_lifetime, max_lifetime)
+
+        claims = yield self._resolve_claims(claims, details)
+
+        if claims is None:
+            return_value(None)
+
+        # Only the holder of the private request key can make requests with this capability
+        claims['requestKey'] = request_key
+
+        return_value({
+            'token': self._encode_claims(claims, datetime.timedelta(seconds=lifetime)),
+            'lifetime': lifetime
+        })
+
+    @chainable
+    def _resolve_claims(self, claims, details):
         role = details.caller_authrole or 'user'
 
         if not isinstance(claims, dict):
             raise TypeError()
 
         claims = convert_obj_to_json(claims)
-        if any(key in claims for key in ['group', 'role', 'username']):
+        if any(key in claims for key in ['group', 'role', 'username', 'requestKey']):
             raise MDStudioException('Illegal key detected in claims: {0}'.format(', '.join(claims.keys())))
 
         if 'asGroup' in claims:
@@ -99,7 +182,7 @@ class AuthComponent(CoreComponentSession):
 
         elif role == 'user':
 
-            user = yield self.user_repository.find_user(details.caller_authid)
+            user = yield self._session_user(details)
 
             claims = convert_obj_to_json(claims)
             claims['username'] = user.name
@@ -109,7 +192,7 @@ class AuthComponent(CoreComponentSession):
             if group is not None:
                 if self.authorizer.authorize_user(claims['uri'], claims['action']) or (
                         g == group and
-                        (yield self.user_repository.check_permission(user.name, g, c, e, claims['action'], group_role))
+                        (yield self.user_repository.check_permission(user.name, g, c, e, claims['action'], group_role, user_handle=user.handle))
                 ):
                     claims['group'] = group
 
@@ -120,37 +203,89 @@ class AuthComponent(CoreComponentSession):
         else:
             raise NotImplementedError('Implement this (for oauth clients)')
 
-        claims['exp'] = datetime.datetime.utcnow() + datetime.timedelta(minutes=1)
+        return_value(claims)
+
+    @chainable
+    def _session_user(self, details):
+        user = self.identity_cache.get(details.caller, details.caller_authid)
+
+        if user is None:
+            user = yield self.user_repository.find_user(details.caller_authid)
+            self.identity_cache.put(details.caller, details.caller_authid, user)
 
-        return_value(jwt_encode(claims, self.jwt_key))
+        return_value(user)
 
-    @wamp.register(u'mdstudio.auth.endpoint.verify')
+    def _encode_claims(self, claims, lifetime):
+        claims['exp'] = datetime.datetime.utcnow() + lifetime
+
+        key = self.signing_keys.active
+
+        return jwt_encode(claims, key.private_key, algorithm=key.algorithm, headers={'kid': key.kid})
+
+    @wamp.register(u'mdstudio.auth.endpoint.verify', options=wamp.RegisterOptions(invoke='roundrobin'))
+    @chainable
     def verify_claims(self, signed_claims):
         try:
-            claims = jwt_decode(signed_claims, self.jwt_key)
+            key_id = get_unverified_header(signed_claims).get('kid')
         except DecodeError:
-            return {'error': 'Could not verify user'}
+            return_value({'error': 'Could not verify user'})
+
+        key = yield self.signing_keys.get(key_id)
+        if key is None:
+            return_value({'error': 'Could not verify user'})
+
+        try:
+            claims = jwt_decode(signed_claims, key.public_key, algorithms=[key.algorithm])
         except ExpiredSignatureError:
-            return {'expired': 'Request token has expired'}
+            return_value({'expired': 'Request token has expired'})
+        except InvalidTokenError:
+            return_value({'error': 'Could not verify user'})
 
-        return {'claims': claims}
+        return_value({'claims': claims})
 
-    @endpoint('ring0.set-status', {}, {})
+    @wamp.register(u'mdstudio.auth.endpoint.verification-keys', options=wamp.RegisterOptions(invoke='roundrobin'))
+    def verification_keys(self):
+        return self.signing_keys.published()
+
+    @endpoint('ring0.set-status', {}, {}, options=wamp.RegisterOptions(invoke='roundrobin'))
     def ring0_set_status(self, request, claims=None):
         self.status_list[claims['username']] = request['status']
 
-    @endpoint('ring0.get-status', {}, {})
+        # Keeps the status lists of the other auth instances in sync, and wakes up the components that wait
+        # for this one, including those of this instance
+        self.event(u'mdstudio.auth.endpoint.ring0.status', {'component': claims['username'], 'status': request['status']},
+                   options=wamp.PublishOptions(exclude_me=False))
+
+    def on_status(self, status, *args, **kwargs):
+        self.status_list[status['component']] = status['status']
+
+    @endpoint('ring0.get-status', {}, {}, options=wamp.RegisterOptions(invoke='roundrobin'))
     def ring0_get_status(self, request, claims=None):
         return self.status_list.get(request['component'], False)
 
+    @endpoint('ring0.refresh-permissions', {}, {}, options=wamp.RegisterOptions(invoke='roundrobin'))
+    @chainable
+    def ring0_refresh_permissions(self, request, claims=None):
+        groups = yield self.user_repository.load_permissions()
+
+        return_value({'groups': groups})
+
+    @endpoint('ring0.usage', {}, {}, options=wamp.RegisterOptions(invoke='roundrobin'))
+    @chainable
+    def ring0_usage(self, request, claims=None):
+        yield self.usage.flush()
+        usage = yield self.usage.find(request.get('uri'))
+
+        return_value({'usage': usage})
+
     def authorize_request(self, uri, claims):
         if claims.get('group', None) == 'mdstudio' and uri.startswith('mdstudio.auth.endpoint.ring0'):
             return True
 
         return False
 
-    @wamp.register(u'mdstudio.auth.endpoint.login')
-    @inlineCallbacks
+    @wamp.register(u'mdstudio.auth.endpoint.login', options=wamp.RegisterOptions(invoke='roundrobin'))
+    @chainable
     def user_login(self, realm, authid, details):
 
         if authid is None:
@@ -158,18 +293,62 @@ class AuthComponent(CoreComponentSession):
 
         self.log.info('WAMP authentication request for realm: {realm}, authid: {authid}', realm=realm, authid=authid)
 
-        user = yield self.user_repository.find_user(authid, with_authentication=True)
-
-        if user is not None:
-            user_auth = copy.deepcopy(user.authentication)
-            user_auth['stored-key'] = user_auth.pop('storedKey')
-            user_auth['server-key'] = user_auth.pop('serverKey')
-            user_auth['role'] = 'user'
+        user_auth = yield self._login_credentials(authid)
 
-            returnValue(user_auth)
+        if user_auth is not None:
+            return_value(copy.deepcopy(user_auth))
         else:
             raise ApplicationError("No such user")
 
+    @chainable
+    def _login_credentials(self, authid):
+        user_auth = self.credential_cache.get(authid)
+        if user_auth is not None:
+            return_value(user_auth)
+
+        # Concurrent logins with the same authid share the result of the first lookup
+        if authid in self._login_lookups:
+            if len(self._login_lookups[authid]) >= self.max_logins_per_authid:
+                raise ApplicationError('Too many concurrent logins for {}, try again later'.format(authid))
+
+            waiter = Deferred()
+            self._login_lookups[authid].append(waiter)
+            return_value((yield waiter))
+
+        self._login_lookups[authid] = []
+        try:
+            user_auth = yield self.login_limiter.run(self._find_credentials, authid)
+        except LimitExceeded as e:
+            error = ApplicationError('Too many concurrent logins, try again later: {}'.format(e))
+            for waiter in self._login_lookups.pop(authid):
+                waiter.errback(error)
+            raise error
+        except Exception as e:
+            for waiter in self._login_lookups.pop(authid):
+                waiter.errback(e)
+            raise
+        else:
+            for waiter in self._login_lookups.pop(authid):
+                waiter.callback(user_auth)
+
+        return_value(user_auth)
+
+    @chainable
+    def _find_credentials(self, authid):
+        user = yield self.user_repository.find_user(authid, with_authentication=True)
+
+        if user is None:
+            return_value(None)
+
+        user_auth = copy.deepcopy(user.authentication)
+        user_auth['stored-key'] = user_auth.pop('storedKey')
+        user_auth['server-key'] = user_auth.pop('serverKey')
+        user_auth['role'] = 'user'
+
+        self.credential_cache.put(authid, user.handle, user_auth)
+
+        return_value(user_auth)
+
     @chainable
     def on_run(self):
         # repo = UserRepository(self.db)
@@ -213,6 +392,14 @@ class AuthComponent(CoreComponentSession):
                         if p.full_namespace is None:
                             raise MDStudioException()
 
+        yield self.user_repository.load_permissions()
+
+        if not self.signing_keys.static:
+            yield self.signing_keys.refresh()
+            self.signing_keys_refresher.start(self.component_config.settings.get('keyRefreshInterval', 60), now=False)
+
+        self.usage_flusher.start(self.component_config.settings.get('usageFlushInterval', 30), now=False)
+
         # @todo: use this for testing
         # user = yield self.user_repository.create_user('foo', 'bar', 'foo@bar')
         # user2 = yield self.user_repository.create_user('foo2', 'bar2', 'foo@bar')
@@ -247,8 +434,9 @@ class AuthComponent(CoreComponentSession):
     #
     #     returnValue(None)
 
-    @wamp.register(u'mdstudio.auth.endpoint.authorize.admin')
+    @wamp.register(u'mdstudio.auth.endpoint.authorize.admin', options=wamp.RegisterOptions(invoke='roundrobin'))
     def authorize_admin(self, session, uri, action, options):
+        started = default_timer()
         role = session.get('authrole')
         authid = session.get('authid')
 
@@ -268,12 +456,13 @@ class AuthComponent(CoreComponentSession):
             if uri.startswith('mdstudio.auth.endpoint.oauth'):
                 authorization['disclose'] = True
 
-            self._store_action(uri, action, options)
+            self._store_action(uri, action, options, default_timer() - started)
 
         return authorization
 
-    @wamp.register(u'mdstudio.auth.endpoint.authorize.ring0')
+    @wamp.register(u'mdstudio.auth.endpoint.authorize.ring0', options=wamp.RegisterOptions(invoke='roundrobin'))
     def authorize_ring0(self, session, uri, action, options):
+        started = default_timer()
         role = session.get('authrole')
 
         authorization = self.authorizer.authorize_ring0(uri, action, role)
@@ -284,7 +473,7 @@ class AuthComponent(CoreComponentSession):
             if 'disclose' not in authorization:
                 authorization['disclose'] = False
 
-            self._store_action(uri, action, options)
+            self._store_action(uri, action, options, default_timer() - started)
 
         return authorization
 
@@ -327,9 +516,10 @@ class AuthComponent(CoreComponentSession):
     #
     #     returnValue(authorization)
 
-    @wamp.register(u'mdstudio.auth.endpoint.authorize.user')
+    @wamp.register(u'mdstudio.auth.endpoint.authorize.user', options=wamp.RegisterOptions(invoke='roundrobin'))
     @chainable
     def authorize_user(self, session, uri, action, options):
+        started = default_timer()
         username = session.get('authid')
 
         # Check for authorization on ring0
@@ -348,11 +538,11 @@ class AuthComponent(CoreComponentSession):
             if 'disclose' not in authorization:
                 authorization['disclose'] = False
 
-            self._store_action(uri, action, options)
+            self._store_action(uri, action, options, default_timer() - started)
 
         return_value(authorization)
 
-    @endpoint('oauth.client.create', 'oauth/client/client-request', 'oauth/client/client-response')
+    @endpoint('oauth.client.create', 'oauth/client/client-request', 'oauth/client/client-response', options=wamp.RegisterOptions(invoke='roundrobin'))
     @inlineCallbacks
     def create_oauth_client(self, request, details=None):
         user = yield self._get_user(details.caller_authid)
@@ -370,7 +560,7 @@ class AuthComponent(CoreComponentSession):
             'secret': clientInfo['secret']
         })
 
-    @endpoint('oauth.client.getusername', {}, {})
+    @endpoint('oauth.client.getusername', {}, {}, options=wamp.RegisterOptions(invoke='roundrobin'))
     @inlineCallbacks
     def get_oauth_client_username(self, request):
         client = yield self._get_client(request['clientId'])
@@ -382,7 +572,7 @@ class AuthComponent(CoreComponentSession):
         else:
             returnValue({})
 
-    @wamp.register(u'mdstudio.auth.endpoint.logout', options=wamp.RegisterOptions(details_arg='details'))
+    @wamp.register(u'mdstudio.auth.endpoint.logout', options=wamp.RegisterOptions(details_arg='details', invoke='roundrobin'))
     @inlineCallbacks
     def user_logout(self, details):
         user = yield self._get_user(details.get('authid'))
@@ -515,61 +705,5 @@ class AuthComponent(CoreComponentSession):
         res = yield Model(self, 'sessions').delete_one({'userId': user_id, 'sessionId': session_id})
         returnValue(res > 0)
 
-    def _store_action(self, uri, action, options):
-        registration = Model(self, 'registration_info')
-
-        n = now().isoformat()
-
-        if action == 'register':
-            match = options.get('match', 'exact')
-
-            # @inlineCallbacks
-            # def update_registration():
-            #     upd = yield registration.update_one(
-            #         {
-            #             'uri': uri,
-            #             'match': match
-            #         },
-            #         {
-            #             '$inc': {
-            #                 'registrationCount': 1
-            #             },
-            #             '$set': {
-            #                 'latestRegistration': n
-            #             },
-            #             '$setOnInsert': {
-            #                 'uri': uri,
-            #                 'firstRegistration': n,
-            #                 'match': match
-            #             }
-            #         },
-            #         upsert=True,
-            #         date_fields=['update.$set.latestRegistration', 'update.$setOnInsert.firstRegistration']
-            #     )
-
-            # We cannot be sure the DB is already up, possibly wait
-            yield DBWaiter(self, update_registration).run()
-        elif action == 'call':
-            @inlineCallbacks
-            def update_registration():
-                id = yield self.call(u'wamp.registration.match', uri)
-                if id:
-                    reg_info = yield self.call(u'wamp.registration.get', id)
-                    # yield registration.update_one(
-                    #     {
-                    #         'uri': reg_info['uri'],
-                    #         'match': reg_info['match']
-                    #     },
-                    #     {
-                    #         '$inc': {
-                    #             'callCount': 1
-                    #         },
-                    #         '$set': {
-                    #             'latestCall': now
-                    #         }
-                    #     },
-                    #     date_fields=['update.$set.latestCall']
-                    # )
-
-            # We cannot be sure the DB is already up, possibly wait
-            yield DBWaiter(self, update_registration).run()
+    def _store_action(self, uri, action, options, seconds=None):
+        self.usage.record(uri, action, options, seconds)
@@ -1,6 +1,8 @@
 import itertools
 import re
 
+from mdstudio.collection.lru_dict import LRUDict
+
 
 class ActionRule(object):
     def __init__(self, actions):
@@ -43,8 +45,78 @@ class ExactRule(ActionRule):
         return self.uri.format(uri=uri, **kw) == uri and super(ExactRule, self).match(uri, action, **kw)
 
 
+class _RuleIndex(object):
+    """
+    The rules of a rule set with their templates filled in for a single role, indexed by the actions they allow:
+    exact uris in a hash table, prefixes in a character trie, and the regular expressions combined into one pattern.
+    Rules with a template that depends on the uri itself are matched one by one.
+    """
+
+    _actions = object()
+
+    def __init__(self, rules, **kw):
+        self.exact = {}
+        self.prefixes = {}
+        self.dynamic = []
+
+        patterns = {}
+
+        for rule in rules:
+            if isinstance(rule, ExactRule):
+                template = rule.uri
+            elif isinstance(rule, PrefixRule):
+                template = rule.prefix
+            elif isinstance(rule, RegexRule):
+                template = rule.pattern
+            else:
+                template = None
+
+            try:
+                if template is None or '{uri}' in template:
+                    raise KeyError('uri')
+
+                value = template.format(**kw)
+            except (KeyError, IndexError, ValueError):
+                self.dynamic.append(rule)
+                continue
+
+            for action in rule.actions:
+                if isinstance(rule, ExactRule):
+                    self.exact.setdefault(value, set()).add(action)
+                elif isinstance(rule, PrefixRule):
+                    node = self.prefixes
+                    for character in value:
+                        node = node.setdefault(character, {})
+                    node.setdefault(self._actions, set()).add(action)
+                else:
+                    patterns.setdefault(action, []).append(value)
+
+        self.patterns = dict((action, re.compile('|'.join('(?:{})'.format(p) for p in action_patterns)))
+                             for action, action_patterns in patterns.items())
+
+    def match(self, uri, action, **kw):
+        actions = ('*', action)
+
+        if any(a in self.exact.get(uri, ()) for a in actions):
+            return True
+
+        node = self.prefixes
+        for character in itertools.chain([''], uri):
+            if character:
+                node = node.get(character)
+                if node is None:
+                    break
+            if any(a in node.get(self._actions, ()) for a in actions):
+                return True
+
+        if any(a in self.patterns and self.patterns[a].match(uri) for a in actions):
+            return True
+
+        return any(rule.match(uri, action, **kw) for rule in self.dynamic)
+
+
 class Authorizer(object):
-    def __init__(self):
+    def __init__(self, cache_size=4096):
         # Build ruleset for communication inside ring0
         self.ring0_rules = [
             PrefixRule('mdstudio.{role}.', ['*']),
@@ -52,28 +124,59 @@ class Authorizer(object):
             # RegexRule('mdstudio\\.\\w+\\.endpoint\\.events\\.\\w+', ['subscribe']),
             # ExactRule('mdstudio.auth.endpoint.oauth.client.getusername'),
             ExactRule('mdstudio.auth.endpoint.ring0.get-status'),
-            ExactRule('mdstudio.auth.endpoint.ring0.set-status')
+            ExactRule('mdstudio.auth.endpoint.ring0.set-status'),
+            ExactRule('mdstudio.auth.endpoint.ring0.status', ['subscribe'])
         ]
 
         # Endpoints that are callable by anyone that is authenticated
         self.authenticated_rules = [
             RegexRule(r'mdstudio\.db\.endpoint\.\w+'),
             ExactRule('mdstudio.auth.endpoint.sign'),
+            ExactRule('mdstudio.auth.endpoint.sign-capability'),
             ExactRule('mdstudio.auth.endpoint.verify'),
+            ExactRule('mdstudio.auth.endpoint.verification-keys'),
             ExactRule('mdstudio.schema.endpoint.upload'),
             ExactRule('mdstudio.schema.endpoint.get'),
             ExactRule('mdstudio.logger.endpoint.push-logs'),
             ExactRule('mdstudio.logger.endpoint.events-logs')
         ]
-    
+
+        self.decisions = LRUDict(cache_size)
+        self.compile()
+
+    def compile(self):
+        """
+        Index the rule sets, this should be called again after changing them.
+        """
+        self._ring0_rules = list(itertools.chain(self.ring0_rules, self.authenticated_rules))
+        self._ring0_indices = {}
+        self._user_index = _RuleIndex(self.authenticated_rules)
+        self.decisions.clear()
+
     def authorize_ring0(self, uri, action, role):
-        if any(rule.match(uri, action, role=role) for rule in itertools.chain(self.ring0_rules, self.authenticated_rules)):
+        key = ('ring0', uri, action, role)
+        allowed = self.decisions.get(key)
+
+        if allowed is None:
+            index = self._ring0_indices.get(role)
+            if index is None:
+                index = self._ring0_indices[role] = _RuleIndex(self._ring0_rules, role=role)
+
+            allowed = self.decisions[key] = index.match(uri, action, role=role)
+
+        if allowed:
             return {'allow': True, 'disclose': True}
 
         return False
-    
+
     def authorize_user(self, uri, action):
-        if any(rule.match(uri, action) for rule in self.authenticated_rules):
+        key = ('user', uri, action)
+        allowed = self.decisions.get(key)
+
+        if allowed is None:
+            allowed = self.decisions[key] = self._user_index.match(uri, action)
+
+        if allowed:
             return {'allow': True, 'disclose': True}
 
         return False
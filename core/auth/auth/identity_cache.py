@@ -0,0 +1,65 @@
+from mdstudio.collection.lru_dict import LRUDict
+
+
+class SessionIdentityCache(object):
+    """
+    Caches the user that was resolved for a WAMP session, so signing claims for a known session does not need
+    a database lookup. Entries are dropped when the session leaves or the user changes, and expire after `ttl`
+    seconds as a safety net.
+    """
+
+    def __init__(self, size=4096, ttl=300):
+        self.sessions = LRUDict(size, ttl)
+
+    def get(self, session_id, authid):
+        if session_id is None:
+            return None
+
+        entry = self.sessions.get(session_id)
+        if entry is None or entry[0] != authid:
+            return None
+
+        return entry[1]
+
+    def put(self, session_id, authid, user):
+        if session_id is not None and user is not None:
+            self.sessions[session_id] = (authid, user)
+
+    def forget_session(self, session_id):
+        self.sessions.pop(session_id, None)
+
+    def forget_user(self, handle):
+        for session_id in self.sessions.keys():
+            entry = self.sessions.get(session_id)
+            if entry is not None and entry[1].handle == handle:
+                self.sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class CredentialCache(object):
+    """
+    Caches the SCRAM credentials of users by authid for a short time, so a burst of logins, e.g. when all clients
+    reconnect after a router restart, does not decrypt the same credentials in the database for every login.
+    """
+
+    def __init__(self, size=1024, ttl=30):
+        self.credentials = LRUDict(size, ttl)
+
+    def get(self, authid):
+        entry = self.credentials.get(authid)
+
+        return entry[1] if entry is not None else None
+
+    def put(self, authid, handle, credentials):
+        self.credentials[authid] = (handle, credentials)
+
+    def forget_user(self, handle):
+        for authid in self.credentials.keys():
+            entry = self.credentials.get(authid)
+            if entry is not None and entry[0] == handle:
+                self.credentials.pop(authid, None)
+
+    def __len__(self):
+        return len(self.credentials)
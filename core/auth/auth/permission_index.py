@@ -0,0 +1,82 @@
+from mdstudio.collection.lru_dict import LRUDict
+
+
+def component_permissions(group):
+    """
+    Flatten the component permissions of a group document into (user handle, role name, component, permission)
+    tuples, one for every member of a role with permissions on a component that is registered in the group.
+    """
+    if not group:
+        return
+
+    components = set(c.get('componentName') for c in group.get('components') or [])
+
+    for role in group.get('roles') or []:
+        role_permissions = (role.get('permissions') or {}).get('componentPermissions') or {}
+
+        for component, permission in role_permissions.items():
+            if component not in components:
+                continue
+
+            for member in role.get('members') or []:
+                yield member['handle'], role.get('roleName'), component, permission
+
+
+class PermissionIndex(object):
+    """
+    In-memory index of the component permissions in the groups collection. Per group, the permissions of each role
+    are stored under the (user handle, component) pairs of the role members, so checking a permission is a dictionary
+    lookup. At most `max_groups` groups are indexed; the least recently used group is evicted first.
+    """
+
+    def __init__(self, max_groups=1024):
+        self.groups = LRUDict(max_groups)
+
+    def __contains__(self, group_name):
+        return group_name in self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def index_group(self, group_name, group):
+        """
+        (Re)index a group document from the groups collection. A missing group is indexed as having no permissions.
+        """
+        permissions = {}
+
+        for user_handle, role_name, component, permission in component_permissions(group):
+            permissions.setdefault((user_handle, component), {})[role_name] = permission
+
+        self.groups[group_name] = permissions
+
+    def forget_group(self, group_name):
+        self.groups.pop(group_name, None)
+
+    def clear(self):
+        self.groups.clear()
+
+    def check(self, user_handle, group_name, component, uri, action, role_name=None):
+        """
+        Check if the user is allowed to perform the action on the endpoint `uri` of the component, through any of
+        their roles in the group, or only through `role_name` when given. The group should be indexed.
+        """
+        roles = self.groups[group_name].get((user_handle, component), {})
+
+        if role_name:
+            permissions = [roles[role_name]] if role_name in roles else []
+        else:
+            permissions = roles.values()
+
+        actions = (action, '*')
+        # Endpoint uris are stored with slashes, as dots are not allowed in document keys
+        uri = uri.replace('.', '/')
+
+        for permission in permissions:
+            if permission.get('fullNamespace'):
+                return True
+            if any(a in (permission.get('namespace') or []) for a in actions):
+                return True
+            if any(a in (permission.get('endpoints') or {}).get(uri, []) for a in actions):
+                return True
+
+        return False
@@ -0,0 +1,187 @@
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from mdstudio.db.connection_type import ConnectionType
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.return_value import return_value
+from mdstudio.service.model import Model
+from mdstudio.utc import now
+from mdstudio.util.exception import MDStudioException
+from mdstudio.util.random import random_uuid
+
+
+class SigningKey(object):
+    algorithm = 'RS256'
+
+    def __init__(self, kid, private_key, generation=None, expires=None):
+        self.kid = kid
+        self.private_key = private_key
+        self.public_key = private_key.public_key()
+        self.generation = generation
+        self.expires = expires
+
+    @staticmethod
+    def generate(generation=None):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+
+        return SigningKey(random_uuid(), private_key, generation)
+
+    @staticmethod
+    def from_dict(key):
+        if 'key' in key:
+            pem = key['key']
+        elif 'path' in key:
+            with open(key['path']) as f:
+                pem = f.read()
+        else:
+            raise MDStudioException('Signing key {} should have either a "key" or a "path"'.format(key.get('kid')))
+
+        private_key = serialization.load_pem_private_key(pem.encode('ascii'), password=None, backend=default_backend())
+
+        return SigningKey(key['kid'], private_key, key.get('generation'))
+
+    def to_dict(self):
+        pem = self.private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                             format=serialization.PrivateFormat.PKCS8,
+                                             encryption_algorithm=serialization.NoEncryption())
+
+        return {
+            'kid': self.kid,
+            'generation': self.generation,
+            'key': pem.decode('ascii')
+        }
+
+    def public_pem(self):
+        return self.public_key.public_bytes(encoding=serialization.Encoding.PEM,
+                                            format=serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii')
+
+
+class SigningKeyRing(object):
+    """
+    The keys the auth component signs claims with, by key id, so several auth instances can sign and verify the
+    same tokens.
+
+    Keys are either configured in the settings, where the first key signs and the others are only used for
+    verification, or shared through the database. Database keys rotate every `rotation_interval` seconds: every
+    period has its own key, which is created by whichever instance needs it first, and the key of the next period
+    is created ahead of time so all instances know it before they switch. Old keys are kept for `retention`
+    seconds after they stop signing, the longest a token can be valid.
+    """
+
+    class SigningKeys(Model):
+        connection_type = ConnectionType.User
+        encrypted_fields = ['key']
+        date_time_fields = ['createdAt']
+
+    # Minimal number of seconds between looking up unknown key ids in the database
+    lookup_interval = 5
+
+    def __init__(self, db_wrapper=None, rotation_interval=86400, retention=600, clock=time.time):
+        self.wrapper = db_wrapper
+        self.rotation_interval = rotation_interval
+        self.retention = retention
+        self.clock = clock
+        self.refreshed_at = None
+        self.keys = {}
+        self.active = None  # type: SigningKey
+        self.static = False
+
+    @property
+    def signing_keys(self):
+        return self.SigningKeys(self.wrapper)
+
+    def configure(self, keys):
+        """
+        Use the keys from the settings, the first key signs.
+        """
+        if not keys:
+            raise MDStudioException('At least one signing key should be configured')
+
+        keys = [SigningKey.from_dict(k) for k in keys]
+
+        self.keys = dict((k.kid, k) for k in keys)
+        self.active = keys[0]
+        self.static = True
+
+    def generate(self):
+        """
+        Sign with a key of this instance only, until the shared keys are available.
+        """
+        self._activate(SigningKey.generate())
+
+    def generation(self):
+        return int(self.clock() // self.rotation_interval)
+
+    @chainable
+    def refresh(self):
+        if self.static or self.wrapper is None:
+            return_value(self.active)
+
+        self.refreshed_at = self.clock()
+        generation = self.generation()
+        first = int((self.clock() - self.retention) // self.rotation_interval)
+
+        stored = yield self.signing_keys.find_many({'generation': {'$gte': first}}, {'_id': False}).to_list()
+        stored = dict((k['generation'], k) for k in stored)
+
+        for g in [generation, generation + 1]:
+            if g not in stored:
+                stored[g] = yield self._create(g)
+
+        for g, key in stored.items():
+            if key['kid'] not in self.keys:
+                self.keys[key['kid']] = SigningKey.from_dict(key)
+
+            # A key signs during its own period and verifies until its tokens have expired
+            self.keys[key['kid']].expires = (g + 1) * self.rotation_interval + self.retention
+
+        self._activate(self.keys[stored[generation]['kid']])
+
+        return_value(self.active)
+
+    @chainable
+    def get(self, kid):
+        """
+        Find the key with the given key id, and look for it in the database when it is unknown, as
+        another instance may have rotated the keys first.
+        """
+        if kid not in self.keys and not self.static and self.wrapper is not None and \
+                (self.refreshed_at is None or self.clock() - self.refreshed_at >= self.lookup_interval):
+            yield self.refresh()
+
+        return_value(self.keys.get(kid))
+
+    def published(self):
+        return [{
+            'kid': key.kid,
+            'key': key.public_pem(),
+            'algorithm': key.algorithm
+        } for key in self.keys.values()]
+
+    @chainable
+    def _create(self, generation):
+        key = SigningKey.generate(generation).to_dict()
+        key['createdAt'] = now()
+
+        # Only the first instance inserts its key, the others use that one
+        created = yield self.signing_keys.find_one_and_update({
+            'generation': generation
+        }, {
+            '$setOnInsert': key
+        }, upsert=True, projection={'_id': False}, return_updated=True)
+
+        return_value(created)
+
+    def _activate(self, key):
+        if self.active is not None and self.active is not key and self.active.expires is None:
+            self.active.expires = self.clock() + self.retention
+
+        self.active = key
+        self.keys[key.kid] = key
+
+        current = self.clock()
+        for kid in [kid for kid, k in self.keys.items() if k.expires is not None and k.expires < current]:
+            del self.keys[kid]
@@ -0,0 +1,88 @@
+import itertools
+
+from twisted.trial import unittest
+
+from auth.authorizer import Authorizer, ExactRule, PrefixRule, RegexRule, _RuleIndex
+
+
+class TestRuleIndex(unittest.TestCase):
+    rules = [
+        PrefixRule('mdstudio.{role}.', ['*']),
+        PrefixRule('group.component.endpoint.', ['subscribe']),
+        ExactRule('mdstudio.auth.endpoint.sign'),
+        ExactRule('mdstudio.auth.endpoint.{role}-status', ['register']),
+        RegexRule(r'mdstudio\.db\.endpoint\.\w+'),
+        RegexRule(r'group\.\w+\.endpoint\.events\.\w+$', ['subscribe', 'publish']),
+        ExactRule('{uri}', ['publish'])
+    ]
+
+    uris = [
+        'mdstudio.db.endpoint.find_one',
+        'mdstudio.db.endpoint',
+        'mdstudio.schema.endpoint.get',
+        'mdstudio.auth.endpoint.sign',
+        'mdstudio.auth.endpoint.sign.other',
+        'mdstudio.auth.endpoint.db-status',
+        'mdstudio.auth.endpoint.schema-status',
+        'group.component.endpoint.foo',
+        'group.component.endpoint.events.foo',
+        'group.component.endpoint.events.foo.bar',
+        'mdstudio.',
+        ''
+    ]
+
+    def test_matches_rules(self):
+        for role in ['db', 'schema', 'auth']:
+            index = _RuleIndex(self.rules, role=role)
+
+            for uri, action in itertools.product(self.uris, ['call', 'register', 'subscribe', 'publish']):
+                expected = any(rule.match(uri, action, role=role) for rule in self.rules)
+
+                self.assertEqual(bool(index.match(uri, action, role=role)), expected, (uri, action, role))
+
+    def test_dynamic_rules(self):
+        index = _RuleIndex(self.rules, role='db')
+
+        self.assertEqual(len(index.dynamic), 1)
+        self.assertEqual(len(index.exact), 2)
+        self.assertEqual(set(index.patterns.keys()), {'call', 'subscribe', 'publish'})
+
+    def test_missing_substitution(self):
+        index = _RuleIndex([PrefixRule('mdstudio.{role}.', ['*'])])
+
+        self.assertRaises(KeyError, index.match, 'mdstudio.db.endpoint', 'call')
+
+
+class TestAuthorizer(unittest.TestCase):
+    def setUp(self):
+        self.authorizer = Authorizer()
+
+    def test_authorize_ring0(self):
+        self.assertEqual(self.authorizer.authorize_ring0('mdstudio.db.endpoint.find_one', 'register', 'db'), {'allow': True, 'disclose': True})
+        self.assertEqual(self.authorizer.authorize_ring0('mdstudio.auth.endpoint.ring0.set-status', 'call', 'db'), {'allow': True, 'disclose': True})
+        self.assertFalse(self.authorizer.authorize_ring0('mdstudio.auth.endpoint.ring0.set-status', 'register', 'db'))
+        self.assertFalse(self.authorizer.authorize_ring0('mdstudio.schema.endpoint.find_one', 'register', 'db'))
+        self.assertEqual(self.authorizer.authorize_ring0('mdstudio.auth.endpoint.ring0.status', 'subscribe', 'db'), {'allow': True, 'disclose': True})
+        self.assertFalse(self.authorizer.authorize_ring0('mdstudio.auth.endpoint.ring0.status', 'publish', 'db'))
+
+    def test_authorize_user(self):
+        self.assertEqual(self.authorizer.authorize_user('mdstudio.db.endpoint.find_one', 'call'), {'allow': True, 'disclose': True})
+        self.assertEqual(self.authorizer.authorize_user('mdstudio.auth.endpoint.sign', 'call'), {'allow': True, 'disclose': True})
+        self.assertFalse(self.authorizer.authorize_user('mdstudio.auth.endpoint.ring0.set-status', 'call'))
+        self.assertFalse(self.authorizer.authorize_user('mdstudio.db.endpoint.find_one', 'register'))
+
+    def test_decisions_cached(self):
+        self.authorizer.authorize_ring0('mdstudio.db.endpoint.find_one', 'register', 'db')
+        self.authorizer.authorize_user('mdstudio.db.endpoint.find_one', 'register')
+
+        self.assertIs(self.authorizer.decisions.get(('ring0', 'mdstudio.db.endpoint.find_one', 'register', 'db')), True)
+        self.assertIs(self.authorizer.decisions.get(('user', 'mdstudio.db.endpoint.find_one', 'register')), False)
+
+    def test_compile(self):
+        self.assertFalse(self.authorizer.authorize_user('group.component.endpoint.foo', 'call'))
+
+        self.authorizer.authenticated_rules.append(ExactRule('group.component.endpoint.foo'))
+        self.authorizer.compile()
+
+        self.assertTrue(self.authorizer.authorize_user('group.component.endpoint.foo', 'call'))
+        self.assertTrue(self.authorizer.authorize_ring0('group.component.endpoint.foo', 'call', 'db'))
@@ -0,0 +1,56 @@
+import os
+
+import yaml
+from twisted.trial import unittest
+
+CONFIG = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', 'crossbar_config.yml')
+
+
+def role_permission(role, uri):
+    """
+    The permission crossbar applies to the uri: an exact rule wins, otherwise the longest matching prefix.
+    """
+    permissions = role.get('permissions', [])
+
+    for permission in permissions:
+        if permission.get('match', 'exact') == 'exact' and permission['uri'] == uri:
+            return permission['allow']
+
+    prefixes = [p for p in permissions if p.get('match') == 'prefix' and uri.startswith(p['uri'])]
+    if prefixes:
+        return max(prefixes, key=lambda p: len(p['uri']))['allow']
+
+    return {}
+
+
+class TestCrossbarConfig(unittest.TestCase):
+    def setUp(self):
+        with open(CONFIG) as f:
+            config = yaml.safe_load(f)
+
+        roles = [role for worker in config['workers'] for realm in worker.get('realms', []) for role in realm['roles']]
+        self.auth = next(role for role in roles if role['name'] == 'auth')
+
+    def test_auth_status_topic(self):
+        allow = role_permission(self.auth, 'mdstudio.auth.endpoint.ring0.status')
+
+        self.assertTrue(allow.get('subscribe'))
+        self.assertTrue(allow.get('publish'))
+
+    def test_auth_endpoints(self):
+        allow = role_permission(self.auth, 'mdstudio.auth.endpoint.sign')
+
+        self.assertTrue(allow.get('register'))
+        self.assertTrue(allow.get('call'))
+
+    def test_auth_endpoints_least_privilege(self):
+        # Only the status topic is published on, the other auth uris are endpoints
+        for uri in ['mdstudio.auth.endpoint', 'mdstudio.auth.endpoint.sign', 'mdstudio.auth.endpoint.ring0.set-status']:
+            allow = role_permission(self.auth, uri)
+
+            self.assertFalse(allow.get('publish'), uri)
+            self.assertFalse(allow.get('subscribe'), uri)
+
+    def test_auth_subscribe(self):
+        self.assertTrue(role_permission(self.auth, 'mdstudio.db.endpoint.status').get('subscribe'))
+        self.assertTrue(role_permission(self.auth, 'wamp.session.on_leave').get('subscribe'))
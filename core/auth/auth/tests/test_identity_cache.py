@@ -0,0 +1,99 @@
+from twisted.trial import unittest
+
+from auth.identity_cache import SessionIdentityCache, CredentialCache
+from auth.user_repository import UserRepository
+
+
+class TestSessionIdentityCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = SessionIdentityCache(size=2, ttl=300)
+        self.user = UserRepository.Users.Instance.from_dict({'username': 'alice', 'handle': 'alice-handle'})
+
+    def test_get(self):
+        self.cache.put(1, 'alice', self.user)
+
+        self.assertIs(self.cache.get(1, 'alice'), self.user)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get(1, 'alice'))
+
+    def test_get_other_authid(self):
+        self.cache.put(1, 'alice', self.user)
+
+        self.assertIsNone(self.cache.get(1, 'bob'))
+
+    def test_put_without_session(self):
+        self.cache.put(None, 'alice', self.user)
+
+        self.assertEqual(len(self.cache), 0)
+        self.assertIsNone(self.cache.get(None, 'alice'))
+
+    def test_put_without_user(self):
+        self.cache.put(1, 'alice', None)
+
+        self.assertEqual(len(self.cache), 0)
+
+    def test_forget_session(self):
+        self.cache.put(1, 'alice', self.user)
+        self.cache.forget_session(1)
+        self.cache.forget_session(1)
+
+        self.assertIsNone(self.cache.get(1, 'alice'))
+
+    def test_forget_user(self):
+        other = UserRepository.Users.Instance.from_dict({'username': 'bob', 'handle': 'bob-handle'})
+        self.cache.put(1, 'alice', self.user)
+        self.cache.put(2, 'bob', other)
+
+        self.cache.forget_user('alice-handle')
+
+        self.assertIsNone(self.cache.get(1, 'alice'))
+        self.assertIs(self.cache.get(2, 'bob'), other)
+
+    def test_expire(self):
+        cache = SessionIdentityCache(ttl=0)
+        cache.put(1, 'alice', self.user)
+
+        self.assertIsNone(cache.get(1, 'alice'))
+
+    def test_bounded(self):
+        self.cache.put(1, 'alice', self.user)
+        self.cache.put(2, 'alice', self.user)
+        self.cache.put(3, 'alice', self.user)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get(1, 'alice'))
+
+
+class TestCredentialCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = CredentialCache(size=2, ttl=30)
+
+    def test_get(self):
+        self.cache.put('alice', 'alice-handle', {'salt': 'a'})
+
+        self.assertEqual(self.cache.get('alice'), {'salt': 'a'})
+        self.assertIsNone(self.cache.get('bob'))
+
+    def test_forget_user(self):
+        self.cache.put('alice', 'alice-handle', {'salt': 'a'})
+        self.cache.put('bob', 'bob-handle', {'salt': 'b'})
+
+        self.cache.forget_user('alice-handle')
+
+        self.assertIsNone(self.cache.get('alice'))
+        self.assertEqual(self.cache.get('bob'), {'salt': 'b'})
+
+    def test_expire(self):
+        cache = CredentialCache(ttl=0)
+        cache.put('alice', 'alice-handle', {'salt': 'a'})
+
+        self.assertIsNone(cache.get('alice'))
+
+    def test_bounded(self):
+        self.cache.put('alice', 'alice-handle', {})
+        self.cache.put('bob', 'bob-handle', {})
+        self.cache.put('carol', 'carol-handle', {})
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get('alice'))
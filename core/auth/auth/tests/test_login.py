@@ -0,0 +1,98 @@
+from autobahn.wamp.exception import ApplicationError
+from mock import MagicMock
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from auth.application import AuthComponent
+from auth.identity_cache import CredentialCache
+from auth.user_repository import UserRepository
+from mdstudio.deferred.limiter import ConcurrencyLimiter
+
+
+class TestLogin(unittest.TestCase):
+    def setUp(self):
+        self.lookups = {}
+
+        def find_user(authid, with_authentication=False):
+            d = self.lookups[authid] = defer.Deferred()
+            return d
+
+        self.component = AuthComponent.__new__(AuthComponent)
+        self.component.log = MagicMock()
+        self.component.credential_cache = CredentialCache()
+        self.component.login_limiter = ConcurrencyLimiter(1, max_queue=1, clock=Clock())
+        self.component.max_logins_per_authid = 2
+        self.component._login_lookups = {}
+        self.component.user_repository = MagicMock()
+        self.component.user_repository.find_user.side_effect = find_user
+
+    def _user(self, authid):
+        return UserRepository.Users.Instance.from_dict({
+            'username': authid,
+            'handle': '{}-handle'.format(authid),
+            'authentication': {
+                'storedKey': 'stored',
+                'serverKey': 'server',
+                'salt': 'salt'
+            }
+        })
+
+    def test_login(self):
+        d = self.component.user_login('mdstudio', 'alice', {})
+        self.lookups['alice'].callback(self._user('alice'))
+
+        self.assertEqual(self.successResultOf(d), {
+            'stored-key': 'stored',
+            'server-key': 'server',
+            'salt': 'salt',
+            'role': 'user'
+        })
+
+    def test_login_cached(self):
+        d = self.component.user_login('mdstudio', 'alice', {})
+        self.lookups['alice'].callback(self._user('alice'))
+        first = self.successResultOf(d)
+
+        second = self.successResultOf(self.component.user_login('mdstudio', 'alice', {}))
+
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.component.user_repository.find_user.call_count, 1)
+
+    def test_login_unknown(self):
+        d = self.component.user_login('mdstudio', 'alice', {})
+        self.lookups['alice'].callback(None)
+
+        self.failureResultOf(d, ApplicationError)
+        self.assertEqual(len(self.component.credential_cache), 0)
+
+    def test_login_coalesced(self):
+        first = self.component.user_login('mdstudio', 'alice', {})
+        second = self.component.user_login('mdstudio', 'alice', {})
+        self.lookups['alice'].callback(self._user('alice'))
+
+        self.assertEqual(self.successResultOf(first), self.successResultOf(second))
+        self.assertEqual(self.component.user_repository.find_user.call_count, 1)
+
+    def test_login_per_authid_limit(self):
+        self.component.user_login('mdstudio', 'alice', {})
+        self.component.user_login('mdstudio', 'alice', {})
+        self.component.user_login('mdstudio', 'alice', {})
+
+        self.failureResultOf(self.component.user_login('mdstudio', 'alice', {}), ApplicationError)
+
+    def test_login_global_limit(self):
+        alice = self.component.user_login('mdstudio', 'alice', {})
+        bob = self.component.user_login('mdstudio', 'bob', {})
+        carol = self.component.user_login('mdstudio', 'carol', {})
+
+        self.failureResultOf(carol, ApplicationError)
+        self.assertNotIn('bob', self.lookups)
+
+        self.lookups['alice'].callback(self._user('alice'))
+        self.lookups['bob'].callback(self._user('bob'))
+
+        self.successResultOf(alice)
+        self.successResultOf(bob)
+        self.assertEqual(self.component._login_lookups, {})
@@ -0,0 +1,293 @@
+from mock import mock
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from auth.permission_index import PermissionIndex
+from auth.user_repository import UserRepository
+from mdstudio.db.impl.mongo_client_wrapper import MongoClientWrapper
+from mdstudio.deferred.chainable import test_chainable
+from mdstudio.unittest.db import DBTestCase
+
+
+def make_group(name, roles, components):
+    return {
+        'groupName': name,
+        'handle': name,
+        'roles': roles,
+        'members': [],
+        'components': [{'componentName': c} for c in components]
+    }
+
+
+def make_role(name, members, component_permissions):
+    return {
+        'roleName': name,
+        'handle': name,
+        'members': [{'handle': m} for m in members],
+        'permissions': {
+            'componentPermissions': component_permissions
+        }
+    }
+
+
+class TestPermissionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = PermissionIndex(max_groups=2)
+        self.index.index_group('group', make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}}),
+            make_role('reader', ['bob'], {'comp': {'fullNamespace': False, 'namespace': ['call']}}),
+            make_role('writer', ['bob', 'carol'], {'comp': {'fullNamespace': False, 'endpoints': {'db/write': ['call']}},
+                                                   'other': {'fullNamespace': True}})
+        ], ['comp']))
+
+    def test_full_namespace(self):
+        self.assertTrue(self.index.check('alice', 'group', 'comp', 'anything', 'register'))
+
+    def test_namespace(self):
+        self.assertTrue(self.index.check('bob', 'group', 'comp', 'anything', 'call'))
+        self.assertFalse(self.index.check('bob', 'group', 'comp', 'anything', 'register'))
+
+    def test_endpoint(self):
+        self.assertTrue(self.index.check('carol', 'group', 'comp', 'db.write', 'call'))
+        self.assertFalse(self.index.check('carol', 'group', 'comp', 'db.read', 'call'))
+
+    def test_role(self):
+        self.assertTrue(self.index.check('bob', 'group', 'comp', 'anything', 'call', 'reader'))
+        self.assertFalse(self.index.check('bob', 'group', 'comp', 'anything', 'call', 'writer'))
+        self.assertFalse(self.index.check('bob', 'group', 'comp', 'anything', 'call', 'owner'))
+
+    def test_unregistered_component(self):
+        self.assertFalse(self.index.check('carol', 'group', 'other', 'anything', 'call'))
+
+    def test_unknown_user(self):
+        self.assertFalse(self.index.check('dave', 'group', 'comp', 'anything', 'call'))
+
+    def test_missing_group(self):
+        self.index.index_group('missing', None)
+
+        self.assertIn('missing', self.index)
+        self.assertFalse(self.index.check('alice', 'missing', 'comp', 'anything', 'call'))
+
+    def test_bounded(self):
+        self.index.index_group('group2', None)
+        self.index.index_group('group3', None)
+
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn('group', self.index)
+
+    def test_forget_group(self):
+        self.index.forget_group('group')
+        self.index.forget_group('group')
+
+        self.assertNotIn('group', self.index)
+
+
+class TestUserRepositoryPermissionIndex(DBTestCase):
+    def setUp(self):
+        self.db = MongoClientWrapper("localhost", 27127).get_database('users~auth')
+        self.index = PermissionIndex()
+        self.rep = UserRepository(self.db, self.index)
+
+        if not reactor.getThreadPool().started:
+            reactor.getThreadPool().start()
+
+    @test_chainable
+    def test_load_permissions(self):
+        yield self.rep.groups.insert_one(make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}})
+        ], ['comp']))
+
+        groups = yield self.rep.load_permissions()
+
+        self.assertEqual(groups, 1)
+        self.assertIn('group', self.index)
+
+    @test_chainable
+    def test_check_permission_loads_group(self):
+        yield self.rep.groups.insert_one(make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}})
+        ], ['comp']))
+
+        self.assertNotIn('group', self.index)
+        self.assertTrue((yield self.rep.check_permission('alice', 'group', 'comp', 'endpoint', 'call', user_handle='alice')))
+        self.assertIn('group', self.index)
+        self.assertFalse((yield self.rep.check_permission('bob', 'group', 'comp', 'endpoint', 'call', user_handle='bob')))
+
+    @test_chainable
+    def test_check_permission_missing_group(self):
+        self.assertFalse((yield self.rep.check_permission('alice', 'group', 'comp', 'endpoint', 'call', user_handle='alice')))
+        self.assertIn('group', self.index)
+
+    @test_chainable
+    def test_update_permissions(self):
+        yield self.rep.groups.insert_one(make_group('group', [], ['comp']))
+        yield self.rep.load_permissions()
+
+        self.assertFalse(self.index.check('alice', 'group', 'comp', 'endpoint', 'call'))
+
+        yield self.rep.groups.update_one({'groupName': 'group'}, {'$push': {
+            'roles': make_role('owner', ['alice'], {'comp': {'fullNamespace': True}})
+        }})
+        yield self.rep._update_permissions('group')
+
+        self.assertTrue(self.index.check('alice', 'group', 'comp', 'endpoint', 'call'))
+
+
+class TestUserRepositoryPermissions(DBTestCase):
+    def setUp(self):
+        self.db = MongoClientWrapper("localhost", 27127).get_database('users~auth')
+        self.rep = UserRepository(self.db)
+
+        if not reactor.getThreadPool().started:
+            reactor.getThreadPool().start()
+
+    def test_permission_documents(self):
+        group = make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}}),
+            make_role('writer', ['bob'], {'comp': {'fullNamespace': False, 'namespace': ['call'],
+                                                   'endpoints': {'db/write': ['call']}},
+                                          'other': {'fullNamespace': True}})
+        ], ['comp'])
+        group['members'] = [{'handle': 'alice'}, {'handle': 'bob'}]
+
+        documents = self.rep._permission_documents('group', group)
+        keys = sorted((d['userHandle'], d['role'] or '', d['component'] or '') for d in documents)
+
+        self.assertEqual(keys, [('alice', '', ''), ('alice', 'owner', ''), ('alice', 'owner', 'comp'),
+                                ('bob', '', ''), ('bob', 'writer', ''), ('bob', 'writer', 'comp')])
+
+        writer = next(d for d in documents if d['role'] == 'writer' and d['component'] == 'comp')
+        self.assertEqual(writer['actions'], ['call'])
+        self.assertEqual(writer['endpoints'], [{'uri': 'db/write', 'actions': ['call']}])
+        self.assertFalse(writer['fullNamespace'])
+
+    def test_permission_documents_missing_group(self):
+        self.assertEqual(self.rep._permission_documents('group', None), [])
+
+    @test_chainable
+    def test_check_permission(self):
+        group = make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}}),
+            make_role('reader', ['bob'], {'comp': {'fullNamespace': False, 'namespace': ['call']}}),
+            make_role('writer', ['carol'], {'comp': {'fullNamespace': False, 'endpoints': {'db/write': ['*']}}})
+        ], ['comp'])
+        yield self.rep.groups.insert_one(group)
+        yield self.rep.load_permissions()
+
+        self.assertTrue((yield self.rep.check_permission('alice', 'group', 'comp', 'anything', 'register', user_handle='alice')))
+        self.assertTrue((yield self.rep.check_permission('bob', 'group', 'comp', 'anything', 'call', user_handle='bob')))
+        self.assertFalse((yield self.rep.check_permission('bob', 'group', 'comp', 'anything', 'register', user_handle='bob')))
+        self.assertTrue((yield self.rep.check_permission('carol', 'group', 'comp', 'db.write', 'call', user_handle='carol')))
+        self.assertFalse((yield self.rep.check_permission('carol', 'group', 'comp', 'db.read', 'call', user_handle='carol')))
+        self.assertFalse((yield self.rep.check_permission('bob', 'group', 'comp', 'anything', 'call', 'owner', user_handle='bob')))
+        self.assertFalse((yield self.rep.check_permission('alice', 'group', 'other', 'anything', 'call', user_handle='alice')))
+
+    @test_chainable
+    def test_check_membership(self):
+        yield self.rep.users.insert_one({'username': 'alice', 'handle': 'alice'})
+        group = make_group('group', [make_role('owner', ['alice'], {})], [])
+        group['members'] = [{'handle': 'alice'}]
+        yield self.rep.groups.insert_one(group)
+        yield self.rep.load_permissions()
+
+        self.assertTrue((yield self.rep.check_membership('alice', 'group')))
+        self.assertTrue((yield self.rep.check_membership('alice', 'group', 'owner')))
+        self.assertFalse((yield self.rep.check_membership('alice', 'group', 'reader')))
+        self.assertFalse((yield self.rep.check_membership('alice', 'other')))
+
+    @test_chainable
+    def test_update_permissions(self):
+        yield self.rep.groups.insert_one(make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}})
+        ], ['comp']))
+        yield self.rep.load_permissions()
+
+        self.assertTrue((yield self.rep.check_permission('alice', 'group', 'comp', 'endpoint', 'call', user_handle='alice')))
+
+        yield self.rep.groups.update_one({'groupName': 'group'}, {'$set': {'roles': [
+            make_role('owner', ['bob'], {'comp': {'fullNamespace': True}})
+        ]}})
+        yield self.rep._update_permissions('group')
+
+        self.assertFalse((yield self.rep.check_permission('alice', 'group', 'comp', 'endpoint', 'call', user_handle='alice')))
+        self.assertTrue((yield self.rep.check_permission('bob', 'group', 'comp', 'endpoint', 'call', user_handle='bob')))
+        self.assertEqual((yield self.rep.permissions.count({'group': 'group'})), 2)
+
+    @test_chainable
+    def test_store_permissions(self):
+        group = make_group('group', [
+            make_role('owner', ['alice', 'bob'], {'comp': {'fullNamespace': True}})
+        ], ['comp'])
+        group['permissionRevision'] = 1
+
+        with mock.patch.object(UserRepository.Permissions, 'replace_many', autospec=True,
+                               side_effect=UserRepository.Permissions.replace_many) as replace_many:
+            yield self.rep._store_permissions('group', group)
+            self.assertEqual(replace_many.call_count, 0)
+
+            yield self.rep._store_permissions('group', group)
+            self.assertEqual(replace_many.call_count, 1)
+
+        self.assertEqual((yield self.rep.permissions.count({'group': 'group'})), 4)
+
+        group['roles'][0]['members'] = [{'handle': 'bob'}]
+        group['permissionRevision'] = 2
+        yield self.rep._store_permissions('group', group)
+
+        documents = yield self.rep.permissions.find_many({'group': 'group'}, {'_id': False}).to_list()
+        self.assertEqual(sorted(d['userHandle'] for d in documents), ['bob', 'bob'])
+        self.assertEqual(set(d['revision'] for d in documents), {2})
+
+    @test_chainable
+    def test_store_permissions_stale(self):
+        newer = make_group('group', [
+            make_role('owner', ['alice', 'bob'], {'comp': {'fullNamespace': True}})
+        ], ['comp'])
+        newer['permissionRevision'] = 2
+        stale = make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': False}})
+        ], ['comp'])
+        stale['permissionRevision'] = 1
+
+        yield self.rep._store_permissions('group', newer)
+        yield self.rep._store_permissions('group', stale)
+
+        documents = yield self.rep.permissions.find_many({'group': 'group'}, {'_id': False}).to_list()
+        self.assertEqual(sorted(d['userHandle'] for d in documents), ['alice', 'alice', 'bob', 'bob'])
+        self.assertEqual(set(d['revision'] for d in documents), {2})
+        self.assertTrue(all(d['fullNamespace'] for d in documents if d['component'] == 'comp'))
+
+    @test_chainable
+    def test_store_permissions_unrevised(self):
+        group = make_group('group', [make_role('owner', ['alice'], {'comp': {'fullNamespace': True}})], ['comp'])
+        yield self.rep._store_permissions('group', group)
+
+        group['roles'][0]['members'] = [{'handle': 'bob'}]
+        group['permissionRevision'] = 1
+        yield self.rep._store_permissions('group', group)
+
+        documents = yield self.rep.permissions.find_many({'group': 'group'}, {'_id': False}).to_list()
+        self.assertEqual(sorted(d['userHandle'] for d in documents), ['bob', 'bob'])
+
+    @test_chainable
+    def test_update_permissions_serialized(self):
+        yield self.rep.groups.insert_one(make_group('group', [
+            make_role('owner', ['alice'], {'comp': {'fullNamespace': True}})
+        ], ['comp']))
+
+        first = self.rep._update_permissions('group')
+        second = self.rep._update_permissions('group')
+        yield first
+        yield second
+
+        documents = yield self.rep.permissions.find_many({'group': 'group'}, {'_id': False}).to_list()
+        self.assertEqual(set(d['revision'] for d in documents), {2})
+        self.assertEqual((yield self.rep.groups.find_one({'groupName': 'group'}))['permissionRevision'], 2)
+        self.assertEqual(self.rep._permission_locks, {})
+
+    @test_chainable
+    def test_store_permissions_missing_group(self):
+        yield self.rep._store_permissions('group', make_group('group', [make_role('owner', ['alice'], {})], []))
+        yield self.rep._store_permissions('group', None)
+
+        self.assertEqual((yield self.rep.permissions.count({'group': 'group'})), 0)
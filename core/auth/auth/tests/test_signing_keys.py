@@ -0,0 +1,141 @@
+from jwt import encode as jwt_encode, decode as jwt_decode
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from auth.signing_keys import SigningKey, SigningKeyRing
+from mdstudio.db.impl.mongo_client_wrapper import MongoClientWrapper
+from mdstudio.deferred.chainable import test_chainable
+from mdstudio.unittest.db import DBTestCase
+from mdstudio.util.exception import MDStudioException
+
+
+class Clock(object):
+    def __init__(self, time=0):
+        self.time = time
+
+    def __call__(self):
+        return self.time
+
+
+class TestSigningKey(unittest.TestCase):
+    def test_to_dict(self):
+        key = SigningKey.generate(3)
+        loaded = SigningKey.from_dict(key.to_dict())
+
+        self.assertEqual(loaded.kid, key.kid)
+        self.assertEqual(loaded.generation, 3)
+        self.assertEqual(loaded.public_pem(), key.public_pem())
+
+    def test_sign(self):
+        key = SigningKey.generate()
+        token = jwt_encode({'username': 'test'}, key.private_key, algorithm=key.algorithm)
+
+        self.assertEqual(jwt_decode(token, key.public_key, algorithms=[key.algorithm]), {'username': 'test'})
+
+    def test_from_dict_without_key(self):
+        self.assertRaises(MDStudioException, SigningKey.from_dict, {'kid': 'test'})
+
+
+class TestSigningKeyRing(unittest.TestCase):
+    def test_configure(self):
+        first = SigningKey.generate().to_dict()
+        second = SigningKey.generate().to_dict()
+
+        ring = SigningKeyRing()
+        ring.configure([first, second])
+
+        self.assertTrue(ring.static)
+        self.assertEqual(ring.active.kid, first['kid'])
+        self.assertEqual(set(k['kid'] for k in ring.published()), {first['kid'], second['kid']})
+
+    def test_configure_empty(self):
+        self.assertRaises(MDStudioException, SigningKeyRing().configure, [])
+
+    def test_generate(self):
+        ring = SigningKeyRing()
+        ring.generate()
+
+        self.assertFalse(ring.static)
+        self.assertEqual(ring.published(), [{
+            'kid': ring.active.kid,
+            'key': ring.active.public_pem(),
+            'algorithm': 'RS256'
+        }])
+
+    def test_generation(self):
+        clock = Clock(250)
+        ring = SigningKeyRing(rotation_interval=100, clock=clock)
+
+        self.assertEqual(ring.generation(), 2)
+
+
+class TestSigningKeyRingDatabase(DBTestCase):
+    def setUp(self):
+        self.db = MongoClientWrapper("localhost", 27127).get_database('users~auth')
+        self.clock = Clock(1000)
+        self.ring = SigningKeyRing(self.db, rotation_interval=100, retention=10, clock=self.clock)
+
+        if not reactor.getThreadPool().started:
+            reactor.getThreadPool().start()
+
+    @test_chainable
+    def test_refresh(self):
+        self.ring.generate()
+        boot_key = self.ring.active
+
+        active = yield self.ring.refresh()
+
+        self.assertIsNot(active, boot_key)
+        self.assertEqual(active.generation, 10)
+        # The boot key, the current key and the next one
+        self.assertEqual(len(self.ring.keys), 3)
+        self.assertEqual(boot_key.expires, 1010)
+
+    @test_chainable
+    def test_refresh_shared(self):
+        other = SigningKeyRing(self.db, rotation_interval=100, retention=10, clock=self.clock)
+
+        active = yield self.ring.refresh()
+        other_active = yield other.refresh()
+
+        self.assertEqual(active.kid, other_active.kid)
+        self.assertEqual(set(self.ring.keys.keys()), set(other.keys.keys()))
+
+    @test_chainable
+    def test_rotate(self):
+        first = yield self.ring.refresh()
+
+        self.clock.time = 1100
+        second = yield self.ring.refresh()
+
+        self.assertEqual(second.generation, 11)
+        self.assertIn(first.kid, self.ring.keys)
+
+        self.clock.time = 1111
+        yield self.ring.refresh()
+
+        self.assertNotIn(first.kid, self.ring.keys)
+        self.assertIn(second.kid, self.ring.keys)
+
+    @test_chainable
+    def test_get_unknown(self):
+        other = SigningKeyRing(self.db, rotation_interval=100, retention=10, clock=self.clock)
+        yield self.ring.refresh()
+
+        # Another instance rotated to the next key first
+        self.clock.time = 1100
+        rotated = yield other.refresh()
+
+        key = yield self.ring.get(rotated.kid)
+        self.assertEqual(key.kid, rotated.kid)
+
+    @test_chainable
+    def test_get_throttled(self):
+        yield self.ring.refresh()
+        key = SigningKeyRing(self.db, rotation_interval=100, retention=10, clock=Clock(5000))
+        rotated = yield key.refresh()
+
+        self.assertIsNone((yield self.ring.get(rotated.kid)))
+
+        self.clock.time = 1005
+        self.assertIsNotNone((yield self.ring.get(rotated.kid)))
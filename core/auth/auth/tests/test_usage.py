@@ -0,0 +1,137 @@
+from mock import mock
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
+from auth.usage import UsageStatistics
+from mdstudio.db.impl.mongo_client_wrapper import MongoClientWrapper
+from mdstudio.deferred.chainable import test_chainable
+from mdstudio.unittest.db import DBTestCase
+
+
+class TestUsageStatistics(DBTestCase):
+    def setUp(self):
+        self.db = MongoClientWrapper("localhost", 27127).get_database('users~auth')
+        self.usage = UsageStatistics(self.db, max_uris=2)
+
+        if not reactor.getThreadPool().started:
+            reactor.getThreadPool().start()
+
+    def test_record(self):
+        self.usage.record('mdstudio.db.endpoint.find_one', 'call', {}, 0.5)
+        self.usage.record('mdstudio.db.endpoint.find_one', 'call', {}, 0.25)
+        self.usage.record('mdstudio.db.endpoint.find_one', 'register', {'match': 'prefix'})
+
+        entry = self.usage.pending['mdstudio.db.endpoint.find_one']
+        self.assertEqual(entry['$inc'], {
+            'callCount': 2,
+            'registrationCount': 1,
+            'authorizationCount': 2,
+            'authorizationTime': 0.75
+        })
+        self.assertEqual(entry['$set']['match'], 'prefix')
+        self.assertIn('latestCall', entry['$set'])
+        self.assertIn('latestRegistration', entry['$set'])
+        self.assertIn('firstSeen', entry['$setOnInsert'])
+
+    def test_record_bounded(self):
+        self.usage.record('a', 'call')
+        self.usage.record('b', 'call')
+        self.usage.record('c', 'call')
+        self.usage.record('a', 'call')
+
+        self.assertEqual(set(self.usage.pending.keys()), {'a', 'b'})
+        self.assertEqual(self.usage.dropped, 1)
+
+    @test_chainable
+    def test_flush(self):
+        self.usage.record('mdstudio.db.endpoint.find_one', 'call', {}, 0.5)
+        self.usage.record('mdstudio.schema.endpoint.get', 'subscribe')
+
+        flushed = yield self.usage.flush()
+        self.assertEqual(flushed, 2)
+        self.assertEqual(self.usage.pending, {})
+
+        self.usage.record('mdstudio.db.endpoint.find_one', 'call', {}, 0.25)
+        yield self.usage.flush()
+
+        usage = yield self.usage.find('mdstudio.db.')
+        self.assertEqual(len(usage), 1)
+        self.assertEqual(usage[0]['uri'], 'mdstudio.db.endpoint.find_one')
+        self.assertEqual(usage[0]['callCount'], 2)
+        self.assertEqual(usage[0]['authorizationCount'], 2)
+        self.assertAlmostEqual(usage[0]['authorizationTime'], 0.75)
+
+        usage = yield self.usage.find()
+        self.assertEqual(len(usage), 2)
+
+    def test_flush_failed(self):
+        self.usage.record('a', 'call', {}, 0.5)
+        self.usage.record('b', 'call')
+        pending = {}
+
+        def update_one(usage, filter, *args, **kwargs):
+            pending[filter['uri']] = Deferred()
+            return pending[filter['uri']]
+
+        with mock.patch.object(UsageStatistics.Usage, 'update_one', autospec=True, side_effect=update_one):
+            flushed = self.usage.flush()
+
+            # Recorded while the flush is running
+            self.usage.record('a', 'call', {}, 0.25)
+
+            pending['a'].errback(Exception('offline'))
+            pending['b'].callback(None)
+
+        self.assertEqual(self.successResultOf(flushed), 1)
+        self.assertEqual(list(self.usage.pending.keys()), ['a'])
+        self.assertEqual(self.usage.pending['a']['$inc'], {'callCount': 2, 'authorizationCount': 2, 'authorizationTime': 0.75})
+
+    def test_flush_failed_bounded(self):
+        self.usage.record('a', 'call')
+        self.usage.record('b', 'call')
+        pending = {}
+
+        def update_one(usage, filter, *args, **kwargs):
+            pending[filter['uri']] = Deferred()
+            return pending[filter['uri']]
+
+        with mock.patch.object(UsageStatistics.Usage, 'update_one', autospec=True, side_effect=update_one):
+            flushed = self.usage.flush()
+
+            self.usage.record('c', 'call')
+            self.usage.record('d', 'call')
+
+            pending['a'].errback(Exception('offline'))
+            pending['b'].callback(None)
+
+        self.assertEqual(self.successResultOf(flushed), 1)
+        self.assertEqual(set(self.usage.pending.keys()), {'c', 'd'})
+        self.assertEqual(self.usage.dropped, 1)
+
+    def test_flush_window(self):
+        self.usage = UsageStatistics(self.db, max_uris=3, flush_window=2)
+        pending = []
+
+        def update_one(*args, **kwargs):
+            pending.append(Deferred())
+            return pending[-1]
+
+        for uri in ['a', 'b', 'c']:
+            self.usage.record(uri, 'call')
+
+        with mock.patch.object(UsageStatistics.Usage, 'update_one', autospec=True, side_effect=update_one):
+            flushed = self.usage.flush()
+
+            self.assertEqual(len(pending), 2)
+            pending[0].callback(None)
+            self.assertEqual(len(pending), 3)
+            pending[1].callback(None)
+            pending[2].callback(None)
+
+        self.assertEqual(self.successResultOf(flushed), 3)
+
+    @test_chainable
+    def test_flush_empty(self):
+        flushed = yield self.usage.flush()
+
+        self.assertEqual(flushed, 0)
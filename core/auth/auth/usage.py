@@ -0,0 +1,137 @@
+import re
+
+from twisted.internet.defer import DeferredList
+
+from mdstudio.db.connection_type import ConnectionType
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.limiter import ConcurrencyLimiter
+from mdstudio.deferred.return_value import return_value
+from mdstudio.logging.logger import Logger
+from mdstudio.service.model import Model
+from mdstudio.utc import now
+
+
+class UsageStatistics(object):
+    """
+    Counts the registrations, subscriptions, publications and calls per uri that pass the authorizers, together with
+    the time spent authorizing them. The counters are kept in memory and added to the usage collection on every flush,
+    so recording an authorization costs no database round trip. A flush has at most `flush_window` upserts in flight,
+    and the counters of the upserts that failed are kept for the next flush.
+    """
+    log = Logger()
+
+    class Usage(Model):
+        connection_type = ConnectionType.User
+        date_time_fields = ['firstSeen', 'latestCall', 'latestRegistration', 'latestSubscription', 'latestPublication']
+
+    counters = {
+        'call': 'callCount',
+        'register': 'registrationCount',
+        'subscribe': 'subscriptionCount',
+        'publish': 'publicationCount'
+    }
+
+    latest = {
+        'call': 'latestCall',
+        'register': 'latestRegistration',
+        'subscribe': 'latestSubscription',
+        'publish': 'latestPublication'
+    }
+
+    def __init__(self, db_wrapper, max_uris=10000, flush_window=8):
+        self.wrapper = db_wrapper
+        self.max_uris = max_uris
+        self.flush_window = flush_window
+        self.pending = {}
+        self.dropped = 0
+
+    @property
+    def usage(self):
+        return self.Usage(self.wrapper)
+
+    def record(self, uri, action, options=None, seconds=None):
+        entry = self.pending.get(uri)
+
+        if entry is None:
+            if len(self.pending) >= self.max_uris:
+                self.dropped += 1
+                return
+
+            entry = self.pending[uri] = {'$inc': {}, '$set': {}}
+
+        time = now()
+        counts = entry['$inc']
+        counter = self.counters.get(action, '{}Count'.format(action))
+        counts[counter] = counts.get(counter, 0) + 1
+        entry['$set'][self.latest.get(action, 'latest{}'.format(action.title()))] = time
+        entry.setdefault('$setOnInsert', {'firstSeen': time})
+
+        if action == 'register':
+            entry['$set']['match'] = (options or {}).get('match', 'exact')
+
+        if seconds is not None:
+            counts['authorizationCount'] = counts.get('authorizationCount', 0) + 1
+            counts['authorizationTime'] = counts.get('authorizationTime', 0.0) + seconds
+
+    @chainable
+    def flush(self):
+        """
+        Add the pending counters to the usage collection, with one upsert per uri that was used since the last flush.
+        """
+        pending, self.pending = self.pending, {}
+
+        if self.dropped:
+            self.log.warn('Did not count the usage of {dropped} authorizations, as too many uris were used', dropped=self.dropped)
+            self.dropped = 0
+
+        if not pending:
+            return_value(0)
+
+        usage = self.usage
+        limiter = ConcurrencyLimiter(self.flush_window, max_queue=len(pending))
+        results = yield DeferredList([limiter.run(usage.update_one, {'uri': uri}, update, upsert=True)
+                                      for uri, update in pending.items()], consumeErrors=True)
+
+        failures = []
+        for (uri, update), (success, result) in zip(pending.items(), results):
+            if not success:
+                failures.append(result)
+                self._restore(uri, update)
+
+        if failures:
+            self.log.warn('Could not store the usage of {count} uris, retrying with the next flush: {message}',
+                          count=len(failures), message=failures[0].getErrorMessage())
+
+        return_value(len(pending) - len(failures))
+
+    def _restore(self, uri, update):
+        """
+        Merge the counters of a failed upsert with those recorded since, or drop them when too many uris are pending.
+        """
+        entry = self.pending.get(uri)
+
+        if entry is None:
+            if len(self.pending) >= self.max_uris:
+                self.dropped += sum(update['$inc'].get(counter, 0) for counter in self.counters.values())
+                return
+
+            self.pending[uri] = update
+            return
+
+        for counter, count in update['$inc'].items():
+            entry['$inc'][counter] = entry['$inc'].get(counter, 0) + count
+
+        # The latest times recorded since are newer, while the first time seen is the one of the failed upsert
+        for field, value in update['$set'].items():
+            entry['$set'].setdefault(field, value)
+        entry['$setOnInsert'] = update['$setOnInsert']
+
+    @chainable
+    def find(self, prefix=None):
+        usage_filter = {}
+        if prefix:
+            usage_filter['uri'] = {'$regex': '^{}'.format(re.escape(prefix))}
+
+        usage = yield self.usage.find_many(usage_filter, {'_id': False}).to_list()
+
+        return_value(usage)
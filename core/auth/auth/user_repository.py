@@ -1,13 +1,19 @@
-import itertools
-
+import json
 import os
 import pytz
 from copy import deepcopy
 from enum import Enum
 
+from twisted.internet.defer import DeferredLock
+from typing import Optional
+
+from auth.identity_cache import SessionIdentityCache, CredentialCache
+from auth.permission_index import PermissionIndex, component_permissions
 from mdstudio.collection import dict_property, dict_array_property
 from mdstudio.db.connection_type import ConnectionType
 from mdstudio.db.fields import timestamp_properties, Fields
+from mdstudio.db.index import Index
+from mdstudio.db.sort_mode import SortMode
 from mdstudio.deferred.chainable import chainable
 from mdstudio.deferred.return_value import return_value
 from mdstudio.service.model import Model
@@ -224,8 +230,27 @@ class UserRepository(object):
             members = dict_array_property('members', Member.from_dict)
             components = dict_array_property('components', Component.from_dict)
 
-    def __init__(self, db_wrapper):
+    class Permissions(Model):
+        """
+        Flat copy of the groups collection for authorization queries, with one document per (user handle, group, role,
+        component). Membership documents have no component, and the group membership itself also has no role. The
+        `key` of a document is derived from its user handle, role and component, and its `revision` is the permission
+        revision of the group snapshot it was written from.
+        """
+        connection_type = ConnectionType.User
+
+        indexes = [
+            Index(keys=[('group', SortMode.Asc), ('userHandle', SortMode.Asc), ('component', SortMode.Asc),
+                        ('role', SortMode.Asc)], unique=True, name='permission'),
+            Index(keys=[('group', SortMode.Asc), ('key', SortMode.Asc)], unique=True, name='permission_key')
+        ]
+
+    def __init__(self, db_wrapper, permission_index=None, identity_cache=None, credential_cache=None):
         self.wrapper = db_wrapper
+        self.permission_index = permission_index  # type: Optional[PermissionIndex]
+        self.identity_cache = identity_cache  # type: Optional[SessionIdentityCache]
+        self.credential_cache = credential_cache  # type: Optional[CredentialCache]
+        self._permission_locks = {}
 
     @property
     def users(self):
@@ -286,11 +311,15 @@ class UserRepository(object):
 
         update_user['updatedAt'] = now()
 
-        return_value((yield self.users.update_one({'handle': handle}, update_user).modified) == 1)
+        modified = yield self.users.update_one({'handle': handle}, update_user).modified
+        self._forget_identity(handle)
+
+        return_value(modified == 1)
 
     @chainable
     def deactivate_user(self, handle):
-        modified = self.users.update_one({'handle': handle}, {'deletedAt': now()}).modified
+        modified = yield self.users.update_one({'handle': handle}, {'deletedAt': now()}).modified
+        self._forget_identity(handle)
 
         return_value(modified == 1)
 
@@ -298,6 +327,12 @@ class UserRepository(object):
     def check_user_password(self, username, password):
         return_value((yield self.find_user(username=username).password) == password)
 
+    def _forget_identity(self, handle):
+        if self.identity_cache is not None:
+            self.identity_cache.forget_user(handle)
+        if self.credential_cache is not None:
+            self.credential_cache.forget_user(handle)
+
     @staticmethod
     def _add_to_request(request, accepted_parameters, **kwargs):
         for p in accepted_parameters:
@@ -337,6 +372,8 @@ class UserRepository(object):
             '$setOnInsert': group
         }, upsert=True, projection={'_id': False}, return_updated=True)
 
+        yield self._update_permissions(group_name)
+
         return_value(_Group.from_dict(group) if group == inserted else None)
 
     @chainable
@@ -349,87 +386,45 @@ class UserRepository(object):
     def check_membership(self, username, group_name, group_role=None):
         user_handle = yield self.find_user(username).handle
 
-        group_filter = {
-            'groupName': group_name,
-            'members': {
-                '$elemMatch': {
-                    'handle': user_handle
-                }
-            }
-        }
+        membership = yield self.permissions.find_one({
+            'group': group_name,
+            'userHandle': user_handle,
+            'component': None,
+            'role': group_role
+        }, {'_id': True})
 
-        if group_role is not None:
-            group_filter['roles'] = {
-                '$elemMatch': {
-                    'roleName': group_role,
-                    'members': {
-                        '$elemMatch': user_handle
-                    }
-                }
-            }
+        return_value(membership is not None)
 
-        group = yield self.groups.find_one(group_filter)
+    @chainable
+    def check_permission(self, username, group_name, component, uri, action, role_name=None, user_handle=None):
+        if user_handle is None:
+            user_handle = yield self.find_user(username).handle
 
-        return_value(group is not None)
+        if self.permission_index is not None:
+            if group_name not in self.permission_index:
+                yield self._index_group(group_name)
 
-    @chainable
-    def check_permission(self, username, group_name, component, uri, action, role_name=None):
-        # @todo: check
-        user_handle = yield self.find_user(username).handle
+            return_value(self.permission_index.check(user_handle, group_name, component, uri, action, role_name))
 
-        roles_filter = {
-            'groupName': group_name,
-            'members': {
-                '$elemMatch': {
-                    'handle': user_handle
-                }
-            },
-            'roles': {
-                '$elemMatch': {
-                    'members': {
-                        '$elemMatch': {
-                            'handle': user_handle
-                        }
-                    },
-                    'permissions.componentPermissions.{}'.format(component): {
-                        '$exists': True
-                    }
-                }
-            },
-            'components': {
-                '$elemMatch': {
-                    'componentName': component
-                }
-            }
+        permission_filter = {
+            'group': group_name,
+            'userHandle': user_handle,
+            'component': component,
+            '$or': [
+                {'fullNamespace': True},
+                {'actions': {'$in': [action, '*']}},
+                {'endpoints': {'$elemMatch': {'uri': uri.replace('.', '/'), 'actions': {'$in': [action, '*']}}}}
+            ]
         }
 
         if role_name:
-            roles_filter['roles']['$elemMatch']['roleName'] = role_name
-
-        _Group = UserRepository.Groups.Instance
+            permission_filter['role'] = role_name
 
+        # @todo: check if endpoint is in named scope
         # @todo: subgroups
-        group = yield self.groups.find_one(roles_filter, fields=self._group_permission_timestamps('componentPermissions', component))\
-                                 .transform(UserRepository.Groups.Instance.from_dict)  # type: _Group
-
-        permission = False
-
-        if not group:
-            return_value(False)
+        permission = yield self.permissions.find_one(permission_filter, {'_id': True})
 
-        for role in group.roles:  # type: _Group.Role
-            if component in role.permissions.component_permissions:
-                permissions = _Group.Role.Permissions.ComponentPermission.from_dict(role.permissions.component_permissions.get(component))
-
-                # @todo: check if endpoint is in named scope
-                if permissions.full_namespace:
-                    permission = True
-                elif any(v in permissions.namespace for v in itertools.chain(action, '*')):
-                    permission = True
-                elif any(v in permissions.endpoints.get(uri, []) for v in itertools.chain(action, '*')):
-                    permission = True
-
-        return_value(permission)
+        return_value(permission is not None)
 
     @chainable
     def create_group_role(self, group_name, role_name, owner_username, role_resources=None, group_resources=None):
@@ -468,6 +463,8 @@ class UserRepository(object):
 
         updated = yield self.groups.find_one_and_update(group_filter, group_update, projection={'roles': {'$elemMatch': {'handle': role_uuid}}}, return_updated=True).transform(self._extract_role)
 
+        yield self._update_permissions(group_name)
+
         return_value(_Group.Role.from_dict(updated) if updated is not None and updated['handle'] == role_uuid else None)
 
     @chainable
@@ -524,6 +521,9 @@ class UserRepository(object):
 
         updated = yield self.groups.update_one(group_filter, group_update).modified
 
+        if updated == 1:
+            yield self._update_permissions(group_name)
+
         return_value(updated == 1)
 
     @chainable
@@ -554,6 +554,9 @@ class UserRepository(object):
 
         updated = yield self.groups.update_one(group_filter, group_update).modified
 
+        if updated == 1:
+            yield self._update_permissions(group_name)
+
         return_value(updated == 1)
 
     @chainable
@@ -599,6 +602,9 @@ class UserRepository(object):
             }
         }, return_updated=True, fields=fields).transform(self._extract_group_component)
 
+        if updated:
+            yield self._update_permissions(group_name)
+
         return_value(_Group.Component.from_dict(updated) if updated else None)
 
     @chainable
@@ -687,6 +693,8 @@ class UserRepository(object):
 
             updated = yield self.groups.find_one_and_update(component_new_filter, role_update, projection=component_match_filter, return_updated=True, fields=fields).transform(self._extract_component_permission, permission_set, component_name)
 
+            yield self._update_permissions(group_name)
+
             return_value(updated is not None and updated['createdAt'] == created_at)
         else:
             if permission_type == PermissionType.ComponentNamespace:
@@ -700,6 +708,8 @@ class UserRepository(object):
 
                 updated = yield self.groups.find_one_and_update(component_match_filter, role_update, projection=component_match_filter, return_updated=True, fields=fields).transform(self._extract_component_permission, permission_set, component_name)
 
+                yield self._update_permissions(group_name)
+
                 return_value(updated is not None and updated['updatedAt'] == created_at)
             elif permission_type == PermissionType.FullAccess:
                 role_update = self._role_permission_update_times({
@@ -710,6 +720,8 @@ class UserRepository(object):
 
                 updated = yield self.groups.find_one_and_update(component_match_filter, role_update, projection=component_match_filter, return_updated=True, fields=fields).transform(self._extract_component_permission, permission_set, component_name)
 
+                yield self._update_permissions(group_name)
+
                 return_value(updated is not None and updated['updatedAt'] == created_at)
             elif permission_type == PermissionType.NamedScope or permission_type == PermissionType.SpecificEndpoint:
                 key = 'scopes' if permission_type == PermissionType.NamedScope else 'endpoints'
@@ -747,6 +759,8 @@ class UserRepository(object):
 
                 updated = yield self.groups.find_one_and_update(rule_filter, role_update, projection=rule_match_filter, return_updated=True, fields=fields).transform(self._extract_component_permission, permission_set, component_name)
 
+                yield self._update_permissions(group_name)
+
                 return_value(updated is not None and updated['updatedAt'] == created_at)
 
     @chainable
@@ -813,6 +827,130 @@ class UserRepository(object):
     def find_client(self, client_id):
         pass
 
+    """
+    Permissions
+    """
+
+    @chainable
+    def load_permissions(self):
+        """
+        Rebuild the permissions collection and the permission index from the groups collection, and return the number
+        of groups.
+        """
+        yield self.permissions.create_indexes(self.permissions.collection, self.Permissions.indexes)
+
+        groups = yield self.groups.find_many({}, {'_id': False, 'groupName': True}).to_list()
+
+        if self.permission_index is not None:
+            self.permission_index.clear()
+
+        # Each group is read again while its permissions are rewritten, so a mutation in the meantime is not undone
+        for group in groups:
+            yield self._update_permissions(group['groupName'], index=True)
+
+        return_value(len(groups))
+
+    @chainable
+    def _index_group(self, group_name):
+        group = yield self.groups.find_one({'groupName': group_name}, {'_id': False})
+        self.permission_index.index_group(group_name, group)
+
+    @chainable
+    def _update_permissions(self, group_name, index=False):
+        """
+        Rewrite the permissions of a group from its current document. The rewrites of a group are serialized in this
+        process, and every rewrite takes the next permission revision of the group together with its snapshot, so
+        the rewrites of other instances from older snapshots leave the newer documents alone.
+        """
+        lock = self._permission_locks.setdefault(group_name, DeferredLock())
+        yield lock.acquire()
+
+        try:
+            group = yield self.groups.find_one_and_update({'groupName': group_name}, {'$inc': {'permissionRevision': 1}},
+                                                          projection={'_id': False}, return_updated=True)
+
+            yield self._store_permissions(group_name, group)
+
+            # Groups that are not indexed are loaded on their first permission check
+            if self.permission_index is not None and (index or group_name in self.permission_index):
+                self.permission_index.index_group(group_name, group)
+        finally:
+            lock.release()
+            if not lock.locked and not lock.waiting:
+                self._permission_locks.pop(group_name, None)
+
+    @chainable
+    def _store_permissions(self, group_name, group, retry=True):
+        if group is None:
+            yield self.permissions.delete_many({'group': group_name})
+            return_value(None)
+
+        revision = group.get('permissionRevision', 0)
+        documents = self._permission_documents(group_name, group)
+        for document in documents:
+            document['revision'] = revision
+
+        # Documents without a revision predate the revisions, and are older than any snapshot
+        older = {'group': group_name, 'revision': {'$not': {'$gte': revision}}}
+
+        existing = yield self.permissions.find_many({'group': group_name}, {'_id': False, 'key': True}).to_list()
+        existing = set(d['key'] for d in existing)
+
+        replacements = [d for d in documents if d['key'] in existing]
+        if replacements:
+            yield self.permissions.replace_many([{
+                'filter': dict(older, key=document['key']),
+                'replacement': document
+            } for document in replacements])
+
+        insertions = [d for d in documents if d['key'] not in existing]
+        if insertions:
+            try:
+                yield self.permissions.insert_many(insertions)
+            except Exception:
+                # Another instance inserted some of the documents in the meantime, which are replaced when older
+                if not retry:
+                    raise
+                yield self._store_permissions(group_name, group, retry=False)
+                return_value(None)
+
+        yield self.permissions.delete_many(dict(older, key={'$nin': [d['key'] for d in documents]}))
+
+    @staticmethod
+    def _permission_documents(group_name, group):
+        documents = {}
+
+        def document(user_handle, role_name, component):
+            key = (user_handle, role_name, component)
+            if key not in documents:
+                documents[key] = {
+                    'group': group_name,
+                    'key': json.dumps(key),
+                    'userHandle': user_handle,
+                    'role': role_name,
+                    'component': component,
+                    'fullNamespace': False,
+                    'actions': [],
+                    'endpoints': []
+                }
+            return documents[key]
+
+        if group:
+            for member in group.get('members') or []:
+                document(member['handle'], None, None)
+
+            for role in group.get('roles') or []:
+                for member in role.get('members') or []:
+                    document(member['handle'], role.get('roleName'), None)
+
+        for user_handle, role_name, component, permission in component_permissions(group):
+            d = document(user_handle, role_name, component)
+            d['fullNamespace'] = bool(permission.get('fullNamespace'))
+            d['actions'] = list(permission.get('namespace') or [])
+            d['endpoints'] = [{'uri': uri, 'actions': list(actions)} for uri, actions in (permission.get('endpoints') or {}).items()]
+
+        return list(documents.values())
+
     @staticmethod
     def _group_permission_timestamps(permission_set, component_name):
         return Fields(timestamp_properties({'roles.permissions': {permission_set: component_name}}))
@@ -899,3 +1037,7 @@ class UserRepository(object):
     @property
     def clients(self):
         return self.Clients(self.wrapper)
+
+    @property
+    def permissions(self):
+        return self.Permissions(self.wrapper)
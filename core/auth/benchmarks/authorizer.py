@@ -0,0 +1,73 @@
+"""
+Compares authorizing calls by scanning the rules one by one (the previous behaviour), with the compiled rule
+index, and with the decision cache in front of it, over a set of generated uris.
+
+Usage: python benchmarks/authorizer.py [uris] [rounds]
+"""
+import itertools
+import random
+import sys
+import timeit
+
+from auth.authorizer import Authorizer, ExactRule, PrefixRule, RegexRule
+
+roles = ['db', 'cache', 'schema', 'auth', 'logger']
+actions = ['call', 'register', 'subscribe', 'publish']
+
+
+def make_authorizer(rule_count):
+    authorizer = Authorizer()
+
+    for i in range(rule_count):
+        authorizer.authenticated_rules.append(ExactRule('group{0}.component.endpoint.exact{0}'.format(i)))
+        authorizer.authenticated_rules.append(PrefixRule('group{0}.prefix.'.format(i), ['call', 'subscribe']))
+        authorizer.authenticated_rules.append(RegexRule(r'group{0}\.regex\.endpoint\.\w+$'.format(i)))
+
+    authorizer.compile()
+    return authorizer
+
+
+def make_uris(count, rule_count):
+    uris = []
+    for _ in range(count):
+        i = random.randrange(rule_count * 2)
+        uris.append(random.choice([
+            'group{0}.component.endpoint.exact{0}'.format(i),
+            'group{0}.prefix.endpoint.get'.format(i),
+            'group{0}.regex.endpoint.find'.format(i),
+            'mdstudio.{}.endpoint.find_one'.format(random.choice(roles)),
+            'mdstudio.auth.endpoint.sign'
+        ]))
+
+    return uris
+
+
+def linear(authorizer, requests):
+    rules = list(itertools.chain(authorizer.ring0_rules, authorizer.authenticated_rules))
+    for uri, action, role in requests:
+        any(rule.match(uri, action, role=role) for rule in rules)
+
+
+def compiled(authorizer, requests):
+    for uri, action, role in requests:
+        authorizer.decisions.clear()
+        authorizer.authorize_ring0(uri, action, role)
+
+
+def cached(authorizer, requests):
+    for uri, action, role in requests:
+        authorizer.authorize_ring0(uri, action, role)
+
+
+if __name__ == '__main__':
+    uri_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    rule_count = 100
+
+    authorizer = make_authorizer(rule_count)
+    requests = [(uri, random.choice(actions), random.choice(roles)) for uri in make_uris(uri_count, rule_count)]
+
+    print('{} rules, {} uris'.format(len(authorizer.ring0_rules) + len(authorizer.authenticated_rules), uri_count))
+    for name, func in [('linear', linear), ('compiled', compiled), ('cached', cached)]:
+        elapsed = timeit.timeit(lambda: func(authorizer, requests), number=rounds)
+        print('{:<10} {:8.2f} us/check'.format(name, elapsed / (rounds * uri_count) * 1e6))
@@ -1,10 +1,8 @@
 from collections import OrderedDict
 
-import base64
 import hashlib
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 from mdstudio.db.database import IDatabase
 
 from db.key_repository import KeyRepository
@@ -14,8 +12,8 @@ from mdstudio.db.connection_type import ConnectionType
 from mdstudio.db.fields import Fields
 from mdstudio.db.impl.mongo_client_wrapper import MongoClientWrapper
 from mdstudio.db.index import Index
+from mdstudio.db.key_derivation import key_derivation, pbkdf2
 from mdstudio.deferred.chainable import chainable
-from mdstudio.deferred.lock import Lock
 from mdstudio.deferred.return_value import return_value
 from mdstudio.util.exception import MDStudioException
 
@@ -35,7 +33,9 @@ class DBComponent(CoreComponentSession):
 
         self.component_waiters.append(self.ComponentWaiter(self, 'schema', self.group_context('mdstudio')))
 
-        self._client = MongoClientWrapper(self.component_config.settings['host'], self.component_config.settings['port'])
+        self._client = MongoClientWrapper(self.component_config.settings['host'], self.component_config.settings['port'],
+                                          max_databases=self.component_config.settings.get('maxDatabases', 1000),
+                                          max_idle=self.component_config.settings.get('databaseMaxIdle', 3600))
 
         super(DBComponent, self).pre_init()
 
@@ -48,7 +48,22 @@ class DBComponent(CoreComponentSession):
             raise MDStudioException('The database secret must be at least 20 characters long! Please make sure it is larger than it is now')
 
         self._set_secret()
-        self.database_lock = Lock()
+        self.key_repository = KeyRepository(self, self._client.get_database('users~db', pinned=True),
+                                            self.component_config.settings.get('keyCacheSize', 1024),
+                                            self.component_config.settings.get('keyCacheTtl', 600))
+        self.database_evictor = LoopingCall(deferToThread, self._client.evict_idle)
+
+        # Key derivations run in their own processes, so hashing and encrypting many documents does not hold the
+        # interpreter lock the reactor and the database threads need
+        key_derivation.configure(self.component_config.settings.get('derivationProcesses', 2),
+                                 self.component_config.settings.get('derivationBatchSize', 8))
+        Fields.configure_decryption(self.component_config.settings.get('decryptionWorkers', 0))
+
+        for name in ['hits', 'misses', 'refreshes']:
+            self.metrics.gauge(u'mdstudio.db', 'collections.{}'.format(name),
+                               lambda name=name: self._client.collection_stats()[name])
+        self.metrics.gauge(u'mdstudio.db', 'derivation.count', lambda: key_derivation.derived)
+        self.metrics.gauge(u'mdstudio.db', 'derivation.rate', key_derivation.rate)
 
     @property
     def secret(self):
@@ -60,6 +75,9 @@ class DBComponent(CoreComponentSession):
 
         yield super(DBComponent, self)._on_join()
 
+        if not self.database_evictor.running:
+            self.database_evictor.start(self.component_config.settings.get('databaseEvictInterval', 300), now=False)
+
     @endpoint('more', 'cursor/more-request/v1', 'cursor/more-response/v1', scope='write')
     def more(self, request, claims=None):
         database = self.get_database(claims)
@@ -113,6 +131,20 @@ class DBComponent(CoreComponentSession):
         return database.replace_one(request['collection'], request['filter'],
                                     request['replacement'], **kwargs)
 
+    @endpoint('replace_many',
+              'replace/replace-many-request',
+              'replace/replace-many-response',
+              scope='write')
+    def replace_many(self, request, claims=None):
+        database = self.get_database(claims)
+        kwargs = {}
+        if 'upsert' in request:
+            kwargs['upsert'] = request['upsert']
+
+        self.set_fields(claims, kwargs, request)
+
+        return database.replace_many(request['collection'], request['replacements'], **kwargs)
+
     @endpoint('count',
               'count/count-request',
               'count/count-response', scope='read')
@@ -372,16 +404,17 @@ class DBComponent(CoreComponentSession):
             if database_name.strip() == 'users~db':
                 raise MDStudioException('Someone tried to spoof the key database!')
 
-            yield self.database_lock.acquire()
-            result = self._client.get_database(database_name)
-            yield self.database_lock.release()
+            result = self._client.find_database(database_name)
+
+            # Only a new database is created off the reactor, as that looks up the existing databases
+            if result is None:
+                result = yield deferToThread(self._client.get_database, database_name)
 
         return_value(result)
 
     def set_fields(self, claims, kwargs, request):
         if 'fields' in request:
-            repo = KeyRepository(self, self._client.get_database('users~db'))
-            kwargs['fields'] = Fields.from_dict(request['fields'], repo)
+            kwargs['fields'] = Fields.from_dict(request['fields'], self.key_repository)
             if kwargs['fields'].uses_encryption:
                 kwargs['claims'] = claims
 
@@ -401,11 +434,4 @@ class DBComponent(CoreComponentSession):
 
     def _set_secret(self):
         secret = self.component_config.settings['secret'].encode()
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=hashlib.sha512(secret).digest(),
-            iterations=150000,
-            backend=default_backend()
-        )
-        self._secret = base64.urlsafe_b64encode(kdf.derive(secret))
+        self._secret = pbkdf2(secret, hashlib.sha512(secret).digest(), 150000)
@@ -1,46 +1,62 @@
-import base64
 import os
 from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from pymongo import ReturnDocument
 
+from mdstudio.collection.lru_dict import LRUDict
 from mdstudio.db.connection_type import ConnectionType
 from mdstudio.db.exception import DatabaseException
+from mdstudio.db.key_derivation import key_derivation
 
 
 class KeyRepository(object):
+    """
+    Stores the keys that encrypt the fields of users, groups and group roles, encrypted with the component secret.
+    Decrypted keys are cached by key body for at most `cache_ttl` seconds.
+    """
     _internal_db = None
 
-    def __init__(self, session, internal_db):
+    def __init__(self, session, internal_db, cache_size=1024, cache_ttl=600):
         self._session = session
         self._internal_db = internal_db
+        self._keys = LRUDict(cache_size, cache_ttl)
 
     def get_key(self, claims):
         connection_type = claims['connectionType']
-        model = self._get_key_model(connection_type)
         body = self._get_key_body(claims, connection_type)
-        found = model.find_one(body)
-        if not found:
-            new_key = self._new_key()
-            # find_one_and_update ensures transactionality here
-            found = self._get_key_model(connection_type).find_one_and_update(body, {
-                '$setOnInsert': new_key
-            }, upsert=True, return_document=ReturnDocument.AFTER)
-        return self._decrypt_key(found['key'])
+        cache_key = self._cache_key(body)
+
+        key = self._keys.get(cache_key)
+        if key is None:
+            model = self._get_key_model(connection_type)
+            found = model.find_one(body)
+            if not found:
+                new_key = self._new_key()
+                # find_one_and_update ensures transactionality here
+                found = self._get_key_model(connection_type).find_one_and_update(body, {
+                    '$setOnInsert': new_key
+                }, upsert=True, return_document=ReturnDocument.AFTER)
+
+            key = self._decrypt_key(found['key'])
+            self._keys[cache_key] = key
+
+        return key
+
+    def evict(self, claims=None):
+        """
+        Forget the cached key for the claims, or all cached keys.
+        """
+        if claims is None:
+            self._keys.clear()
+        else:
+            self._keys.pop(self._cache_key(self._get_key_body(claims, claims['connectionType'])), None)
+
+    def _cache_key(self, body):
+        # Keys that were decrypted with a previous secret are not used anymore
+        return (self._session.secret,) + tuple(sorted(body.items()))
 
     @staticmethod
     def _key_from_password(password, salt):
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=150000,
-            backend=default_backend()
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        return key
+        return key_derivation.derive(password, salt, 150000)
 
     def _new_key(self):
 
@@ -4,12 +4,13 @@ from faker import Faker
 from mock import mock, call
 from mongomock import ObjectId
 from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 
 from db.application import DBComponent
 from db.key_repository import KeyRepository
 from mdstudio.db.fields import Fields
+from mdstudio.db.key_derivation import key_derivation
 from mdstudio.deferred.chainable import test_chainable
-from mdstudio.deferred.lock import Lock
 from mdstudio.unittest.api import APITestCase
 from mdstudio.unittest.db import DBTestCase
 from mdstudio.unittest.settings import load_settings
@@ -38,6 +39,9 @@ class TestDBComponent(DBTestCase, APITestCase):
         if not reactor.getThreadPool().started:
             reactor.getThreadPool().start()
 
+    def tearDown(self):
+        key_derivation.configure()
+
     @mock.patch.dict(os.environ, {'MD_MONGO_HOST': 'localhost2', 'MD_MONGO_PORT': '31312'})
     @mock.patch("mdstudio.component.impl.core.CoreComponentSession.pre_init")
     def test_pre_init_host(self, m):
@@ -56,7 +60,26 @@ class TestDBComponent(DBTestCase, APITestCase):
         self.service.on_init()
         self.assertIsInstance(self.service._secret, bytes)
         self.assertEqual(self.service._secret, b'pJIM5xrgbis_h9HBqfexTSf7MON0uedITnyPdI67ngY=')
-        self.assertIsInstance(self.service.database_lock, Lock)
+        self.assertIsInstance(self.service.database_evictor, LoopingCall)
+        self.assertIn('users~db', self.service._client._pinned)
+
+    def test_collection_metrics(self):
+        self.service.on_init()
+        self.db._get_collection(self.collection, create=True)
+        self.db._get_collection(self.collection)
+
+        gauges = self.service.metrics.snapshot()['mdstudio.db']['gauges']
+        self.assertEqual(gauges['collections.hits'], 1)
+        self.assertEqual(gauges['collections.misses'], 1)
+
+    def test_derivation_metrics(self):
+        self.service.component_config.settings['derivationProcesses'] = 0
+        self.service.on_init()
+        key_derivation.derive(b'password', b'salt', 1000)
+
+        gauges = self.service.metrics.snapshot()['mdstudio.db']['gauges']
+        self.assertGreater(gauges['derivation.count'], 0)
+        self.assertGreater(gauges['derivation.rate'], 0)
 
     @mock.patch("mdstudio.component.impl.core.CoreComponentSession._on_join")
     @test_chainable
@@ -68,6 +91,8 @@ class TestDBComponent(DBTestCase, APITestCase):
             call('mdstudio.auth.endpoint.ring0.set-status', {'status': True})
         ])
         m.assert_called_once()
+        self.assertTrue(self.service.database_evictor.running)
+        self.service.database_evictor.stop()
 
     @test_chainable
     def test_more(self):
@@ -259,6 +284,29 @@ class TestDBComponent(DBTestCase, APITestCase):
             'upsertedId': cursor['results'][1]['_id']
         })
 
+    @test_chainable
+    def test_replace_many(self):
+
+        o1 = {'test': 1, '_id': str(ObjectId())}
+        o2 = {'test': 2, '_id': str(ObjectId())}
+        yield self.db.insert_many(self.collection, [o1, o2])
+        output = yield self.assertApi(self.service, 'replace_many', {
+            'collection': self.collection,
+            'replacements': [
+                {'filter': {'test': 2}, 'replacement': {'test2': 3}},
+                {'filter': {'test': 4}, 'replacement': {'test2': 4}}
+            ],
+            'upsert': True
+        }, self.claims)
+        cursor = yield self.db.find_many(self.collection, {})
+        self.assertSequenceEqual(cursor['results'], [o1, {'test2': 3, '_id': o2['_id']},
+                                                     {'test2': 4, '_id': cursor['results'][2]['_id']}])
+        self.assertEqual(output, {
+            'matched': 1,
+            'modified': 1,
+            'upsertedIds': [cursor['results'][2]['_id']]
+        })
+
     @test_chainable
     def test_replace_one_fields_datetime(self):
 
@@ -1344,6 +1392,16 @@ class TestDBComponent(DBTestCase, APITestCase):
                 'role': role
             }))._database_name, 'grouproles~{}~{}'.format(word, role))
 
+    @test_chainable
+    def test_get_database_known(self):
+        self.service._client._client.database_names = mock.MagicMock(wraps=self.service._client._client.database_names)
+
+        first = yield self.service.get_database({'connectionType': 'user', 'username': 'test-user'})
+        second = yield self.service.get_database({'connectionType': 'user', 'username': 'test-user'})
+
+        self.assertIs(first, second)
+        self.service._client._client.database_names.assert_called_once_with()
+
     @test_chainable
     def test_get_database_non_existing(self):
         yield self.assertFailure(self.service.get_database({
@@ -1362,4 +1420,5 @@ class TestDBComponent(DBTestCase, APITestCase):
         })
         self.assertEqual(kwargs['fields'], Fields(encrypted=['test']))
         self.assertIsInstance(kwargs['fields']._key_repository, KeyRepository)
+        self.assertIs(kwargs['fields']._key_repository, self.service.key_repository)
         self.assertEqual(kwargs['claims'], claims)
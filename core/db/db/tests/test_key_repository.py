@@ -1,4 +1,5 @@
 from faker import Faker
+from mock import mock
 from twisted.internet import reactor
 
 from db.application import DBComponent
@@ -177,3 +178,39 @@ class TestKeyRepository(DBTestCase):
         self.assertEqual(self.rep.get_key(claim), self.rep.get_key(claim))
         self.assertEqual(self.rep.get_key(claim2), self.rep.get_key(claim2))
         self.assertNotEqual(self.rep.get_key(claim), self.rep.get_key(claim2))
+
+    def test_get_key_cached(self):
+        claim = {
+            'connectionType': 'user',
+            'username': 'test-user'
+        }
+
+        key = self.rep.get_key(claim)
+        self.rep._get_key_model = mock.MagicMock()
+
+        self.assertEqual(self.rep.get_key(claim), key)
+        self.rep._get_key_model.assert_not_called()
+
+    def test_get_key_cache_bounded(self):
+        self.rep = KeyRepository(self.service, self.db, cache_size=1)
+
+        key = self.rep.get_key({'connectionType': 'user', 'username': 'test-user'})
+        self.rep.get_key({'connectionType': 'user', 'username': 'test-user2'})
+
+        self.assertEqual(len(self.rep._keys), 1)
+        self.assertEqual(self.rep.get_key({'connectionType': 'user', 'username': 'test-user'}), key)
+
+    def test_evict(self):
+        claim = {
+            'connectionType': 'group',
+            'group': 'test-group'
+        }
+
+        self.rep.get_key(claim)
+        self.rep.get_key({'connectionType': 'user', 'username': 'test-user'})
+
+        self.rep.evict(claim)
+        self.assertEqual(len(self.rep._keys), 1)
+
+        self.rep.evict()
+        self.assertEqual(len(self.rep._keys), 0)
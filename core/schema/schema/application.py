@@ -46,8 +46,11 @@ class SchemaComponent(CoreComponentSession):
             for schema in claim_schemas:
                 yield self.claims.upsert(vendor, component, schema, claims)
 
+        yield self.schema_get.invalidate_cache()
+
     # @todo: validate using json schema draft
-    @endpoint('get', {}, {})
+    # The schema component is a dependency of the cache component, so results are only cached locally
+    @endpoint('get', {}, {}, cache={'ttl': 300, 'remote': False})
     @chainable
     def schema_get(self, request, claims=None, **kwargs):
         vendor = claims['vendor']
@@ -0,0 +1,77 @@
+"""
+Compares the validation of a request against an endpoint schema, when constructing a new validator for every
+request (the previous behaviour), when reusing a cached validator, and when using the compiled validator.
+
+Usage: python benchmarks/schema_validation.py [iterations]
+"""
+import sys
+import timeit
+
+from jsonschema import FormatChecker
+
+from mdstudio.api.schema import DefaultValidatingDraft4Validator, SchemaValidator
+
+schema = {
+    'type': 'object',
+    'properties': {
+        'name': {'type': 'string', 'minLength': 1},
+        'uri': {'type': 'string', 'format': 'uri'},
+        'count': {'type': 'integer', 'minimum': 0, 'default': 10},
+        'options': {
+            'type': 'object',
+            'properties': {
+                'recursive': {'type': 'boolean', 'default': False},
+                'depth': {'type': 'integer', 'default': 3}
+            }
+        },
+        'items': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'id': {'type': 'string'},
+                    'value': {'type': 'number'},
+                    'tags': {'type': 'array', 'items': {'type': 'string'}}
+                },
+                'required': ['id', 'value']
+            }
+        }
+    },
+    'required': ['name', 'items']
+}
+
+
+def request():
+    return {
+        'name': 'benchmark',
+        'uri': 'https://example.com/resource',
+        'options': {},
+        'items': [{'id': str(i), 'value': i * 0.5, 'tags': ['a', 'b']} for i in range(20)]
+    }
+
+
+def per_call():
+    DefaultValidatingDraft4Validator(schema, format_checker=FormatChecker()).validate(request())
+
+
+cached_validator = SchemaValidator(schema)
+compiled_validator = SchemaValidator(schema, compiled=True)
+
+
+def cached():
+    cached_validator.validate(request())
+
+
+def compiled():
+    compiled_validator.validate(request())
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    if compiled_validator.compiled is None:
+        print('fastjsonschema is not available, the compiled validator falls back to the cached validator')
+
+    for name, func in [('per call', per_call), ('cached', cached), ('compiled', compiled)]:
+        elapsed = timeit.timeit(func, number=iterations)
+        print('{:<10} {:8.1f} us/validation'.format(name, elapsed / iterations * 1e6))
@@ -1,5 +1,5 @@
 class APIResult(dict):
-    def __init__(self, data=None, error=None, warning=None, expired=None):
+    def __init__(self, data=None, error=None, warning=None, expired=None, retry=None):
         super(APIResult, self).__init__()
 
         if data is not None:
@@ -14,6 +14,9 @@ class APIResult(dict):
         if expired is not None:
             self['expired'] = expired
 
+        if retry is not None:
+            self['retry'] = retry
+
     @property
     def data(self):
         return self.get('data', None)
@@ -29,3 +32,7 @@ class APIResult(dict):
     @property
     def expired(self):
         return self['expired']
+
+    @property
+    def retry(self):
+        return self.get('retry', False)
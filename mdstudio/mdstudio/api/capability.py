@@ -0,0 +1,145 @@
+import json
+import time
+from base64 import b64encode, b64decode, urlsafe_b64encode, urlsafe_b64decode
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from twisted.internet.defer import Deferred
+
+from mdstudio.collection.lru_dict import LRUDict
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.return_value import return_value
+
+# The claims an endpoint accepts, which it reports with every result: version 1 only accepts claims signed for a
+# single request, version 2 also accepts capabilities with a request proof
+CLAIMS_VERSION = 2
+
+# Endpoints that accept capabilities raise their errors under this uri, together with their claims version, so a
+# caller can tell them apart from an older instance that rejected the request proof before running the call
+ENDPOINT_ERROR = u'mdstudio.error.endpoint'
+
+# Loaded public request keys, as loading a key costs more than verifying a proof with it
+_request_keys = LRUDict(1024)
+
+
+def generate_request_key():
+    return ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+
+def public_request_key(private_key):
+    der = private_key.public_key().public_bytes(serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+    return urlsafe_b64encode(der).decode('ascii')
+
+
+def load_request_key(public_key):
+    key = _request_keys.get(public_key)
+    if key is None:
+        key = serialization.load_der_public_key(urlsafe_b64decode(public_key.encode('ascii')), default_backend())
+        if not isinstance(key, ec.EllipticCurvePublicKey):
+            raise ValueError('A request key should be an elliptic curve key')
+        _request_keys[public_key] = key
+
+    return key
+
+
+def request_proof(private_key, request_hash):
+    return b64encode(private_key.sign(request_hash.encode('ascii'), ec.ECDSA(hashes.SHA256()))).decode('ascii')
+
+
+def verify_request_proof(public_key, request_hash, proof):
+    if not proof:
+        return False
+
+    try:
+        load_request_key(public_key).verify(b64decode(proof.encode('ascii')), request_hash.encode('ascii'), ec.ECDSA(hashes.SHA256()))
+    except (InvalidSignature, ValueError, TypeError):
+        return False
+
+    return True
+
+
+class CapabilityCache(object):
+    """
+    Caches the capability tokens a session obtained from the auth component.
+
+    A capability is signed once for a combination of claims (and thereby for a context, uri and action), together
+    with the public half of a request key that is generated for it. The private half never leaves the session: each
+    request is bound to the capability by a signature over its request hash, so the capability can be reused for every
+    call within its lifetime without another round trip to the auth component, while a token that is seen by others
+    cannot be used for other requests.
+
+    Capabilities are only used for endpoints that reported they accept them. At most `max_capabilities` are kept,
+    and they are dropped after the requested lifetime.
+    """
+
+    def __init__(self, session, lifetime=300, margin=5, max_procedures=4096, max_capabilities=1024):
+        # type: (CommonSession, int, int, int, int) -> None
+        self.session = session
+        self.lifetime = lifetime
+        self.margin = margin
+        self._capabilities = LRUDict(max_capabilities, lifetime)
+        self._pending = {}
+        self._versions = LRUDict(max_procedures)
+
+    def supported(self, procedure):
+        return self._versions.get(procedure, 1) >= CLAIMS_VERSION
+
+    def learn(self, procedure, result):
+        """
+        Remember the version of the claims the endpoint of the procedure reported with its result.
+        """
+        version = result.get('claimsVersion', 1) if isinstance(result, dict) else 1
+        if version != self._versions.get(procedure, 1):
+            self._versions[procedure] = version
+
+    @chainable
+    def get(self, claims):
+        key = self._key(claims)
+
+        capability = self._capabilities.get(key)
+        if capability is not None and capability['expires'] - self.margin > time.time():
+            return_value(capability)
+
+        if key in self._pending:
+            waiter = Deferred()
+            self._pending[key].append(waiter)
+            return_value((yield waiter))
+
+        self._pending[key] = []
+        try:
+            request_key = generate_request_key()
+            capability = yield self._sign(claims, public_request_key(request_key))
+        except Exception as e:
+            for waiter in self._pending.pop(key):
+                waiter.errback(e)
+            raise
+        else:
+            if capability is not None:
+                capability['key'] = request_key
+                capability['expires'] = time.time() + capability['lifetime']
+                self._capabilities[key] = capability
+            else:
+                self._capabilities.pop(key, None)
+
+            for waiter in self._pending.pop(key):
+                waiter.callback(capability)
+
+        return_value(capability)
+
+    def invalidate(self, claims):
+        self._capabilities.pop(self._key(claims), None)
+
+    def clear(self):
+        self._capabilities.clear()
+
+    def _sign(self, claims, request_key):
+        from mdstudio.component.impl.common import CommonSession
+
+        return super(CommonSession, self.session).call(u'mdstudio.auth.endpoint.sign-capability', claims, self.lifetime,
+                                                       request_key=request_key)
+
+    @staticmethod
+    def _key(claims):
+        return json.dumps(claims, sort_keys=True)
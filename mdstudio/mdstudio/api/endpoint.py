@@ -1,4 +1,6 @@
+import hashlib
 import json
+import time
 import uuid
 import six
 
@@ -8,16 +10,24 @@ from typing import Union, Optional, Callable
 from jsonschema import ValidationError
 from twisted.internet.defer import _inlineCallbacks, Deferred
 from autobahn.wamp import RegisterOptions
+from autobahn.wamp.exception import ApplicationError
 
 from mdstudio.api.api_result import APIResult
+from mdstudio.api.capability import CLAIMS_VERSION, ENDPOINT_ERROR, verify_request_proof
 from mdstudio.api.converter import convert_obj_to_json
-from mdstudio.api.request_hash import request_hash
-from mdstudio.api.schema import (ISchema, EndpointSchema, validate_json_schema, ClaimSchema,
+from mdstudio.api.request_hash import request_hash, CanonicalRequest
+from mdstudio.api.response_cache import ResponseCache
+from mdstudio.api.schema import (ISchema, EndpointSchema, ClaimSchema,
                                  MDStudioClaimSchema, InlineSchema, MDStudioSchema)
+from mdstudio.api.validation import ValidationPolicy
+from mdstudio.collection.lru_dict import LRUDict
 from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.limiter import ConcurrencyLimiter, LimitExceeded
 from mdstudio.deferred.return_value import return_value
 
 SchemaType = Union[str, dict, ISchema]
+ValidationType = Union[str, dict, ValidationPolicy]
+ResponseCacheType = Union[int, dict, ResponseCache]
 
 
 def validation_error(schema, instance, error, prefix, uri):
@@ -33,12 +43,21 @@ def validation_error(schema, instance, error, prefix, uri):
 
 
 class WampEndpoint(object):
-    def __init__(self, wrapped_f, uri, input_schema, output_schema, claim_schema=None, options=None, scope=None):
+    def __init__(self, wrapped_f, uri, input_schema, output_schema, claim_schema=None, options=None, scope=None, validation=None,
+                 max_concurrency=None, max_queue=None, queue_timeout=None, cache=None):
         from mdstudio.component.impl.common import CommonSession
         self.uri_suffix = uri
         self.uri = None
         self.options = options
         self.scope = scope
+        self.validation_config = validation
+        self.validation = ValidationPolicy.from_config(validation)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.limiter = None  # type: Optional[ConcurrencyLimiter]
+        self.response_cache = ResponseCache.from_config(cache)
+        self.claims_memo = None  # type: Optional[LRUDict]
         self.instance = None  # type: CommonSession
         self.wrapped = wrapped_f
         self.input_schema = self._to_schema(input_schema, EndpointSchema)
@@ -58,92 +77,219 @@ class WampEndpoint(object):
             self.uri_suffix
         )
 
+        # The policy of the endpoint itself takes precedence over the component wide setting
+        settings = self.instance.component_config.settings
+        if self.validation_config is None:
+            self.validation = ValidationPolicy.from_config(settings.get('validation'))
+
+        max_concurrency = self._setting(self.max_concurrency, 'maxConcurrency')
+        if max_concurrency:
+            self.limiter = ConcurrencyLimiter(max_concurrency,
+                                              max_queue=self._setting(self.max_queue, 'maxQueue', 0),
+                                              queue_timeout=self._setting(self.queue_timeout, 'queueTimeout'))
+            self.instance.metrics.gauge(self.uri, 'limit.running', lambda: self.limiter.running)
+            self.instance.metrics.gauge(self.uri, 'limit.queued', lambda: self.limiter.queued)
+        else:
+            self.limiter = None
+
+        # Tokens that passed validation and authorization for this endpoint, by digest, with their expiry
+        claims_memo_size = settings.get('claimsMemoSize', 1024)
+        self.claims_memo = LRUDict(claims_memo_size) if claims_memo_size else None
+
+    def _setting(self, value, key, default=None):
+        return value if value is not None else self.instance.component_config.settings.get(key, default)
+
     def register(self):
         return self.instance.register(self, self.uri, options=self.options)
 
-    def __call__(self, request, signed_claims=None):
-        return self.execute(request, signed_claims)
+    @chainable
+    def __call__(self, request, signed_claims=None, request_proof=None):
+        try:
+            result = yield self.execute(request, signed_claims, request_proof)
+        except ApplicationError as e:
+            e.kwargs['claimsVersion'] = CLAIMS_VERSION
+            raise
+        except Exception as e:
+            raise ApplicationError(ENDPOINT_ERROR, str(e), claimsVersion=CLAIMS_VERSION)
+
+        # Tells the caller that this endpoint accepts capabilities
+        result['claimsVersion'] = CLAIMS_VERSION
+
+        return_value(result)
 
     @chainable
-    def execute(self, request, signed_claims):
+    def execute(self, request, signed_claims, request_proof=None):
         if not signed_claims:
             return_value(APIResult(error='Remote procedure was called without claims'))
 
-        from mdstudio.component.impl.common import CommonSession
+        metrics = self.instance.metrics
+        with metrics.timed(self.uri, 'execute'):
+            canonical = CanonicalRequest(request)
+            request = canonical.request
 
-        request = convert_obj_to_json(request)
-        claims = yield super(CommonSession, self.instance).call(u'mdstudio.auth.endpoint.verify', signed_claims)
+            with metrics.timed(self.uri, 'verify'):
+                claims = yield self.instance.claims_verifier.verify(signed_claims)
 
-        claim_errors = self.validate_claims(claims, request)
-        if claim_errors:
-            return_value(claim_errors)
+            claim_errors = self.validate_claims(claims, canonical, request_proof, signed_claims)
+            if claim_errors:
+                return_value(claim_errors)
 
-        request_errors = self.validate_request(request)
-        if request_errors:
-            return_value(request_errors)
+            cache_key = None
+            if self.response_cache is not None:
+                tier = None
+                with metrics.timed(self.uri, 'cache'):
+                    cache_key = yield self.response_cache.key(self.instance, self.uri, claims['claims'], canonical.hash)
+                    if cache_key is not None:
+                        tier, data = yield self.response_cache.get(self.instance, cache_key)
 
-        result = self.call_wrapped(request, claims['claims'])
-        if isinstance(result, GeneratorType):
-            result = _inlineCallbacks(None, result, Deferred())
-        result = yield result
+                if tier is not None:
+                    metrics.increment(self.uri, 'cache.hit.{}'.format(tier))
+                    return_value(APIResult(data))
 
-        result = result if isinstance(result, APIResult) else APIResult(result)
-        convert_obj_to_json(result)
+                metrics.increment(self.uri, 'cache.miss')
 
-        if 'error' in result:
-            return_value(result)
+            metrics.increment(self.uri, 'validation.{}'.format(self.validation.mode))
 
-        result_errors = self.validate_result(result.data)
-        if result_errors:
-            return_value(result_errors)
+            if self.validation.validate_input():
+                with metrics.timed(self.uri, 'validation.input'):
+                    request_errors = self.validate_request(request)
+                if request_errors and self._fail_validation(request_errors):
+                    return_value(request_errors)
+            else:
+                metrics.increment(self.uri, 'validation.input.skipped')
 
-        if 'error' in result:
-            return_value(result)
+            if self.limiter is not None:
+                try:
+                    with metrics.timed(self.uri, 'queue'):
+                        yield self.limiter.acquire()
+                except LimitExceeded as e:
+                    metrics.increment(self.uri, 'limit.rejected')
+                    return_value(APIResult(error='Too many concurrent calls to {}: {}'.format(self.uri, e), retry=True))
+
+            try:
+                with metrics.timed(self.uri, 'handler'):
+                    result = self.call_wrapped(request, claims['claims'])
+                    if isinstance(result, GeneratorType):
+                        result = _inlineCallbacks(None, result, Deferred())
+                    result = yield result
+            finally:
+                if self.limiter is not None:
+                    self.limiter.release()
+
+            with metrics.timed(self.uri, 'conversion'):
+                result = result if isinstance(result, APIResult) else APIResult(result)
+                convert_obj_to_json(result)
+
+            if 'error' in result:
+                return_value(result)
+
+            result_errors = None
+            if self.validation.validate_output():
+                with metrics.timed(self.uri, 'validation.output'):
+                    result_errors = self.validate_result(result.data)
+                if result_errors and self._fail_validation(result_errors):
+                    return_value(result_errors)
+            else:
+                metrics.increment(self.uri, 'validation.output.skipped')
 
-        result_errors = self.validate_result(result.data)
-        if result_errors:
-            return_value(result_errors)
+            if cache_key is not None and not result_errors:
+                self.response_cache.put(self.instance, cache_key, result.data)
 
         return_value(result)
 
+    @chainable
+    def invalidate_cache(self, request=None, claims=None):
+        """
+        Invalidate the cached result for a request by a caller, or all cached results when no request is given.
+        """
+        if self.response_cache is None:
+            return_value(None)
+
+        if request is None:
+            yield self.response_cache.invalidate(self.instance, uri=self.uri)
+        else:
+            key = yield self.response_cache.key(self.instance, self.uri, claims, request_hash(request))
+            if key is not None:
+                yield self.response_cache.invalidate(self.instance, key)
+
+    def _fail_validation(self, errors):
+        if self.validation.strict:
+            return True
+
+        self.instance.log.warn('{error_message}', error_message=errors['error'])
+        self.instance.metrics.increment(self.uri, 'validation.errors.ignored')
+        return False
+
     def call_wrapped(self, request, claims):
         return self.wrapped(self.instance, request, claims)
 
-    def validate_claims(self, claims, request):
+    def validate_claims(self, claims, request, request_proof=None, signed_claims=None):
         if 'error' in claims:
             res = APIResult(error=claims['error'])
         elif 'expired' in claims:
             res = APIResult(expired=claims['expired'])
         else:
             claims = claims['claims']
-            if claims['requestHash'] != request_hash(request):
+            if not self._matches_request(claims, request, request_proof):
                 res = APIResult(error='Request did not match the signed request')
-            elif claims['uri'] != self.uri:
-                res = APIResult(error='Claims were obtained for a different endpoint')
-            elif claims['action'] != 'call':
-                res = APIResult(error='Claims were not obtained for the action "call"')
             else:
-                s = None
-                try:
+                # The rest only depends on the token, so it is done once for every token that is reused
+                digest = expires = None
+                if signed_claims and self.claims_memo is not None:
+                    digest = hashlib.sha256(signed_claims.encode('utf-8')).digest()
+                    expires = self.claims_memo.get(digest)
+
+                if expires is not None and time.time() < expires:
+                    self.instance.metrics.increment(self.uri, 'validation.claims.memoized')
+                    res = None
+                else:
+                    res = self._validate_token_claims(claims)
+
+                    if res is None and digest is not None and claims.get('exp'):
+                        self.claims_memo[digest] = claims['exp']
+
+        return res
+
+    def _validate_token_claims(self, claims):
+        if claims['uri'] != self.uri:
+            res = APIResult(error='Claims were obtained for a different endpoint')
+        elif claims['action'] != 'call':
+            res = APIResult(error='Claims were not obtained for the action "call"')
+        else:
+            s = None
+            try:
+                with self.instance.metrics.timed(self.uri, 'validation.claims'):
                     for s in self.claim_schemas:
-                        validate_json_schema(s.to_schema(), claims)
-                except ValidationError as e:
-                    res = {'error': validation_error(s.to_schema(), claims, e, 'Claims', self.uri)}
+                        s.validate(claims)
+            except ValidationError as e:
+                res = {'error': validation_error(s.to_schema(), claims, e, 'Claims', self.uri)}
+                self.instance.log.error('{error_message}', error_message=res['error'])
+            else:
+                with self.instance.metrics.timed(self.uri, 'authorize'):
+                    authorized = self.instance.authorize_request(self.uri, claims)
+
+                if not authorized:
+                    res = APIResult(error='Unauthorized call to {}'.format(self.uri))
                     self.instance.log.error('{error_message}', error_message=res['error'])
                 else:
-                    if not self.instance.authorize_request(self.uri, claims):
-                        res = APIResult(error='Unauthorized call to {}'.format(self.uri))
-                        self.instance.log.error('{error_message}', error_message=res['error'])
-                    else:
-                        # Everything is OK, no errors
-                        res = None
+                    # Everything is OK, no errors
+                    res = None
 
         return res
 
+    @staticmethod
+    def _matches_request(claims, request, request_proof):
+        # Capabilities are reused for many requests, and bind each of them through a signature over its hash, made
+        # with the request key that only the caller has
+        if 'requestKey' in claims:
+            return verify_request_proof(claims['requestKey'], request_hash(request), request_proof)
+
+        return claims.get('requestHash') == request_hash(request)
+
     def validate_request(self, request):
         schema = self.input_schema.to_schema()
         try:
-            validate_json_schema(schema, request)
+            self.input_schema.validate(request)
         except ValidationError as e:
             return APIResult(error=validation_error(schema, request, e, 'Input', self.uri))
         else:
@@ -154,7 +300,7 @@ class WampEndpoint(object):
         schema = self.output_schema.to_schema()
 
         try:
-            validate_json_schema(schema, result)
+            self.output_schema.validate(result)
         except ValidationError as e:
             res = APIResult(error=validation_error(schema, result, e, 'Output', self.uri))
         else:
@@ -180,7 +326,8 @@ class WampEndpoint(object):
 
 
 class CursorWampEndpoint(WampEndpoint):
-    def __init__(self, wrapped_f, uri, input_schema, output_schema, claim_schema=None, options=None, scope=None):
+    def __init__(self, wrapped_f, uri, input_schema, output_schema, claim_schema=None, options=None, scope=None, validation=None,
+                 max_concurrency=None, max_queue=None, queue_timeout=None):
         input_schema = InlineSchema({
             'oneOf': [
                 {
@@ -202,7 +349,8 @@ class CursorWampEndpoint(WampEndpoint):
                 }
             ]
         })
-        super(CursorWampEndpoint, self).__init__(wrapped_f, uri, input_schema, output_schema, claim_schema, options, scope)
+        super(CursorWampEndpoint, self).__init__(wrapped_f, uri, input_schema, output_schema, claim_schema, options, scope,
+                                                 validation, max_concurrency, max_queue, queue_timeout)
 
     @chainable
     def call_wrapped(self, request, claims):
@@ -251,17 +399,21 @@ class CursorWampEndpoint(WampEndpoint):
         })
 
 
-def endpoint(uri, input_schema, output_schema=None, claim_schema=None, options=None, scope=None):
-    # type: (str, SchemaType, Optional[SchemaType], Optional[SchemaType], Optional[RegisterOptions], Optional[str]) -> Callable
+def endpoint(uri, input_schema, output_schema=None, claim_schema=None, options=None, scope=None, validation=None,
+             max_concurrency=None, max_queue=None, queue_timeout=None, cache=None):
+    # type: (str, SchemaType, Optional[SchemaType], Optional[SchemaType], Optional[RegisterOptions], Optional[str], Optional[ValidationType], Optional[int], Optional[int], Optional[float], Optional[ResponseCacheType]) -> Callable
     def wrap_f(f):
-        return WampEndpoint(f, uri, input_schema, output_schema, claim_schema, options, scope)
+        return WampEndpoint(f, uri, input_schema, output_schema, claim_schema, options, scope, validation,
+                            max_concurrency, max_queue, queue_timeout, cache)
 
     return wrap_f
 
 
-def cursor_endpoint(uri, input_schema, output_schema, claim_schema=None, options=None, scope=None):
-    # type: (str, SchemaType, Optional[SchemaType], Optional[SchemaType], Optional[RegisterOptions], Optional[str]) -> Callable
+def cursor_endpoint(uri, input_schema, output_schema, claim_schema=None, options=None, scope=None, validation=None,
+                    max_concurrency=None, max_queue=None, queue_timeout=None):
+    # type: (str, SchemaType, Optional[SchemaType], Optional[SchemaType], Optional[RegisterOptions], Optional[str], Optional[ValidationType], Optional[int], Optional[int], Optional[float]) -> Callable
     def wrap_f(f):
-        return CursorWampEndpoint(f, uri, input_schema, output_schema, claim_schema, options, scope)
+        return CursorWampEndpoint(f, uri, input_schema, output_schema, claim_schema, options, scope, validation,
+                                  max_concurrency, max_queue, queue_timeout)
 
     return wrap_f
@@ -2,5 +2,9 @@ class CallException(Exception):
     pass
 
 
+class RetryableCallException(CallException):
+    pass
+
+
 class RegisterException(Exception):
     pass
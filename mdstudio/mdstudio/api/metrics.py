@@ -0,0 +1,156 @@
+from bisect import bisect_left
+from timeit import default_timer
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed, roughly logarithmic buckets, so recording a value is a single bisect.
+    """
+
+    # Upper bounds of the buckets in seconds, the last bucket holds everything above
+    bounds = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(self.bounds, seconds)] += 1
+
+    def percentile(self, percentage):
+        """
+        Estimate the percentile by the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = percentage / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'buckets': dict(('le{}'.format(bound), count) for bound, count in zip(self.bounds + [float('inf')], self.buckets) if count)
+        }
+
+
+class _Timer(object):
+    __slots__ = ('metrics', 'uri', 'name', 'start')
+
+    def __init__(self, metrics, uri, name):
+        self.metrics = metrics
+        self.uri = uri
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.record(self.uri, self.name, default_timer() - self.start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+class Metrics(object):
+    """
+    Collects counters and latency histograms per uri, e.g. for each stage of the calls to and from an endpoint.
+    When disabled, nothing is recorded and timing a block only costs a shared no-op context manager.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+
+    def increment(self, uri, name, count=1):
+        if not self.enabled:
+            return
+
+        key = (uri, name)
+        self.counters[key] = self.counters.get(key, 0) + count
+
+    def record(self, uri, name, seconds):
+        if not self.enabled:
+            return
+
+        key = (uri, name)
+        histogram = self.timings.get(key)
+        if histogram is None:
+            histogram = self.timings[key] = Histogram()
+
+        histogram.record(seconds)
+
+    def gauge(self, uri, name, value):
+        """
+        Register a callable of which the current value is reported in every snapshot.
+        """
+        self.gauges[(uri, name)] = value
+
+    def timed(self, uri, name):
+        if not self.enabled:
+            return _null_timer
+
+        return _Timer(self, uri, name)
+
+    def snapshot(self):
+        result = {}
+
+        for (uri, name), count in self.counters.items():
+            self._uri_entry(result, uri)['counters'][name] = count
+
+        for (uri, name), histogram in self.timings.items():
+            self._uri_entry(result, uri)['timings'][name] = histogram.to_dict()
+
+        for (uri, name), value in self.gauges.items():
+            self._uri_entry(result, uri)['gauges'][name] = value()
+
+        return result
+
+    def summary(self):
+        lines = []
+        for (uri, name), histogram in sorted(self.timings.items()):
+            lines.append('{uri} {name}: {count} calls, mean {mean:.2f}ms, p95 {p95:.2f}ms, max {max:.2f}ms'.format(
+                uri=uri,
+                name=name,
+                count=histogram.count,
+                mean=histogram.total / histogram.count * 1000,
+                p95=histogram.percentile(95) * 1000,
+                max=histogram.max * 1000
+            ))
+
+        return lines
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    @staticmethod
+    def _uri_entry(result, uri):
+        return result.setdefault(uri, {'counters': {}, 'timings': {}, 'gauges': {}})
@@ -5,6 +5,30 @@ from hashlib import sha512
 from mdstudio.api.converter import convert_obj_to_json
 
 
+class CanonicalRequest(object):
+    """
+    A request that is converted to json types once, and of which the canonical encoding is hashed at most once.
+    Both the caller and the endpoint use it, so the hash can be reused for the MAC, retries and claims checks.
+    """
+
+    def __init__(self, request):
+        # The conversion builds new containers, so this is a copy of the request as well
+        self.request = convert_obj_to_json(request)
+        self._hash = None
+
+    def encode(self):
+        return json.dumps(self.request, sort_keys=True).encode('utf8')
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = b64encode(sha512(self.encode()).digest()).decode('utf8')
+
+        return self._hash
+
+
 def request_hash(request):
-    request = convert_obj_to_json(request)
-    return b64encode(sha512(json.dumps(request, sort_keys=True).encode('utf8')).digest()).decode('utf8')
+    if not isinstance(request, CanonicalRequest):
+        request = CanonicalRequest(request)
+
+    return request.hash
@@ -0,0 +1,166 @@
+import json
+import time
+import uuid
+from base64 import b64encode
+from hashlib import sha256
+
+from mdstudio.api.converter import convert_obj_to_json
+from mdstudio.collection.lru_dict import LRUDict
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.return_value import return_value
+from mdstudio.logging.logger import Logger
+
+_missing = object()
+
+
+class ResponseCache(object):
+    """
+    Caches the result data of an idempotent endpoint, keyed by the uri, the identity of the caller and the request hash.
+
+    Results are kept in a small in-process LRU, and in the cache component of the session (when available) with the
+    same time to live, so other instances of the component can use them too. Invalidating the whole cache moves
+    to a new generation of keys, after which the entries of the older generations in the cache component expire.
+    The generation of an endpoint is kept in the cache component as well, so it is shared by all instances and
+    survives restarts; without a cache component it is a counter of this process. Each instance holds on to the
+    generation for `generation_ttl` seconds, so a local hit needs no round trip, and an invalidation by another
+    instance takes effect here within that time.
+    """
+    log = Logger()
+
+    clock = time.time
+
+    # Claims that differ per call, rather than per caller
+    call_claims = ['uri', 'action', 'requestHash', 'requestKey', 'exp', 'iat']
+
+    def __init__(self, ttl=60, size=256, remote=True, generation_ttl=5):
+        self.ttl = ttl
+        self.remote = remote
+        self.local = LRUDict(size, ttl)
+        self.generation = 0
+        self.generation_ttl = generation_ttl
+        self.generations = {}
+
+    @chainable
+    def key(self, session, uri, claims, request_hash):
+        """
+        Returns the key of the response in the current generation, or None when the generation is not available.
+        """
+        generation = yield self._generation(session, uri)
+        if generation is None:
+            return_value(None)
+
+        identity = dict((k, v) for k, v in claims.items() if k not in self.call_claims)
+        identity = b64encode(sha256(json.dumps(identity, sort_keys=True).encode('utf8')).digest()).decode('ascii')
+
+        return_value('response#{}#{}#{}#{}'.format(uri, generation, identity, request_hash))
+
+    @chainable
+    def get(self, session, key):
+        """
+        Returns the tier the result was found in ('local' or 'remote') and its data, or (None, None) on a miss.
+        """
+        data = self.local.get(key, _missing)
+        if data is not _missing:
+            return_value(('local', data))
+
+        cache = self._remote(session)
+        if cache is not None:
+            try:
+                result = yield cache.get(key)
+            except Exception as e:
+                self.log.debug('Could not retrieve the cached response: {message}', message=str(e))
+            else:
+                if result and result.get('result') is not None:
+                    data = json.loads(result['result'])
+                    self.local[key] = data
+                    return_value(('remote', data))
+
+        return_value((None, None))
+
+    def put(self, session, key, data):
+        self.local[key] = data
+
+        cache = self._remote(session)
+        if cache is not None:
+            # The response does not wait for the cache component
+            cache.put(key, json.dumps(convert_obj_to_json(data)), self.ttl).addErrback(self._log_failure)
+
+    @chainable
+    def invalidate(self, session=None, key=None, uri=None):
+        """
+        Invalidate a single key, or move the endpoint at `uri` to a new generation when no key is given.
+        """
+        cache = self._remote(session)
+
+        if key is None:
+            self.local.clear()
+            self.generation += 1
+
+            if cache is not None and uri is not None:
+                generation = uuid.uuid4().hex
+                self.generations[uri] = (generation, self.clock())
+                try:
+                    yield cache.put(self._generation_key(uri), generation)
+                except Exception as e:
+                    self.log.warn('Could not invalidate the cached responses of {uri}: {message}', uri=uri, message=str(e))
+            return_value(None)
+
+        self.local.pop(key, None)
+
+        if cache is not None:
+            cache.forget(key).addErrback(self._log_failure)
+
+    @chainable
+    def _generation(self, session, uri):
+        cache = self._remote(session)
+        if cache is None:
+            return_value(self.generation)
+
+        generation, retrieved = self.generations.get(uri, (None, None))
+        if generation is not None and self.clock() - retrieved < self.generation_ttl:
+            return_value(generation)
+
+        try:
+            result = yield cache.get(self._generation_key(uri))
+        except Exception as e:
+            # The last known generation is used until the shared one is available again, and without one the call
+            # is not cached, as a cached response might be stale
+            self.log.debug('Could not retrieve the response generation: {message}', message=str(e))
+            return_value(generation)
+
+        generation = (result.get('result') if result else None) or 0
+        self.generations[uri] = (generation, self.clock())
+
+        return_value(generation)
+
+    @staticmethod
+    def _generation_key(uri):
+        return 'response#{}#generation'.format(uri)
+
+    def _remote(self, session):
+        if not self.remote or session is None:
+            return None
+
+        return getattr(session, 'cache', None)
+
+    def _log_failure(self, failure):
+        self.log.debug('Could not update the cached response: {message}', message=failure.getErrorMessage())
+
+    @staticmethod
+    def from_config(config):
+        """
+        Create a cache from the `cache` argument of an endpoint. This is either the time to live in seconds,
+        or a dict with a `ttl`, the `size` of the local cache, whether to use the `remote` cache component, and the
+        `generationTtl` for which the generation is held.
+        """
+        if config is None or isinstance(config, ResponseCache):
+            return config
+        if isinstance(config, bool):
+            return ResponseCache() if config else None
+        if isinstance(config, (int, float)):
+            return ResponseCache(ttl=config)
+        if isinstance(config, dict):
+            return ResponseCache(config.get('ttl', 60), config.get('size', 256), config.get('remote', True),
+                                 config.get('generationTtl', 5))
+
+        raise ValueError('Response cache of type {} is not supported'.format(type(config)))
@@ -17,10 +17,28 @@ try:
 except NameError:
     FileNotFoundError = IOError
 
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
 
 class ISchema(object):
     def __init__(self):
         self.cached = {}
+        self.validator = None
+        self.compiled = False
+
+    def validate(self, instance):
+        if self.validator is None:
+            self.validator = SchemaValidator(self.to_schema(), compiled=self.compiled)
+
+        self.validator.validate(instance)
+
+    def _reset_validator(self, session):
+        # The validator is built for the flattened schema on the first validation
+        self.validator = None
+        self.compiled = SchemaValidator.use_compiled(session)
 
     def _retrieve_local(self, base_path, schema_path, versions=None):
         if versions is not None:
@@ -109,6 +127,7 @@ class InlineSchema(ISchema):
         self.schema = schema
 
     def flatten(self, session=None):
+        self._reset_validator(session)
         return self._recurse_subschemas(self.schema, session)
 
     def to_schema(self):
@@ -172,6 +191,8 @@ class EndpointSchema(ISchema):
 
         if not success:
             self.cached = {}
+        else:
+            self._reset_validator(session)
 
         return_value(success)
 
@@ -198,9 +219,14 @@ class MDStudioClaimSchema(object):
         with open(os.path.join(session.mdstudio_schemas_path(), 'claims.v1.json'), 'r') as base_claims_file:
             self.schema = json.load(base_claims_file)
 
+        self.validator = SchemaValidator(self.schema)
+
     def to_schema(self):
         return self.schema
 
+    def validate(self, instance):
+        self.validator.validate(instance)
+
     @staticmethod
     def flatten(session):
         return True
@@ -246,6 +272,8 @@ class ResourceSchema(ISchema):
 
         if not success:
             self.cached = {}
+        else:
+            self._reset_validator(session)
 
         return_value(success)
 
@@ -279,5 +307,61 @@ def extend_with_default(validator_class):
 DefaultValidatingDraft4Validator = extend_with_default(Draft4Validator)
 
 
+class SchemaValidator(object):
+    """
+    Validator for a single (flattened) schema, that is constructed once and reused for every validation.
+
+    When `compiled` is set and fastjsonschema is available, the schema is also compiled to python code, which is
+    used to check the instance first. The regular validator is then only used to report the details of a failure.
+    Schemas with `format` or `default` keywords are not compiled, as the compiled code checks formats and fills in
+    defaults differently from the regular validator.
+    """
+
+    def __init__(self, schema, compiled=False):
+        self.schema = schema
+        self.validator = DefaultValidatingDraft4Validator(schema, format_checker=FormatChecker())
+        self.compiled = self._compile(schema) if compiled else None
+
+    def validate(self, instance):
+        if self.compiled is not None:
+            try:
+                self.compiled(instance)
+            except fastjsonschema.JsonSchemaException:
+                pass
+            else:
+                return
+
+        self.validator.validate(instance)
+
+    @staticmethod
+    def use_compiled(session):
+        config = getattr(session, 'component_config', None)
+        return config is not None and bool(config.settings.get('compiledValidation', False))
+
+    @staticmethod
+    def _compile(schema):
+        if fastjsonschema is None or not isinstance(schema, dict) or SchemaValidator._has_keywords(schema, ('format', 'default')):
+            return None
+
+        # All our schemas are draft 4, regardless of the $schema they specify
+        schema = dict(schema)
+        schema['$schema'] = 'http://json-schema.org/draft-04/schema#'
+
+        try:
+            return fastjsonschema.compile(schema)
+        except Exception:
+            # Fall back to the regular validator for schemas that cannot be compiled, e.g. with unresolvable references
+            return None
+
+    @staticmethod
+    def _has_keywords(schema, keywords):
+        if isinstance(schema, dict):
+            return any(k in keywords or SchemaValidator._has_keywords(v, keywords) for k, v in schema.items())
+        if isinstance(schema, list):
+            return any(SchemaValidator._has_keywords(v, keywords) for v in schema)
+
+        return False
+
+
 def validate_json_schema(schema_def, instance):
-    DefaultValidatingDraft4Validator(schema_def, format_checker=FormatChecker()).validate(instance)
+    SchemaValidator(schema_def).validate(instance)
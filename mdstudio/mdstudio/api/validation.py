@@ -0,0 +1,88 @@
+# coding=utf-8
+
+import random
+from enum import Enum
+
+import six
+
+
+class ValidationMode(Enum):
+    Full = 0, 'full'
+    InputOnly = 1, 'input'
+    SampledOutput = 2, 'sampled'
+    LogOnly = 3, 'log'
+    Off = 4, 'off'
+
+    def __new__(cls, value, name):
+        member = object.__new__(cls)
+        member._value_ = value
+        member.fullname = name
+        return member
+
+    def __str__(self):
+        return self.fullname
+
+    def __int__(self):
+        return self.value
+
+    @staticmethod
+    def from_string(name):
+        for mode in ValidationMode:
+            if name == str(mode):
+                return mode
+
+        raise ValueError('Validation mode "{}" is not supported'.format(name))
+
+
+class ValidationPolicy(object):
+    """
+    Determines which schemas an endpoint validates its calls against. The claims are always validated.
+
+    full:    validate the input and output of every call
+    input:   only validate the input
+    sampled: validate the input, and the output of `sample_rate` percent of the calls
+    log:     validate the input and output of every call, but only log the errors instead of failing the call
+    off:     skip the input and output validation; note that defaults from the input schema are not filled in either
+    """
+
+    def __init__(self, mode=ValidationMode.Full, sample_rate=100.0):
+        if isinstance(mode, six.string_types):
+            mode = ValidationMode.from_string(mode)
+
+        if not 0 <= sample_rate <= 100:
+            raise ValueError('The output sample rate should be a percentage, got {}'.format(sample_rate))
+
+        self.mode = mode
+        self.sample_rate = sample_rate
+
+    @property
+    def strict(self):
+        return self.mode != ValidationMode.LogOnly
+
+    def validate_input(self):
+        return self.mode != ValidationMode.Off
+
+    def validate_output(self):
+        if self.mode in (ValidationMode.Full, ValidationMode.LogOnly):
+            return True
+        if self.mode == ValidationMode.SampledOutput:
+            return random.random() * 100 < self.sample_rate
+
+        return False
+
+    @staticmethod
+    def from_config(config):
+        """
+        Create a policy from the `validation` argument of an endpoint, or the `validation` component setting.
+        This is either a mode, or a dict with a `mode` and an optional `sampleRate` in percent.
+        """
+        if config is None:
+            return ValidationPolicy()
+        if isinstance(config, ValidationPolicy):
+            return config
+        if isinstance(config, (ValidationMode, six.string_types)):
+            return ValidationPolicy(config)
+        if isinstance(config, dict):
+            return ValidationPolicy(config.get('mode', ValidationMode.Full), float(config.get('sampleRate', 100.0)))
+
+        raise ValueError('Validation policy of type {} is not supported'.format(type(config)))
@@ -0,0 +1,102 @@
+import time
+from copy import deepcopy
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from jwt import decode as jwt_decode, get_unverified_header, DecodeError, ExpiredSignatureError, InvalidTokenError
+
+from mdstudio.collection.lru_dict import LRUDict
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.return_value import return_value
+from mdstudio.logging.logger import Logger
+
+
+class ClaimsVerifier(object):
+    """
+    Verifies signed claims in-process, using the public keys that are published by the auth component.
+
+    Tokens that were signed with a key id we do not know (yet) are verified by the auth component instead,
+    after which the cached keys are refreshed, so a key rotation only costs a couple of round trips.
+
+    Verified tokens are memoized until they expire, as a single publish delivers the same token to every
+    subscriber and callers tend to reuse their token for many requests.
+    """
+    log = Logger()
+
+    def __init__(self, session, memo_size=4096, clock=time.time):
+        # type: (CommonSession, int, Callable[[], float]) -> None
+        self.session = session
+        self.keys = {}
+        self.memo = LRUDict(memo_size)
+        self.clock = clock
+        self._refreshing = None
+
+    @chainable
+    def refresh(self):
+        if self._refreshing is not None:
+            yield self._refreshing
+            return_value(self.keys)
+
+        from mdstudio.component.impl.common import CommonSession
+
+        self._refreshing = super(CommonSession, self.session).call(u'mdstudio.auth.endpoint.verification-keys')
+        try:
+            published = yield self._refreshing
+        except Exception as e:
+            self.log.debug('Could not retrieve the verification keys: {message}', message=str(e))
+        else:
+            self.keys = dict((key['kid'], self._load_key(key)) for key in published)
+        finally:
+            self._refreshing = None
+
+        return_value(self.keys)
+
+    @chainable
+    def verify(self, signed_claims):
+        claims = self.verify_local(signed_claims)
+
+        if claims is None:
+            from mdstudio.component.impl.common import CommonSession
+
+            claims = yield super(CommonSession, self.session).call(u'mdstudio.auth.endpoint.verify', signed_claims)
+
+            # The token is valid, but signed with a key we do not have yet
+            if 'claims' in claims:
+                self.refresh()
+
+        return_value(claims)
+
+    def verify_local(self, signed_claims):
+        memoized = self.memo.get(signed_claims)
+        if memoized is not None:
+            expires, claims = memoized
+            if expires is None or self.clock() < expires:
+                # Handlers are free to modify their claims
+                return {'claims': deepcopy(claims)}
+
+            self.memo.pop(signed_claims, None)
+            return {'expired': 'Request token has expired'}
+
+        try:
+            key_id = get_unverified_header(signed_claims).get('kid')
+        except DecodeError:
+            return {'error': 'Could not verify user'}
+
+        if key_id not in self.keys:
+            return None
+
+        key, algorithm = self.keys[key_id]
+        try:
+            claims = jwt_decode(signed_claims, key, algorithms=[algorithm])
+        except ExpiredSignatureError:
+            return {'expired': 'Request token has expired'}
+        except InvalidTokenError:
+            return {'error': 'Could not verify user'}
+
+        self.memo[signed_claims] = (claims.get('exp'), deepcopy(claims))
+
+        return {'claims': claims}
+
+    @staticmethod
+    def _load_key(key):
+        return load_pem_public_key(key['key'].encode('ascii'), backend=default_backend()), key['algorithm']
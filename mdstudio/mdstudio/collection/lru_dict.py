@@ -0,0 +1,79 @@
+# coding=utf-8
+
+import time
+from collections import OrderedDict
+from threading import RLock
+
+from mdstudio.util.exception import MDStudioException
+
+
+class LRUDict(object):
+    """
+    Dictionary that holds at most `max_size` items, evicting the least recently used item first.
+    Items can optionally expire after `max_age_seconds`.
+    """
+
+    def __init__(self, max_size, max_age_seconds=None):
+        if max_size < 1:
+            raise MDStudioException('The maximum size should be at least 1, got {}'.format(max_size))
+
+        self.max_size = max_size
+        self.max_age = max_age_seconds
+        self.lock = RLock()
+        self._items = OrderedDict()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value, stored = self._items.pop(key)
+            if self.max_age is not None and time.time() - stored >= self.max_age:
+                raise KeyError(key)
+
+            # Reinsert the item to mark it as most recently used
+            self._items[key] = (value, stored)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self._items:
+                del self._items[key]
+            elif len(self._items) >= self.max_size:
+                self._items.popitem(last=False)
+
+            self._items[key] = (value, time.time())
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self._items[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+
+        return True
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key in self._items:
+                return self._items.pop(key)[0]
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+    def keys(self):
+        with self.lock:
+            return list(self._items.keys())
+
+    def clear(self):
+        with self.lock:
+            self._items.clear()
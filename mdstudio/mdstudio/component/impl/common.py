@@ -7,19 +7,25 @@ import re
 from collections import OrderedDict
 from copy import deepcopy
 
+import six
 import yaml
 from autobahn.twisted.wamp import ApplicationSession
 from autobahn.wamp import PublishOptions, ApplicationError
+from twisted.internet import task
+from twisted.internet.defer import Deferred, DeferredList
 from twisted.python.failure import Failure
 
 from mdstudio.api.api_result import APIResult
+from mdstudio.api.capability import CapabilityCache, request_proof
 from mdstudio.api.context import UserContext, GroupRoleContext, GroupContext
-from mdstudio.api.converter import convert_obj_to_json
-from mdstudio.api.exception import CallException
-from mdstudio.api.request_hash import request_hash
+from mdstudio.api.exception import CallException, RetryableCallException
+from mdstudio.api.metrics import Metrics
+from mdstudio.api.request_hash import CanonicalRequest
 from mdstudio.api.schema import validate_json_schema
+from mdstudio.api.verifier import ClaimsVerifier
 from mdstudio.collection import merge_dicts, dict_property
-from mdstudio.deferred.chainable import chainable, Chainable
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.limiter import ConcurrencyLimiter
 from mdstudio.deferred.return_value import return_value
 from mdstudio.logging.impl.session_observer import SessionLogObserver
 from mdstudio.logging.log_type import LogType
@@ -59,6 +65,8 @@ class CommonSession(ApplicationSession):
         self.log = Logger(namespace=self.__class__.__name__)
         self.log_type = LogType.User
         self.default_call_context = None
+        self.metrics = Metrics()
+        self.claims_verifier = ClaimsVerifier(self)
 
         self.daily_log = True
         if config and config.extra:
@@ -79,6 +87,13 @@ class CommonSession(ApplicationSession):
         # load config from env/file, check with schema
         self.validate_settings()
 
+        self.capabilities = CapabilityCache(self, lifetime=self.component_config.settings.get('capabilityLifetime', 300),
+                                            max_capabilities=self.component_config.settings.get('capabilityCacheSize', 1024))
+        self.metrics.enabled = self.component_config.settings.get('metrics', True)
+        self.metrics_logger = task.LoopingCall(self.log_metrics)
+        self.coalesced_procedures = set(self.component_config.settings.get('coalesceCalls', []))
+        self._in_flight = {}
+
         if config:
             config.realm = u'{}'.format(self.component_config.session.realm)
 
@@ -134,35 +149,128 @@ class CommonSession(ApplicationSession):
         claims['uri'] = procedure
         claims['action'] = 'call'
 
-        request = convert_obj_to_json(deepcopy(request))
-        claims['requestHash'] = request_hash(request)
-
-        signed_claims = yield super(CommonSession, self).call(u'mdstudio.auth.endpoint.sign', claims)
+        canonical = CanonicalRequest(request)
 
-        if signed_claims is None:
-            claims.pop('requestHash')
-            raise CallException('Claims were not signed. You are not authorized for signing: \n{}'.format(json.dumps(claims, indent=2)))
+        if kwargs or not self.coalesce_call(procedure):
+            return_value((yield self._call(procedure, canonical, claims, **kwargs)))
 
-        def make_original_call():
-            return Chainable(super(CommonSession, self).call(u'{}'.format(procedure), request, signed_claims=signed_claims, **kwargs))
+        # Identical calls that are still in flight share the result of the first one
+        key = (procedure, canonical.hash, json.dumps(claims, sort_keys=True))
+        if key in self._in_flight:
+            self.metrics.increment(procedure, 'call.coalesced')
+            waiter = Deferred()
+            self._in_flight[key].append(waiter)
+            result = yield waiter
+            return_value(deepcopy(result))
 
+        self._in_flight[key] = []
         try:
+            result = yield self._call(procedure, canonical, claims)
+        except Exception as e:
+            for waiter in self._in_flight.pop(key):
+                waiter.errback(e)
+            raise
+        else:
+            for waiter in self._in_flight.pop(key):
+                waiter.callback(result)
+
+        return_value(result)
+
+    @chainable
+    def call_many(self, procedure, requests, claims=None, context=None, window=10):
+        """
+        Call a procedure (or a list of procedures, one per request) for every request, with at most `window` calls
+        in flight at once. The results are returned in the order of the requests, as an APIResult with either the
+        data or the error of each call, so a failing call does not abort the others.
+        """
+        if isinstance(procedure, six.string_types):
+            procedures = [procedure] * len(requests)
+        else:
+            procedures = list(procedure)
+
+        if len(procedures) != len(requests):
+            raise ValueError('Got {} procedures for {} requests'.format(len(procedures), len(requests)))
+
+        if context is None:
+            context = self.default_call_context
+
+        # Sign the claims for each procedure once up front, so the calls themselves use the cached capabilities
+        signing = []
+        for uri in set(p for p in procedures if self.capabilities.supported(p)):
+            procedure_claims = context.get_claims(claims)
+            procedure_claims['uri'] = uri
+            procedure_claims['action'] = 'call'
+            signing.append(self.capabilities.get(procedure_claims))
+        yield DeferredList(signing, consumeErrors=True)
+
+        limiter = ConcurrencyLimiter(window, max_queue=len(requests))
+
+        def call(uri, request):
+            return limiter.run(self.call, uri, request, claims=claims, context=context).addCallbacks(
+                APIResult, lambda failure: APIResult(error=failure.getErrorMessage())
+            )
+
+        results = yield DeferredList([call(uri, request) for uri, request in zip(procedures, requests)])
+
+        return_value([result for _, result in results])
+
+    def coalesce_call(self, procedure):
+        if procedure in self.coalesced_procedures:
+            return True
+
+        return any(p.endswith('*') and procedure.startswith(p[:-1]) for p in self.coalesced_procedures)
+
+    @chainable
+    def _call(self, procedure, canonical, claims, **kwargs):
+        with self.metrics.timed(procedure, 'call'):
+            request = canonical.request
+
+            with self.metrics.timed(procedure, 'sign'):
+                call_claims = yield self._sign_call(procedure, claims, canonical.hash)
+
+            if call_claims is None:
+                raise CallException('Claims were not signed. You are not authorized for signing: \n{}'.format(json.dumps(claims, indent=2)))
+
+            @chainable
+            def make_original_call():
+                with self.metrics.timed(procedure, 'remote'):
+                    try:
+                        result = yield super(CommonSession, self).call(u'{}'.format(procedure), request, **dict(kwargs, **call_claims))
+                    except ApplicationError as e:
+                        # Newer endpoints report their claims version with their errors, while an older instance of the
+                        # endpoint fails on the request proof as an unexpected argument, and never ran the call
+                        if 'request_proof' in call_claims and e.error == u'wamp.error.runtime_error' and \
+                                e.kwargs.get('claimsVersion') is None:
+                            self.capabilities.learn(procedure, None)
+                            return_value(None)
+
+                        result = APIResult(error='Call to {uri} failed'.format(uri=procedure))
+                    else:
+                        self.capabilities.learn(procedure, result)
+
+                return_value(result)
+
             result = yield make_original_call()
-        except ApplicationError:
-            result = APIResult(error='Call to {uri} failed'.format(uri=procedure))
 
-        if 'expired' in result:
-            signed_claims = yield super(CommonSession, self).call(u'mdstudio.auth.endpoint.sign', claims)
+            if result is None or 'expired' in result:
+                with self.metrics.timed(procedure, 'sign'):
+                    call_claims = yield self._sign_call(procedure, claims, canonical.hash, renew=True)
+
+                if call_claims is None:
+                    raise CallException(result['expired'] if result else 'Claims were not signed')
 
-            try:
                 result = yield make_original_call()
-            except ApplicationError:
-                result = APIResult(error='Call to {uri} failed'.format(uri=procedure))
+
+                if result is None:
+                    result = APIResult(error='Call to {uri} failed'.format(uri=procedure))
 
         if 'expired' in result:
             raise CallException(result['expired'])
 
         if 'error' in result:
+            if result.get('retry'):
+                raise RetryableCallException(result['error'])
+
             raise CallException(result['error'])
 
         if 'warning' in result:
@@ -170,6 +278,33 @@ class CommonSession(ApplicationSession):
 
         return_value(result.get('data', None))
 
+    @chainable
+    def _sign_call(self, procedure, claims, hashed_request, renew=False):
+        """
+        The claims to call a procedure with: a capability and the proof for this request when the endpoint accepts
+        capabilities, and otherwise claims signed for this request only.
+        """
+        if self.capabilities.supported(procedure):
+            if renew:
+                self.capabilities.invalidate(claims)
+
+            capability = yield self.capabilities.get(claims)
+            if capability is None:
+                return_value(None)
+
+            return_value({
+                'signed_claims': capability['token'],
+                'request_proof': request_proof(capability['key'], hashed_request)
+            })
+
+        signed_claims = yield super(CommonSession, self).call(u'mdstudio.auth.endpoint.sign', dict(claims, requestHash=hashed_request))
+        if signed_claims is None:
+            return_value(None)
+
+        return_value({
+            'signed_claims': signed_claims
+        })
+
     @chainable
     def publish(self, topic, claims=None, context=None, options=None):
         if context is None:
@@ -191,7 +326,8 @@ class CommonSession(ApplicationSession):
             if not signed_claims:
                 raise MDStudioException('Subscribe was called without claims')
 
-            claims = yield super(CommonSession, self).call('mdstudio.auth.endpoint.verify', signed_claims)
+            with self.metrics.timed(topic, 'verify'):
+                claims = yield self.claims_verifier.verify(signed_claims)
 
             if not ('error' in claims or 'expired' in claims):
                 claims = claims['claims']
@@ -209,35 +345,45 @@ class CommonSession(ApplicationSession):
     def on_event(self, handler, topic, options=None):
         return super(CommonSession, self).subscribe(handler, topic, options)
 
+    def get_metrics(self, request, claims):
+        return self.metrics.snapshot()
+
+    def log_metrics(self):
+        for line in self.metrics.summary():
+            self.log.info('Metrics: {summary}', summary=line)
+
     @chainable
     def _on_join(self):
+        yield self.claims_verifier.refresh()
         yield self.upload_schemas()
         yield self.on_run()
 
         if self.daily_log:
             yield self.log_collector.start_flushing(self)
 
+        log_interval = self.component_config.settings.get('metricsLogInterval', 0)
+        if self.metrics.enabled and log_interval and not self.metrics_logger.running:
+            self.metrics_logger.start(log_interval, now=False)
+
     @chainable
     def on_join(self):
         failures = 0
         successful = 0
 
         registrations = yield self.register(self)
-        for _, endpoint in self.__class__.__dict__.items():
-            from mdstudio.api.endpoint import WampEndpoint
-            if isinstance(endpoint, WampEndpoint):
-                yield endpoint.input_schema.flatten(self)
-                yield endpoint.output_schema.flatten(self)
-                for s in endpoint.claim_schemas:
-                    yield s.flatten(self)
-
-                endpoint.set_instance(self)
-                try:
-                    yield endpoint.register()
-                    successful += 1
-                except Exception as e:
-                    self.log.info("ERROR: {class_name}: {message}", class_name=self.class_name(), message=str(e))
-                    failures += 1
+        for endpoint in self.session_endpoints():
+            yield endpoint.input_schema.flatten(self)
+            yield endpoint.output_schema.flatten(self)
+            for s in endpoint.claim_schemas:
+                yield s.flatten(self)
+
+            endpoint.set_instance(self)
+            try:
+                yield endpoint.register()
+                successful += 1
+            except Exception as e:
+                self.log.info("ERROR: {class_name}: {message}", class_name=self.class_name(), message=str(e))
+                failures += 1
 
         yield self._on_join()
 
@@ -277,6 +423,18 @@ class CommonSession(ApplicationSession):
     #
     # onLeave = on_leave
 
+    def session_endpoints(self):
+        from mdstudio.api.endpoint import WampEndpoint
+
+        endpoints = [e for e in self.__class__.__dict__.values() if isinstance(e, WampEndpoint)]
+
+        # A session exposes its metrics when configured to, and the component authorizes the calls as for its own
+        # endpoints. The endpoint is bound to this instance
+        if self.component_config.settings.get('metricsEndpoint', False):
+            endpoints.append(WampEndpoint(CommonSession.get_metrics, 'metrics', {'type': 'object'}, {'type': 'object'}, scope='read'))
+
+        return endpoints
+
     def add_env_var_from_config(self, session_var, env_vars, attribute=None, default=None, converter=None, extract=os.getenv):
         if not attribute:
             attribute = 'settings'
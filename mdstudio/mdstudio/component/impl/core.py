@@ -1,58 +1,116 @@
 # -*- coding: utf-8 -*-
 
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+
 from mdstudio.api.exception import CallException
 from mdstudio.cache.session_cache import SessionCacheWrapper
 from mdstudio.component.impl.common import CommonSession
 from mdstudio.db.connection_type import ConnectionType
 from mdstudio.db.session_database import SessionDatabaseWrapper
 from mdstudio.deferred.chainable import chainable
-from mdstudio.deferred.sleep import sleep
+from mdstudio.deferred.return_value import return_value
 from mdstudio.logging.log_type import LogType
 from mdstudio.logging.logger import Logger
 
 
 class CoreComponentSession(CommonSession):
     class ComponentWaiter(object):
+        """
+        Waits until a core component has reported its status to the auth component. The waiter subscribes to the
+        status events of the auth component, and then queries the status once, so a component that came online
+        in between is not missed. The status is queried again with a growing interval, in case the auth
+        component itself was not online yet, or the subscription was refused.
+        """
         log = Logger()
+        clock = reactor
+
+        status_topic = u'mdstudio.auth.endpoint.ring0.status'
+        poll_interval = 0.1
+        max_poll_interval = 5.0
 
         def __init__(self, session, component, context=None):
             # type: (CoreComponentSession, str) -> None
             self.session = session
             self.component = component
             self.context = context
+            self.online = False
+            self._wakeup = None
 
         @chainable
         def wait(self):
-            online = False
+            started = self.clock.seconds()
+            via = 'query'
             tried = False
-
-            def status_call():
-                return self.session.call('mdstudio.auth.endpoint.ring0.get-status', {'component': self.component}, context=self.context)
+            interval = self.poll_interval
 
             try:
-                online = yield status_call()
-            except:
-                self.log.info('{waiter} is waiting for {waitee}', waiter=self.session.class_name(), waitee=self.component)
-                tried = True
-
-            while not online:
-                try:
-                    online = yield status_call()
-                except CallException:
-                    yield sleep(0.1)
-                except Exception as e:
-                    self.log.error('Component {component} not online, and caught '
-                                   'unrecognized exception {exc}.', component=self.component, exc=e)
-                    yield sleep(1)
-                else:
-                    yield sleep(0.1)
+                subscription = yield self.session.on_event(self._on_status, self.status_topic)
+            except Exception as e:
+                # Without the status events the waiter still finds out by querying the status
+                self.log.warn('{waiter} could not subscribe to the status of {waitee}, polling instead: {exc}',
+                              waiter=self.session.class_name(), waitee=self.component, exc=e)
+                subscription = None
+
+            while not (yield self._query()):
+                if not tried:
+                    self.log.info('{waiter} is waiting for {waitee}', waiter=self.session.class_name(), waitee=self.component)
+                    tried = True
+
+                self._wakeup = Deferred()
+                timeout = self.clock.callLater(interval, self._wake)
+                yield self._wakeup
+
+                if timeout.active():
+                    timeout.cancel()
+
+                if self.online:
+                    via = 'event'
+                    break
+
+                interval = min(interval * 2, self.max_poll_interval)
+
+            if subscription is not None:
+                yield subscription.unsubscribe()
+
+            self.online = True
+            waited = self.clock.seconds() - started
+            self.session.startup_timeline.append({
+                'component': self.component,
+                'waited': waited,
+                'via': via
+            })
+            self.session.metrics.record(u'startup', u'wait.{}'.format(self.component), waited)
 
             if tried:
                 self.log.info('{waitee} is now online, continuing '
                               'execution for {waiter}', waitee=self.component, waiter=self.session.class_name())
 
+        @chainable
+        def _query(self):
+            try:
+                online = yield self.session.call('mdstudio.auth.endpoint.ring0.get-status', {'component': self.component}, context=self.context)
+            except CallException:
+                online = False
+            except Exception as e:
+                self.log.error('Component {component} not online, and caught '
+                               'unrecognized exception {exc}.', component=self.component, exc=e)
+                online = False
+
+            return_value(bool(online) or self.online)
+
+        def _on_status(self, status, *args, **kwargs):
+            if status.get('component') == self.component and status.get('status'):
+                self.online = True
+                self._wake()
+
+        def _wake(self):
+            if self._wakeup is not None and not self._wakeup.called:
+                self._wakeup.callback(None)
+
     def __init__(self, config=None):
         self.component_waiters = []
+        self.startup_timeline = []
         self.db = SessionDatabaseWrapper(self, ConnectionType.User)
         self.cache = SessionCacheWrapper(self, ConnectionType.User)
         super(CoreComponentSession, self).__init__(config)
@@ -87,6 +145,21 @@ class CoreComponentSession(CommonSession):
 
         yield super(CoreComponentSession, self)._on_join()
 
+        for line in self.startup_report():
+            self.log.info('Startup: {line}', line=line)
+
+    def startup_report(self):
+        """
+        Lists how long this component waited on each of its dependencies, and whether the wait ended on
+        the status query or on the status event.
+        """
+        return ['{component} waited {waited:.2f}s for {dependency} ({via})'.format(
+            component=self.class_name(),
+            waited=entry['waited'],
+            dependency=entry['component'],
+            via=entry['via']
+        ) for entry in self.startup_timeline]
+
     def on_challenge(self, challenge):
         if challenge.method == u'ticket':
             return self.component_config.session.username
@@ -54,6 +54,11 @@ class IDatabase(object):
         # type: (CollectionType, DocumentType, DocumentType, bool, Optional[Fields], Optional[dict]) -> Any
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def replace_many(self, collection, replacements, upsert=False, fields=None, claims=None):
+        # type: (CollectionType, List[Dict[str, DocumentType]], bool, Optional[Fields], Optional[dict]) -> Any
+        raise NotImplementedError
+
     @abc.abstractmethod
     def count(self, collection, filter=None, skip=None, limit=None, fields=None, claims=None, cursor_id=None, with_limit_and_skip=False):
         # type: (CollectionType, Optional[DocumentType], Optional[int], Optional[int], Optional[Fields], Optional[dict], Optional[str], bool) -> Any
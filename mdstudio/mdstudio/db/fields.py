@@ -1,16 +1,17 @@
 import datetime
 from typing import List, Callable, Optional, Union
 
-import base64
 import hashlib
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import pytz
 from copy import deepcopy
 
 import six
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
 
+from mdstudio.collection.lru_dict import LRUDict
 from mdstudio.db.exception import DatabaseException
+from mdstudio.db.key_derivation import key_derivation
 from mdstudio.utc import from_utc_string, from_date_string
 
 
@@ -56,6 +57,15 @@ class Fields(object):
     _key_repository = None
     _encrypted_prefix = '__encrypted__'
 
+    # Encryptors by key, shared by all fields as creating them for every conversion adds up
+    _encryptors = LRUDict(1024)
+
+    # Worker threads that decrypt large result batches, when configured
+    _decryption_pool = None
+
+    # Minimal number of encrypted values in a batch before it is decrypted by the workers
+    parallel_decryption_threshold = 64
+
     def __init__(self, date_times=None, dates=None, encrypted=None, hashed=None, key_repository=None):
         # type: (Optional[Union[List[str],str]], Optional[Union[List[str],str]], Optional[Union[List[str],str]], Optional[Union[List[str],str]], Optional[KeyRepository]) -> None
         if date_times and not isinstance(date_times, list):
@@ -90,7 +100,11 @@ class Fields(object):
         # type: (dict, Optional[List[str]], Optional[dict]) -> None
         self.transform_to_object(obj, self.date_times, Fields.parse_date_time, prefixes)
         self.transform_to_object(obj, self.dates, Fields.parse_date, prefixes)
-        self.transform_to_object(obj, self.hashed, Fields.parse_hashed, prefixes)
+        if self.hashed:
+            # The hashes of all documents are derived as one batch
+            hashed = []
+            self.transform_to_object(obj, self.hashed, Fields.parse_hashed, prefixes, hashed=hashed)
+            self._derive_hashed(hashed)
 
         if claims and self.uses_encryption:
             encryptor = self.get_encryptor(claims)
@@ -102,6 +116,30 @@ class Fields(object):
             encryptor = self.get_encryptor(claims)
             self.transform_to_object(obj, self.encrypted, Fields.decrypt, None, **{'encryptor': encryptor})
 
+    def parse_results(self, objs, claims=None):
+        # type: (List[dict], dict) -> None
+        """
+        Decrypt the encrypted fields of all documents in a result batch in one pass: the encrypted values are
+        collected first, every distinct value is decrypted once, and the plain values are written back afterwards.
+        """
+        if not claims or not self.uses_encryption or not objs:
+            return
+
+        if len(objs) == 1:
+            self.parse_result(objs[0], claims)
+            return
+
+        encryptor = self.get_encryptor(claims)
+
+        collected = []
+        for obj in objs:
+            self.transform_to_object(obj, self.encrypted, Fields.collect_encrypted, None, collected=collected)
+
+        decrypted = self._decrypt_all(collected, encryptor)
+
+        for obj in objs:
+            self.transform_to_object(obj, self.encrypted, Fields.replace_decrypted, None, decrypted=decrypted)
+
     def is_empty(self):
         # type: () -> bool
         return not self.date_times and not self.dates and not self.encrypted
@@ -257,20 +295,20 @@ class Fields(object):
             sval = val.encode()
         else:
             sval = deepcopy(val)
-        try:
-            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=hashlib.sha512(sval).digest(),
-                iterations=50000,
-                backend=default_backend()
-            )
-            sub['__hashed__:{}'.format(key)] = base64.urlsafe_b64encode(kdf.derive(sval)).decode('utf-8')
-        except Exception as ex:
-            raise ex
+
+        if 'hashed' in kwargs:
+            kwargs['hashed'].append((sub, key, sval))
         else:
-            return val
+            self._derive_hashed([(sub, key, sval)])
+
+        return val
+
+    @staticmethod
+    def _derive_hashed(hashed):
+        digests = key_derivation.derive_many([(sval, hashlib.sha512(sval).digest(), 50000) for _, _, sval in hashed])
+
+        for (sub, key, _), digest in zip(hashed, digests):
+            sub['__hashed__:{}'.format(key)] = digest.decode('utf-8')
 
     def decrypt(self, val, sub, key, *args, **kwargs):
         if isinstance(val, (six.text_type, str)):
@@ -290,14 +328,71 @@ class Fields(object):
         else:
             raise DatabaseException("Failed to decrypt field '{}'".format(val))
 
+    def collect_encrypted(self, val, sub, key, *args, **kwargs):
+        if isinstance(val, (six.text_type, str)):
+            token = val.encode()
+        else:
+            token = val
+        if isinstance(token, bytes):
+            prefix = '{}:'.format(self._encrypted_prefix).encode()
+            if prefix not in token:
+                raise DatabaseException('Trying to decrypt an unencrypted field with key "{key}", '
+                                        'please check your insert statements!'.format(key=key))
+
+            kwargs['collected'].append((key, val, token.replace(prefix, b'', 1)))
+        else:
+            raise DatabaseException("Failed to decrypt field '{}'".format(val))
+
+        return val
+
+    def replace_decrypted(self, val, *args, **kwargs):
+        return kwargs['decrypted'][val]
+
+    @staticmethod
+    def configure_decryption(workers=None):
+        # type: (Optional[int]) -> None
+        if Fields._decryption_pool is not None:
+            Fields._decryption_pool.terminate()
+            Fields._decryption_pool = None
+
+        if workers:
+            Fields._decryption_pool = ThreadPool(workers)
+
+    @staticmethod
+    def _decrypt_all(collected, encryptor):
+        tokens = OrderedDict()
+        for key, val, token in collected:
+            tokens.setdefault(val, (key, token))
+
+        def _decrypt(item):
+            key, token = item
+            try:
+                return encryptor.decrypt(token).decode('utf-8')
+            except Exception as ex:
+                raise DatabaseException('Failed to decrypt field {key}:\n{exp_str}'.format(key=key, exp_str=str(ex)))
+
+        pool = Fields._decryption_pool
+        if pool is not None and len(tokens) >= Fields.parallel_decryption_threshold:
+            plain = pool.map(_decrypt, list(tokens.values()))
+        else:
+            plain = [_decrypt(item) for item in tokens.values()]
+
+        return dict(zip(tokens.keys(), plain))
+
     def get_encryptor(self, claims):
         from cryptography.fernet import Fernet
-        try:
-            encryptor = Fernet(self._get_key(claims))
-        except Exception:  # @todo: filter this
-            raise DatabaseException('Failed to create a Fernet encryption class due to an incorrect key.')
-        else:
-            return encryptor
+        key = self._get_key(claims)
+
+        encryptor = Fields._encryptors.get(key)
+        if encryptor is None:
+            try:
+                encryptor = Fernet(key)
+            except Exception:  # @todo: filter this
+                raise DatabaseException('Failed to create a Fernet encryption class due to an incorrect key.')
+
+            Fields._encryptors[key] = encryptor
+
+        return encryptor
 
     @property
     def conversion_operators(self):
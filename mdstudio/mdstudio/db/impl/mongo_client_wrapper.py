@@ -1,3 +1,6 @@
+import time
+from threading import Lock
+
 from pymongo import MongoClient
 
 from mdstudio.db.impl.mongo_database_wrapper import MongoDatabaseWrapper
@@ -5,26 +8,105 @@ from mdstudio.logging.logger import Logger
 
 
 class MongoClientWrapper(object):
+    """
+    Hands out one MongoDatabaseWrapper per database. Known databases are returned without locking or round trips,
+    only the creation of a wrapper is serialized. When `max_databases` or `max_idle` are given, the least recently
+    used databases, or those that were not used for `max_idle` seconds, are evicted and their cursors closed.
+    Databases with open cursors are kept until their cursors expire, and pinned databases are never evicted.
+    """
     logger = Logger()
 
-    def __init__(self, host, port):
+    clock = time.time
+
+    def __init__(self, host, port, max_databases=None, max_idle=None):
         self._host = host
         self._port = port
         self._client = self.create_mongo_client(host, port)
         self._databases = {}
+        self._last_used = {}
+        self._pinned = set()
+        self._creating = Lock()
+        self.max_databases = max_databases
+        self.max_idle = max_idle
+
+    def find_database(self, database_name):
+        """
+        Get the wrapper of a database that is already known, or None.
+        """
+        database = self._databases.get(database_name)
+        if database is not None:
+            self._last_used[database_name] = self.clock()
+
+        return database
+
+    def get_database(self, database_name, pinned=False):
+        """
+        Get the wrapper of a database, and create it when it is not known yet. A `pinned` database is not evicted,
+        for databases that are used through their wrapper only.
+        """
+        if pinned:
+            self._pinned.add(database_name)
+
+        database = self.find_database(database_name)
+
+        if database is None:
+            with self._creating:
+                database = self.find_database(database_name)
+
+                if database is None:
+                    if database_name not in self._client.database_names():
+                        self.logger.info('Creating database "{database}"', database=database_name)
 
-    def get_database(self, database_name):
-        if database_name not in self._databases:
-            if database_name not in self._client.database_names():
-                self.logger.info('Creating database "{database}"', database=database_name)
+                    database = MongoDatabaseWrapper(database_name, self._client[database_name])
+                    self._databases[database_name] = database
+                    self._last_used[database_name] = self.clock()
 
-            database = MongoDatabaseWrapper(database_name, self._client[database_name])
-            self._databases[database_name] = database
-        else:
-            database = self._databases[database_name]
+                    self._evict(keep=database_name)
 
         return database
 
+    def evict_idle(self):
+        """
+        Evict the databases that have been idle for too long, and return their number.
+        """
+        with self._creating:
+            return self._evict()
+
+    def collection_stats(self):
+        """
+        The hits, misses and refreshes of the known collection names, summed over all databases.
+        """
+        stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+        for database in list(self._databases.values()):
+            for key, value in database.collection_stats.items():
+                stats[key] += value
+
+        return stats
+
+    def _evict(self, keep=None):
+        evicted = []
+        candidates = [(self._last_used.get(name, 0), name) for name, database in list(self._databases.items())
+                      if name != keep and name not in self._pinned and not database.open_cursors()]
+
+        if self.max_idle is not None:
+            current = self.clock()
+            evicted.extend(name for used, name in candidates if current - used >= self.max_idle)
+
+        if self.max_databases is not None:
+            remaining = len(self._databases) - len(evicted) - self.max_databases
+            if remaining > 0:
+                evicted.extend(name for _, name in sorted(candidates)[:remaining] if name not in evicted)
+
+        for name in evicted:
+            database = self._databases.pop(name, None)
+            self._last_used.pop(name, None)
+
+            if database is not None:
+                self.logger.debug('Evicting database "{database}"', database=name)
+                database.close()
+
+        return len(evicted)
+
     @staticmethod
     def create_mongo_client(host, port):
         try:
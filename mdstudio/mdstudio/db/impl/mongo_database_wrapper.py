@@ -7,8 +7,9 @@ import hashlib
 import pytz
 import random
 import six
+import time
 from bson import ObjectId
-from pymongo import ReturnDocument, IndexModel
+from pymongo import ReturnDocument, ReplaceOne
 from pymongo.cursor import Cursor
 
 from mdstudio.api.context import ContextCallable
@@ -33,10 +34,20 @@ class MongoDatabaseWrapper(IDatabase, ContextCallable):
 
     _logger = Logger()
 
+    # Maximal number of seconds the known collection names are used before they are listed again
+    collection_refresh_interval = 60
+
+    clock = time.time
+
     def __init__(self, database_name, db):
         self._database_name = database_name
         self._db = db
 
+        # The collection names are listed lazily, and again on a miss, as another process may have created it
+        self._collections = None
+        self._collections_listed = None
+        self.collection_stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+
         # store the cursors for 10 minutes as described here
         # https://docs.mongodb.com/v3.0/core/cursors/
         # @TODO:  this method is really insecure since we can ask arbitrary cursors,
@@ -44,6 +55,26 @@ class MongoDatabaseWrapper(IDatabase, ContextCallable):
         self._cursors = CacheDict(max_age_seconds=10 * 60)
         ContextCallable.__init__(self)
 
+    def open_cursors(self):
+        """
+        The number of cursors that can still be continued with `more`.
+        """
+        return sum(1 for cursor_id in list(self._cursors.keys()) if cursor_id in self._cursors)
+
+    def close(self):
+        """
+        Close the cursors that are still open, for when the database is no longer used.
+        """
+        for cursor_id in list(self._cursors.keys()):
+            try:
+                cursor, _ = self._cursors[cursor_id]
+            except KeyError:
+                continue
+
+            cursor.close()
+
+        self._cursors.clear()
+
     @make_deferred
     def more(self, cursor_id, claims=None):
         # type: (str, Optional[dict]) -> Dict[str, Any]
@@ -100,6 +131,34 @@ class MongoDatabaseWrapper(IDatabase, ContextCallable):
 
         return self._update_response(upsert, result=replace_result)
 
+    @make_deferred
+    def replace_many(self, collection, replacements, upsert=False, fields=None, claims=None):
+        # type: (CollectionType, List[Dict[str, DocumentType]], bool, Optional[Fields], Optional[dict]) -> Dict[str, Any]
+        db_collection = self._get_collection(collection, upsert)
+
+        if not db_collection or not replacements:
+            return {
+                'matched': 0,
+                'modified': 0
+            }
+
+        self._convert_fields(fields, {'replacements': replacements}, ['replacements.filter', 'replacements.replacement'], claims)
+
+        # All replacements are sent to the database in one bulk write
+        result = db_collection.bulk_write([ReplaceOne(self._prepare_for_mongo(r['filter']),
+                                                      self._prepare_for_mongo(r['replacement']), upsert=upsert)
+                                           for r in replacements])
+
+        response = {
+            'matched': result.matched_count,
+            'modified': result.modified_count
+        }
+
+        if upsert and result.upserted_ids:
+            response['upsertedIds'] = [str(oid) for _, oid in sorted(result.upserted_ids.items())]
+
+        return response
+
     @make_deferred
     def count(self, collection=None, filter=None, skip=None, limit=None, fields=None, claims=None, cursor_id=None,
               with_limit_and_skip=False):
@@ -336,15 +395,13 @@ class MongoDatabaseWrapper(IDatabase, ContextCallable):
     @make_deferred
     def create_indexes(self, collection, indexes):
         # type: (CollectionType, str, List[Index]) -> Any
-        db_collection = self._get_collection(collection)
+        db_collection = self._get_collection(collection, create=True)
 
         names = []
         if db_collection:
-            models = []
-            for i in models:
-                models.append(IndexModel(**i.to_dict(create=True, to_mongo=True)))
-
-            names = db_collection.create_indexes(models)
+            for i in indexes:
+                index = i.to_dict(create=True, to_mongo=True)
+                names.append(db_collection.create_index(index.pop('keys'), **index))
         return {
             'names': names
         }
@@ -459,19 +516,19 @@ class MongoDatabaseWrapper(IDatabase, ContextCallable):
             for _ in range(size):
                 doc = cursor.next()
                 self._prepare_for_json(doc)
-                if fields and claims:
-                    fields.parse_result(doc, claims)
                 results.append(doc)
         except AttributeError:
             for doc in cursor:
                 self._prepare_for_json(doc)
-                if fields and claims:
-                    fields.parse_result(doc, claims)
                 results.append(doc)
                 if len(results) >= max_size:
                     break
             size = len(results)
 
+        # the encrypted fields of the whole batch are decrypted at once
+        if fields and claims:
+            fields.parse_results(results, claims)
+
         # cache the cursor for later use
         # by default it will be available for 10 minutes we also
         # hash the cursor id to make random guessing a lot harder
@@ -523,15 +580,31 @@ class MongoDatabaseWrapper(IDatabase, ContextCallable):
         else:
             collection_name = collection
 
-        if collection_name not in self._db.collection_names():
-            if create:
-                self._logger.info('Creating collection {collection} in {database}', collection=collection_name,
-                                  database=self._database_name)
-            else:
-                return None
+        if self._collections is None or self.clock() - self._collections_listed >= self.collection_refresh_interval:
+            self._refresh_collections()
+
+        if collection_name in self._collections:
+            self.collection_stats['hits'] += 1
+        else:
+            self.collection_stats['misses'] += 1
+            self._refresh_collections()
+
+            if collection_name not in self._collections:
+                if create:
+                    self._logger.info('Creating collection {collection} in {database}', collection=collection_name,
+                                      database=self._database_name)
+                    # The collection itself is created by the first write
+                    self._collections = self._collections | {collection_name}
+                else:
+                    return None
 
         return self._db[collection_name]
 
+    def _refresh_collections(self):
+        self._collections = frozenset(self._db.collection_names())
+        self._collections_listed = self.clock()
+        self.collection_stats['refreshes'] += 1
+
     @staticmethod
     def _convert_fields(fields, var_map, prefixes, claims=None):
         if fields:
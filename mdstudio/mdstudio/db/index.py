@@ -29,9 +29,7 @@ class Index(object):
                 return kwargs
 
         if self.keys:
-            kwargs['keys'] = self.keys
-            for i, k in enumerate(kwargs[kwargs['keys']]):
-                kwargs['keys'][i][1] = str(kwargs['keys'][i][1])
+            kwargs['keys'] = [[k, int(mode) if to_mongo else str(mode)] for k, mode in self.keys]
         if self.unique:
             kwargs['unique'] = self.unique
         if self.documentTTL:
@@ -0,0 +1,121 @@
+import base64
+import multiprocessing
+from threading import Condition
+from timeit import default_timer
+from typing import List, Tuple
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+
+def pbkdf2(password, salt, iterations, length=32):
+    # type: (bytes, bytes, int, int) -> bytes
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=length,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend()
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
+
+def _derive_all(items):
+    return [pbkdf2(*item) for item in items]
+
+
+class KeyDerivation(object):
+    """
+    Runs PBKDF2-HMAC-SHA256 derivations in a dedicated process pool when `processes` is set, and in the calling
+    thread otherwise. The calling thread still blocks until its derivations are done, but the hashing itself does
+    not hold the interpreter lock of this process, so it does not compete with the reactor and the other threads.
+
+    Derivations are submitted in batches of `batch_size`, and the number of derivations and the time spent on them
+    are counted to report the derivation rate. Reconfiguring or shutting down waits for the running derivations.
+    """
+
+    def __init__(self, processes=None, batch_size=8):
+        self.processes = processes
+        self.batch_size = batch_size
+        self.derived = 0
+        self.seconds = 0.0
+        self._pool = None
+        self._running = 0
+        self._lock = Condition()
+
+    def configure(self, processes=None, batch_size=None):
+        with self._lock:
+            self._close()
+            self.processes = processes
+            if batch_size:
+                self.batch_size = batch_size
+
+    def derive(self, password, salt, iterations):
+        # type: (bytes, bytes, int) -> bytes
+        return self.derive_many([(password, salt, iterations)])[0]
+
+    def derive_many(self, items):
+        # type: (List[Tuple[bytes, bytes, int]]) -> List[bytes]
+        items = list(items)
+        if not items:
+            return []
+
+        start = default_timer()
+
+        with self._lock:
+            pool = self._get_pool()
+            batch_size = self.batch_size
+            self._running += 1
+
+        try:
+            if pool is None:
+                results = _derive_all(items)
+            else:
+                batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+                results = [key for batch in pool.map(_derive_all, batches) for key in batch]
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._lock.notify_all()
+
+        with self._lock:
+            self.derived += len(items)
+            self.seconds += default_timer() - start
+
+        return results
+
+    def rate(self):
+        """
+        The number of derivations per second spent deriving.
+        """
+        with self._lock:
+            return self.derived / self.seconds if self.seconds else 0.0
+
+    def shutdown(self):
+        with self._lock:
+            self._close()
+
+    def _get_pool(self):
+        if not self.processes:
+            return None
+
+        if self._pool is None:
+            # Forking a threaded process is unsafe, so the workers start from a fresh interpreter
+            self._pool = multiprocessing.get_context('spawn').Pool(self.processes)
+
+        return self._pool
+
+    def _close(self):
+        # The pool is only closed once the running derivations have their results
+        while self._running:
+            self._lock.wait()
+
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+# Shared by the fields and key repository of this process
+key_derivation = KeyDerivation()
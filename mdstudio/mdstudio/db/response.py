@@ -44,3 +44,18 @@ class ReplaceOneResponse(object):
         self.matched = response['matched']
         self.modified = response['modified']
         self.upserted_id = response.get('upsertedId', None)
+
+
+class ReplaceManyResponse(object):
+    # type: int
+    matched = 0
+    # type: int
+    modified = 0
+    # type: List[str]
+    upserted_ids = []
+
+    def __init__(self, response):
+        # type: (dict) -> None
+        self.matched = response['matched']
+        self.modified = response['modified']
+        self.upserted_ids = response.get('upsertedIds', [])
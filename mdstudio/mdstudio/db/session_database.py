@@ -72,6 +72,18 @@ class SessionDatabaseWrapper(IDatabase, ContextCallable):
 
         return self._call('replace_one', request)
 
+    def replace_many(self, collection, replacements, upsert=False, fields=None):
+        # type: (CollectionType, List[Dict[str, DocumentType]], bool, Optional[Fields]) -> Dict[str, Any]
+        request = {
+            'collection': collection,
+            'replacements': replacements,
+            'upsert': upsert
+        }
+        if fields:
+            request['fields'] = fields.to_dict()
+
+        return self._call('replace_many', request)
+
     def count(self, collection, filter=None, skip=None, limit=None, fields=None, cursor_id=None, with_limit_and_skip=False):
         # type: (CollectionType, Optional[DocumentType], Optional[int], Optional[int], Optional[Fields], Optional[str], bool) -> Dict[str, Any]
         request = {
@@ -263,14 +275,9 @@ class SessionDatabaseWrapper(IDatabase, ContextCallable):
 
     def create_indexes(self, collection, indexes):
         # type: (CollectionType, str, List[Index]) -> Any
-        indexes = []
-
-        for i in indexes:
-            indexes.append(i.to_dict(create=True, to_mongo=False))
-
         return self._call('create_indexes', {
             'collection': collection,
-            'indexes': indexes
+            'indexes': [i.to_dict(create=False, to_mongo=False) for i in indexes]
         })
 
     def drop_indexes(self, collection, indexes):
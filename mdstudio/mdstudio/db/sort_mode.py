@@ -18,3 +18,11 @@ class SortMode(Enum):
 
     def __int__(self):
         return self.value
+
+    @staticmethod
+    def from_string(name):
+        for mode in SortMode:
+            if mode.fullname == name:
+                return mode
+
+        raise ValueError('Unknown sort mode {}'.format(name))
@@ -0,0 +1,98 @@
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed, fail
+
+from mdstudio.util.exception import MDStudioException
+
+
+class LimitExceeded(MDStudioException):
+    pass
+
+
+class ConcurrencyLimiter(object):
+    """
+    Bounds the number of concurrently running calls. Calls beyond `max_concurrency` wait in a queue of at most
+    `max_queue` entries, for at most `queue_timeout` seconds. Calls that do not fit in the queue, or time out
+    while waiting, fail with a `LimitExceeded` exception.
+    """
+
+    def __init__(self, max_concurrency, max_queue=0, queue_timeout=None, clock=reactor):
+        if max_concurrency < 1:
+            raise ValueError('The maximum concurrency should be at least 1, got {}'.format(max_concurrency))
+
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.running = 0
+        self.waiting = deque()
+
+    @property
+    def queued(self):
+        return len(self.waiting)
+
+    def acquire(self):
+        if self.running < self.max_concurrency:
+            self.running += 1
+            return succeed(None)
+
+        if len(self.waiting) >= self.max_queue:
+            return fail(LimitExceeded('The queue is full'))
+
+        waiter = Deferred(canceller=self._remove)
+        timeout = None
+        if self.queue_timeout is not None:
+            timeout = self.clock.callLater(self.queue_timeout, self._timeout, waiter)
+
+        self.waiting.append((waiter, timeout))
+        return waiter
+
+    def release(self):
+        if self.waiting:
+            # The slot is handed over to the first waiting call
+            waiter, timeout = self.waiting.popleft()
+            if timeout is not None:
+                timeout.cancel()
+            waiter.callback(None)
+        else:
+            self.running -= 1
+
+    def run(self, f, *args, **kwargs):
+        """
+        Run `f` once a slot is available, and release the slot when its result is available.
+        """
+        def _run(_):
+            try:
+                result = f(*args, **kwargs)
+            except Exception:
+                self.release()
+                raise
+
+            if isinstance(result, Deferred):
+                # Chainables only pretend to be a Deferred, so their result is passed on to a real one
+                d = Deferred()
+                result.addCallbacks(d.callback, d.errback)
+                result = d
+            else:
+                result = succeed(result)
+
+            return result.addBoth(_release)
+
+        def _release(result):
+            self.release()
+            return result
+
+        return self.acquire().addCallback(_run)
+
+    def _timeout(self, waiter):
+        self._remove(waiter, cancel_timeout=False)
+        waiter.errback(LimitExceeded('Timed out while waiting in the queue'))
+
+    def _remove(self, waiter, cancel_timeout=True):
+        for entry in self.waiting:
+            if entry[0] is waiter:
+                self.waiting.remove(entry)
+                if cancel_timeout and entry[1] is not None:
+                    entry[1].cancel()
+                break
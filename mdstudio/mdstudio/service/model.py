@@ -8,7 +8,7 @@ from mdstudio.db.database import DocumentType, ProjectionOperators, SortOperator
 from mdstudio.db.fields import Fields
 from mdstudio.db.impl.connection import GlobalConnection
 from mdstudio.db.index import Index
-from mdstudio.db.response import ReplaceOneResponse, UpdateOneResponse, UpdateManyResponse
+from mdstudio.db.response import ReplaceOneResponse, ReplaceManyResponse, UpdateOneResponse, UpdateManyResponse
 from mdstudio.deferred.chainable import chainable, Chainable
 from mdstudio.deferred.return_value import return_value
 from mdstudio.api.context import ContextCallable
@@ -97,6 +97,15 @@ class Model(ContextCallable):
                                                fields=fields)
         return self.wrapper.transform(replace_one, ReplaceOneResponse)
 
+    def replace_many(self, replacements, upsert=False, fields=None):
+        # type: (List[Dict[str, DocumentType]], bool, Optional[Fields]) -> Union[ReplaceManyResponse, Chainable]
+        fields = self.fields(fields)
+        replace_many = self.wrapper.replace_many(self.collection,
+                                                 replacements=replacements,
+                                                 upsert=upsert,
+                                                 fields=fields)
+        return self.wrapper.transform(replace_many, ReplaceManyResponse)
+
     def count(self, filter=None, skip=None, limit=None, fields=None, cursor_id=None, with_limit_and_skip=False):
         # type: (Optional[DocumentType], Optional[int], Optional[int], Optional[Fields], Optional[str], bool) -> Union[int, Chainable]
         fields = self.fields(fields)
@@ -0,0 +1,135 @@
+import time
+
+from mock import mock
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from mdstudio.api.capability import CapabilityCache, CLAIMS_VERSION, generate_request_key, public_request_key, \
+    request_proof, verify_request_proof
+from mdstudio.api.endpoint import WampEndpoint
+from mdstudio.api.request_hash import request_hash
+from mdstudio.component.impl.common import CommonSession
+from mdstudio.deferred.chainable import test_chainable
+
+
+class TestRequestProof(TestCase):
+    def setUp(self):
+        self.key = generate_request_key()
+        self.public_key = public_request_key(self.key)
+
+    def test_verify(self):
+        proof = request_proof(self.key, request_hash({'foo': 'bar'}))
+
+        self.assertTrue(verify_request_proof(self.public_key, request_hash({'foo': 'bar'}), proof))
+        self.assertFalse(verify_request_proof(self.public_key, request_hash({'foo': 'baz'}), proof))
+        self.assertFalse(verify_request_proof(public_request_key(generate_request_key()), request_hash({'foo': 'bar'}), proof))
+        self.assertFalse(verify_request_proof(self.public_key, request_hash({'foo': 'bar'}), None))
+        self.assertFalse(verify_request_proof(self.public_key, request_hash({'foo': 'bar'}), 'invalid'))
+        self.assertFalse(verify_request_proof('invalid', request_hash({'foo': 'bar'}), proof))
+
+    def test_public_key_cannot_prove(self):
+        # The token only holds the public key, which is not enough to make a proof for another request
+        self.assertRaises(AttributeError, request_proof, self.key.public_key(), request_hash({'foo': 'bar'}))
+
+    def test_matches_request(self):
+        request = {'foo': 'bar'}
+        proof = request_proof(self.key, request_hash(request))
+
+        self.assertTrue(WampEndpoint._matches_request({'requestKey': self.public_key}, request, proof))
+        self.assertFalse(WampEndpoint._matches_request({'requestKey': self.public_key}, {'foo': 'baz'}, proof))
+        self.assertFalse(WampEndpoint._matches_request({'requestKey': self.public_key, 'requestHash': request_hash(request)}, request, None))
+        self.assertTrue(WampEndpoint._matches_request({'requestHash': request_hash(request)}, request, None))
+        self.assertFalse(WampEndpoint._matches_request({}, request, None))
+
+
+class TestCapabilityCache(TestCase):
+    def setUp(self):
+        class TestSession(CommonSession):
+            load_settings = mock.MagicMock()
+            validate_settings = mock.MagicMock()
+
+        self.session = TestSession()
+        self.cache = CapabilityCache(self.session, lifetime=60)
+        self.claims = {'uri': 'vendor.component.endpoint.test', 'action': 'call'}
+
+    @staticmethod
+    def capability(lifetime=60):
+        return defer.succeed({'token': 'token', 'lifetime': lifetime})
+
+    @test_chainable
+    def test_get(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=self.capability()) as call:
+            capability = yield self.cache.get(self.claims)
+            self.assertEqual(capability['token'], 'token')
+
+            yield self.cache.get(dict(self.claims))
+
+        call.assert_called_once_with(u'mdstudio.auth.endpoint.sign-capability', self.claims, 60,
+                                     request_key=public_request_key(capability['key']))
+
+    @test_chainable
+    def test_get_different_claims(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=lambda *args, **kwargs: self.capability()) as call:
+            yield self.cache.get(self.claims)
+            yield self.cache.get(dict(self.claims, asGroup='group'))
+
+        self.assertEqual(call.call_count, 2)
+
+    @test_chainable
+    def test_get_expired(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=lambda *args, **kwargs: self.capability()) as call:
+            capability = yield self.cache.get(self.claims)
+            capability['expires'] = time.time()
+            yield self.cache.get(self.claims)
+
+        self.assertEqual(call.call_count, 2)
+
+    @test_chainable
+    def test_invalidate(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=lambda *args, **kwargs: self.capability()) as call:
+            yield self.cache.get(self.claims)
+            self.cache.invalidate(self.claims)
+            yield self.cache.get(self.claims)
+
+        self.assertEqual(call.call_count, 2)
+
+    @test_chainable
+    def test_get_unauthorized(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(None)):
+            self.assertIsNone((yield self.cache.get(self.claims)))
+
+        self.assertEqual(len(self.cache._capabilities), 0)
+
+    @test_chainable
+    def test_get_bounded(self):
+        cache = CapabilityCache(self.session, lifetime=60, max_capabilities=2)
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=lambda *args, **kwargs: self.capability()):
+            for group in ['a', 'b', 'c']:
+                yield cache.get(dict(self.claims, asGroup=group))
+
+        self.assertEqual(len(cache._capabilities), 2)
+        self.assertNotIn(cache._key(dict(self.claims, asGroup='a')), cache._capabilities)
+
+    @test_chainable
+    def test_get_pending(self):
+        signed = defer.Deferred()
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=signed) as call:
+            first = self.cache.get(self.claims)
+            second = self.cache.get(self.claims)
+            signed.callback({'token': 'token', 'lifetime': 60})
+
+            self.assertEqual((yield first)['token'], 'token')
+            self.assertEqual((yield second)['token'], 'token')
+
+        call.assert_called_once()
+
+    def test_supported(self):
+        self.assertFalse(self.cache.supported('vendor.component.endpoint.test'))
+
+        self.cache.learn('vendor.component.endpoint.test', {'data': 1, 'claimsVersion': CLAIMS_VERSION})
+        self.assertTrue(self.cache.supported('vendor.component.endpoint.test'))
+        self.assertFalse(self.cache.supported('vendor.component.endpoint.other'))
+
+        self.cache.learn('vendor.component.endpoint.test', {'data': 1})
+        self.assertFalse(self.cache.supported('vendor.component.endpoint.test'))
@@ -1 +1,294 @@
+import time
+
+from mock import mock
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
 from mdstudio.api.endpoint import *
+from mdstudio.api.metrics import Metrics
+from mdstudio.api.response_cache import ResponseCache
+from mdstudio.api.validation import ValidationMode, ValidationPolicy
+from mdstudio.deferred.chainable import test_chainable
+
+
+class TestValidationPolicy(TestCase):
+    def test_from_config(self):
+        self.assertEqual(ValidationPolicy.from_config(None).mode, ValidationMode.Full)
+        self.assertEqual(ValidationPolicy.from_config('input').mode, ValidationMode.InputOnly)
+
+        policy = ValidationPolicy.from_config({'mode': 'sampled', 'sampleRate': 10})
+        self.assertEqual(policy.mode, ValidationMode.SampledOutput)
+        self.assertEqual(policy.sample_rate, 10)
+
+        policy = ValidationPolicy(ValidationMode.Off)
+        self.assertIs(ValidationPolicy.from_config(policy), policy)
+
+    def test_from_config_invalid(self):
+        self.assertRaises(ValueError, ValidationPolicy.from_config, 'sometimes')
+        self.assertRaises(ValueError, ValidationPolicy.from_config, {'mode': 'sampled', 'sampleRate': 110})
+        self.assertRaises(ValueError, ValidationPolicy.from_config, 5)
+
+    def test_validate(self):
+        self.assertTrue(ValidationPolicy('full').validate_input())
+        self.assertTrue(ValidationPolicy('full').validate_output())
+        self.assertTrue(ValidationPolicy('input').validate_input())
+        self.assertFalse(ValidationPolicy('input').validate_output())
+        self.assertFalse(ValidationPolicy('off').validate_input())
+        self.assertFalse(ValidationPolicy('off').validate_output())
+        self.assertTrue(ValidationPolicy('log').validate_output())
+        self.assertFalse(ValidationPolicy('log').strict)
+
+    def test_validate_sampled(self):
+        policy = ValidationPolicy('sampled', 10)
+        with mock.patch('random.random', return_value=0.05):
+            self.assertTrue(policy.validate_output())
+        with mock.patch('random.random', return_value=0.5):
+            self.assertFalse(policy.validate_output())
+
+
+class TestWampEndpointValidation(TestCase):
+    def setUp(self):
+        self.instance = mock.MagicMock()
+        self.instance.component_config.static.vendor = 'vendor'
+        self.instance.component_config.static.component = 'component'
+        self.instance.component_config.settings = {}
+        self.instance.metrics = Metrics()
+        self.instance.authorize_request.return_value = True
+        self.result = {'value': 'not a number'}
+
+    def tearDown(self):
+        MDStudioClaimSchema._instance = None
+
+    def endpoint(self, validation=None):
+        def handler(instance, request, claims):
+            return self.result
+
+        ep = WampEndpoint(handler, 'test', {'type': 'object', 'properties': {'value': {'type': 'integer'}}},
+                          {'type': 'object', 'properties': {'value': {'type': 'integer'}}}, validation=validation)
+        ep.set_instance(self.instance)
+        ep.validate_claims = mock.MagicMock(return_value=None)
+        self.instance.claims_verifier.verify.side_effect = lambda signed_claims: defer.succeed({'claims': {}})
+        return ep
+
+    @test_chainable
+    def test_full(self):
+        ep = self.endpoint()
+
+        result = yield ep.execute({'value': 'nan'}, 'claims')
+        self.assertIn('Input validation', result['error'])
+
+        result = yield ep.execute({'value': 1}, 'claims')
+        self.assertIn('Output validation', result['error'])
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['validation.full'], 2)
+        self.assertEqual(metrics['timings']['validation.input']['count'], 2)
+        self.assertEqual(metrics['timings']['validation.output']['count'], 1)
+        self.assertEqual(metrics['timings']['verify']['count'], 2)
+        self.assertEqual(metrics['timings']['handler']['count'], 1)
+        self.assertEqual(metrics['timings']['execute']['count'], 2)
+
+    @test_chainable
+    def test_input_only(self):
+        ep = self.endpoint('input')
+
+        result = yield ep.execute({'value': 1}, 'claims')
+        self.assertEqual(result, {'data': self.result})
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['validation.output.skipped'], 1)
+
+    @test_chainable
+    def test_log(self):
+        ep = self.endpoint('log')
+
+        result = yield ep.execute({'value': 'nan'}, 'claims')
+        self.assertEqual(result, {'data': self.result})
+        self.assertEqual(self.instance.log.warn.call_count, 2)
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['validation.errors.ignored'], 2)
+
+    @test_chainable
+    def test_off(self):
+        ep = self.endpoint('off')
+
+        result = yield ep.execute({'value': 'nan'}, 'claims')
+        self.assertEqual(result, {'data': self.result})
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['validation.input.skipped'], 1)
+        self.assertEqual(metrics['counters']['validation.output.skipped'], 1)
+
+    @test_chainable
+    def test_limit(self):
+        self.instance.component_config.settings = {'maxConcurrency': 1}
+        ep = self.endpoint('off')
+        handler = defer.Deferred()
+        ep.call_wrapped = mock.MagicMock(return_value=handler)
+
+        first = ep.execute({'value': 1}, 'claims')
+        result = yield ep.execute({'value': 1}, 'claims')
+        self.assertTrue(result['retry'])
+        self.assertIn('Too many concurrent calls', result['error'])
+
+        handler.callback(self.result)
+        self.assertEqual((yield first), {'data': self.result})
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['limit.rejected'], 1)
+        self.assertEqual(metrics['gauges'], {'limit.running': 0, 'limit.queued': 0})
+
+    @test_chainable
+    def test_claims_version(self):
+        ep = self.endpoint('off')
+
+        result = yield ep({'value': 1}, 'claims')
+        self.assertEqual(result, {'data': self.result, 'claimsVersion': 2})
+
+    @test_chainable
+    def test_claims_version_error(self):
+        ep = self.endpoint('off')
+        ep.call_wrapped = mock.MagicMock(side_effect=ValueError('failed'))
+
+        try:
+            yield ep({'value': 1}, 'claims')
+        except ApplicationError as e:
+            self.assertEqual(e.error, ENDPOINT_ERROR)
+            self.assertEqual(e.kwargs, {'claimsVersion': 2})
+        else:
+            self.fail('The error was not raised')
+
+        ep.call_wrapped = mock.MagicMock(side_effect=ApplicationError(u'vendor.error', 'failed'))
+
+        try:
+            yield ep({'value': 1}, 'claims')
+        except ApplicationError as e:
+            self.assertEqual(e.error, u'vendor.error')
+            self.assertEqual(e.kwargs, {'claimsVersion': 2})
+        else:
+            self.fail('The error was not raised')
+
+    def test_limit_decorator(self):
+        self.instance.component_config.settings = {'maxConcurrency': 1, 'maxQueue': 4}
+
+        ep = WampEndpoint(None, 'test', {}, {}, max_concurrency=10, queue_timeout=2)
+        ep.set_instance(self.instance)
+        self.assertEqual(ep.limiter.max_concurrency, 10)
+        self.assertEqual(ep.limiter.max_queue, 4)
+        self.assertEqual(ep.limiter.queue_timeout, 2)
+
+    @test_chainable
+    def test_cache(self):
+        ep = self.endpoint()
+        ep.response_cache = ResponseCache(remote=False)
+        ep.call_wrapped = mock.MagicMock(return_value={'value': 1})
+
+        self.assertEqual((yield ep.execute({'value': 1}, 'claims')), {'data': {'value': 1}})
+        self.assertEqual((yield ep.execute({'value': 1}, 'claims')), {'data': {'value': 1}})
+        self.assertEqual((yield ep.execute({'value': 2}, 'claims')), {'data': {'value': 1}})
+        self.assertEqual(ep.call_wrapped.call_count, 2)
+
+        yield ep.invalidate_cache({'value': 1}, {})
+        yield ep.execute({'value': 1}, 'claims')
+        self.assertEqual(ep.call_wrapped.call_count, 3)
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['cache.hit.local'], 1)
+        self.assertEqual(metrics['counters']['cache.miss'], 3)
+
+    @test_chainable
+    def test_cache_errors(self):
+        ep = self.endpoint()
+        ep.response_cache = ResponseCache(remote=False)
+
+        yield ep.execute({'value': 1}, 'claims')
+        yield ep.execute({'value': 1}, 'claims')
+
+        metrics = self.instance.metrics.snapshot()['vendor.component.endpoint.test']
+        self.assertEqual(metrics['counters']['cache.miss'], 2)
+
+    def test_settings(self):
+        self.instance.component_config.settings = {'validation': {'mode': 'sampled', 'sampleRate': 5}}
+
+        self.assertEqual(self.endpoint().validation.mode, ValidationMode.SampledOutput)
+        self.assertEqual(self.endpoint('full').validation.mode, ValidationMode.Full)
+
+
+class TestWampEndpointClaims(TestCase):
+    def setUp(self):
+        self.instance = mock.MagicMock()
+        self.instance.component_config.static.vendor = 'vendor'
+        self.instance.component_config.static.component = 'component'
+        self.instance.component_config.settings = {'claimsMemoSize': 2}
+        self.instance.metrics = Metrics()
+        self.instance.authorize_request.return_value = True
+
+        self.ep = WampEndpoint(None, 'test', {}, {})
+        self.ep.set_instance(self.instance)
+        self.schema = mock.MagicMock()
+        self.ep.claim_schemas = [self.schema]
+
+        self.request = CanonicalRequest({'value': 1})
+
+    def tearDown(self):
+        MDStudioClaimSchema._instance = None
+
+    def claims(self, **kwargs):
+        claims = {
+            'uri': 'vendor.component.endpoint.test',
+            'action': 'call',
+            'requestHash': self.request.hash,
+            'exp': time.time() + 60
+        }
+        claims.update(kwargs)
+        return {'claims': claims}
+
+    def test_memoized(self):
+        claims = self.claims()
+
+        self.assertIsNone(self.ep.validate_claims(claims, self.request, signed_claims='token'))
+        self.assertIsNone(self.ep.validate_claims(claims, self.request, signed_claims='token'))
+
+        self.schema.validate.assert_called_once()
+        self.instance.authorize_request.assert_called_once()
+        self.assertEqual(self.instance.metrics.snapshot()['vendor.component.endpoint.test']['counters']['validation.claims.memoized'], 1)
+
+    def test_memoized_request_hash(self):
+        claims = self.claims()
+        self.ep.validate_claims(claims, self.request, signed_claims='token')
+
+        result = self.ep.validate_claims(claims, CanonicalRequest({'value': 2}), signed_claims='token')
+        self.assertEqual(result, {'error': 'Request did not match the signed request'})
+
+    def test_memo_expired(self):
+        claims = self.claims(exp=time.time() - 1)
+
+        self.ep.validate_claims(claims, self.request, signed_claims='token')
+        self.ep.validate_claims(claims, self.request, signed_claims='token')
+
+        self.assertEqual(self.instance.authorize_request.call_count, 2)
+
+    def test_not_memoized_unauthorized(self):
+        self.instance.authorize_request.return_value = False
+        claims = self.claims()
+
+        self.assertIn('Unauthorized', self.ep.validate_claims(claims, self.request, signed_claims='token')['error'])
+        self.assertIn('Unauthorized', self.ep.validate_claims(claims, self.request, signed_claims='token')['error'])
+        self.assertEqual(self.instance.authorize_request.call_count, 2)
+
+    def test_memo_bounded(self):
+        for token in ['a', 'b', 'c']:
+            self.ep.validate_claims(self.claims(), self.request, signed_claims=token)
+
+        self.assertEqual(len(self.ep.claims_memo), 2)
+
+    def test_memo_disabled(self):
+        self.instance.component_config.settings = {'claimsMemoSize': 0}
+        self.ep.set_instance(self.instance)
+
+        self.ep.validate_claims(self.claims(), self.request, signed_claims='token')
+        self.ep.validate_claims(self.claims(), self.request, signed_claims='token')
+
+        self.assertIsNone(self.ep.claims_memo)
+        self.assertEqual(self.instance.authorize_request.call_count, 2)
@@ -0,0 +1,73 @@
+from twisted.trial.unittest import TestCase
+
+from mdstudio.api.metrics import Metrics, Histogram
+
+
+class TestMetrics(TestCase):
+    def test_increment(self):
+        metrics = Metrics()
+        metrics.increment('uri', 'calls')
+        metrics.increment('uri', 'calls', 2)
+        metrics.increment('other', 'calls')
+
+        self.assertEqual(metrics.snapshot(), {
+            'uri': {'counters': {'calls': 3}, 'timings': {}, 'gauges': {}},
+            'other': {'counters': {'calls': 1}, 'timings': {}, 'gauges': {}}
+        })
+
+    def test_timed(self):
+        metrics = Metrics()
+        with metrics.timed('uri', 'handler'):
+            pass
+        metrics.record('uri', 'handler', 1.0)
+
+        timing = metrics.snapshot()['uri']['timings']['handler']
+        self.assertEqual(timing['count'], 2)
+        self.assertGreaterEqual(timing['total'], 1.0)
+        self.assertAlmostEqual(timing['mean'], timing['total'] / 2)
+
+    def test_disabled(self):
+        metrics = Metrics(enabled=False)
+        metrics.increment('uri', 'calls')
+        with metrics.timed('uri', 'handler'):
+            pass
+
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_summary(self):
+        metrics = Metrics()
+        metrics.record('uri', 'handler', 0.002)
+        metrics.record('uri', 'handler', 0.004)
+
+        self.assertEqual(metrics.summary(), ['uri handler: 2 calls, mean 3.00ms, p95 4.00ms, max 4.00ms'])
+
+    def test_reset(self):
+        metrics = Metrics()
+        metrics.increment('uri', 'calls')
+        metrics.reset()
+
+        self.assertEqual(metrics.snapshot(), {})
+
+
+class TestHistogram(TestCase):
+    def test_record(self):
+        histogram = Histogram()
+        for seconds in [0.0002, 0.0003, 0.003, 20.0]:
+            histogram.record(seconds)
+
+        result = histogram.to_dict()
+        self.assertEqual(result['count'], 4)
+        self.assertEqual(result['max'], 20.0)
+        self.assertEqual(result['buckets'], {'le0.00025': 1, 'le0.0005': 1, 'le0.005': 1, 'leinf': 1})
+
+    def test_percentile(self):
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(50), 0.0)
+
+        for i in range(99):
+            histogram.record(0.0009)
+        histogram.record(0.9)
+
+        self.assertEqual(histogram.percentile(50), 0.001)
+        self.assertEqual(histogram.percentile(99), 0.001)
+        self.assertEqual(histogram.percentile(100), 0.9)
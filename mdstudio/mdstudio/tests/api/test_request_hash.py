@@ -0,0 +1,47 @@
+import datetime
+import json
+from base64 import b64encode
+from hashlib import sha512
+
+import pytz
+from mock import mock
+from twisted.trial.unittest import TestCase
+
+from mdstudio.api.request_hash import CanonicalRequest, request_hash
+
+
+class TestRequestHash(TestCase):
+    request = {
+        'b': [1, 2, {'d': 'e', 'c': None}],
+        'a': datetime.datetime(2017, 10, 26, 9, 16, tzinfo=pytz.utc)
+    }
+
+    def test_request_hash(self):
+        expected = json.dumps({
+            'a': '2017-10-26T09:16:00+00:00',
+            'b': [1, 2, {'c': None, 'd': 'e'}]
+        }, sort_keys=True).encode('utf8')
+
+        self.assertEqual(request_hash(self.request), b64encode(sha512(expected).digest()).decode('utf8'))
+
+    def test_canonical_request(self):
+        canonical = CanonicalRequest(self.request)
+
+        self.assertEqual(canonical.request['a'], '2017-10-26T09:16:00+00:00')
+        self.assertEqual(canonical.hash, request_hash(self.request))
+        self.assertEqual(request_hash(canonical), canonical.hash)
+
+    def test_canonical_request_copy(self):
+        canonical = CanonicalRequest(self.request)
+        canonical.request['b'][2]['d'] = 'f'
+
+        self.assertEqual(self.request['b'][2]['d'], 'e')
+
+    def test_canonical_request_hashed_once(self):
+        canonical = CanonicalRequest(self.request)
+
+        with mock.patch.object(CanonicalRequest, 'encode', wraps=canonical.encode) as encode:
+            canonical.hash
+            request_hash(canonical)
+
+        encode.assert_called_once()
@@ -0,0 +1,138 @@
+import json
+
+from mock import mock
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from mdstudio.api.response_cache import ResponseCache
+from mdstudio.deferred.chainable import test_chainable
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(ttl=60, size=2)
+        self.cache.clock = mock.MagicMock(return_value=0)
+        self.session = mock.MagicMock()
+        self.session.cache.get.return_value = defer.succeed({'result': None})
+        self.claims = {'username': 'user', 'uri': 'vendor.component.endpoint.test', 'action': 'call', 'exp': 5}
+
+    @test_chainable
+    def test_key(self):
+        key = yield self.cache.key(self.session, 'uri', self.claims, 'hash')
+
+        self.assertEqual(key, (yield self.cache.key(self.session, 'uri', dict(self.claims, exp=6, requestHash='other'), 'hash')))
+        self.assertNotEqual(key, (yield self.cache.key(self.session, 'uri', dict(self.claims, username='other'), 'hash')))
+        self.assertNotEqual(key, (yield self.cache.key(self.session, 'uri', self.claims, 'other')))
+        self.assertNotEqual(key, (yield self.cache.key(self.session, 'other', self.claims, 'hash')))
+        self.session.cache.get.assert_called_with('response#other#generation')
+
+    @test_chainable
+    def test_key_shared_generation(self):
+        key = yield self.cache.key(self.session, 'uri', self.claims, 'hash')
+
+        # Another instance invalidated the cache
+        self.session.cache.get.return_value = defer.succeed({'result': 'generation'})
+
+        self.cache.clock.return_value = 4
+        self.assertEqual(key, (yield self.cache.key(self.session, 'uri', self.claims, 'hash')))
+        self.assertEqual(self.session.cache.get.call_count, 1)
+
+        self.cache.clock.return_value = 5
+        other = yield self.cache.key(self.session, 'uri', self.claims, 'hash')
+        self.assertNotEqual(key, other)
+        self.assertIn('#generation#', other)
+        self.assertEqual(self.session.cache.get.call_count, 2)
+
+    @test_chainable
+    def test_key_generation_failure(self):
+        self.session.cache.get.return_value = defer.fail(Exception('offline'))
+
+        self.assertIsNone((yield self.cache.key(self.session, 'uri', self.claims, 'hash')))
+
+    @test_chainable
+    def test_key_generation_last_known(self):
+        key = yield self.cache.key(self.session, 'uri', self.claims, 'hash')
+
+        self.session.cache.get.return_value = defer.fail(Exception('offline'))
+        self.cache.clock.return_value = 10
+
+        self.assertEqual(key, (yield self.cache.key(self.session, 'uri', self.claims, 'hash')))
+
+    @test_chainable
+    def test_get_local(self):
+        self.cache.put(self.session, 'key', {'value': 1})
+
+        self.assertEqual((yield self.cache.get(self.session, 'key')), ('local', {'value': 1}))
+        self.session.cache.put.assert_called_once_with('key', '{"value": 1}', 60)
+        self.session.cache.get.assert_not_called()
+
+    @test_chainable
+    def test_get_remote(self):
+        self.session.cache.get.return_value = defer.succeed({'result': json.dumps({'value': 1})})
+
+        self.assertEqual((yield self.cache.get(self.session, 'key')), ('remote', {'value': 1}))
+        self.assertEqual(self.cache.local['key'], {'value': 1})
+
+    @test_chainable
+    def test_get_miss(self):
+        self.assertEqual((yield self.cache.get(self.session, 'key')), (None, None))
+
+    @test_chainable
+    def test_get_remote_failure(self):
+        self.session.cache.get.return_value = defer.fail(Exception('offline'))
+
+        self.assertEqual((yield self.cache.get(self.session, 'key')), (None, None))
+
+    @test_chainable
+    def test_local_only(self):
+        cache = ResponseCache(remote=False)
+        cache.put(self.session, 'key', {'value': 1})
+
+        self.assertEqual((yield cache.get(self.session, 'key')), ('local', {'value': 1}))
+        self.session.cache.put.assert_not_called()
+
+    @test_chainable
+    def test_invalidate(self):
+        key = yield self.cache.key(self.session, 'uri', self.claims, 'hash')
+        self.cache.put(self.session, key, {'value': 1})
+        yield self.cache.invalidate(self.session, uri='uri')
+
+        self.assertNotIn(key, self.cache.local)
+        (generation_key, generation), _ = self.session.cache.put.call_args
+        self.assertEqual(generation_key, 'response#uri#generation')
+
+        # The new generation is used right away, without retrieving it
+        other = yield self.cache.key(self.session, 'uri', self.claims, 'hash')
+        self.assertNotEqual(key, other)
+        self.assertIn('#{}#'.format(generation), other)
+        self.assertEqual(self.session.cache.get.call_count, 1)
+
+    @test_chainable
+    def test_invalidate_local(self):
+        cache = ResponseCache(remote=False)
+        key = yield cache.key(self.session, 'uri', self.claims, 'hash')
+        yield cache.invalidate(self.session, uri='uri')
+
+        self.assertNotEqual(key, (yield cache.key(self.session, 'uri', self.claims, 'hash')))
+        self.session.cache.get.assert_not_called()
+        self.session.cache.put.assert_not_called()
+
+    @test_chainable
+    def test_invalidate_key(self):
+        self.cache.put(self.session, 'key', {'value': 1})
+        yield self.cache.invalidate(self.session, 'key')
+
+        self.assertNotIn('key', self.cache.local)
+        self.session.cache.forget.assert_called_once_with('key')
+
+    def test_from_config(self):
+        self.assertIsNone(ResponseCache.from_config(None))
+        self.assertEqual(ResponseCache.from_config(30).ttl, 30)
+
+        cache = ResponseCache.from_config({'ttl': 10, 'size': 5, 'remote': False, 'generationTtl': 2})
+        self.assertEqual(cache.ttl, 10)
+        self.assertEqual(cache.generation_ttl, 2)
+        self.assertEqual(cache.local.max_size, 5)
+        self.assertFalse(cache.remote)
+
+        self.assertRaises(ValueError, ResponseCache.from_config, 'forever')
@@ -1,6 +1,7 @@
 import json
 
 import os
+import unittest
 from faker import Faker
 from jsonschema import ValidationError
 from mock import mock
@@ -8,7 +9,7 @@ from pyfakefs.fake_filesystem_unittest import Patcher, TestCase
 
 from mdstudio.api.exception import RegisterException
 from mdstudio.api.schema import ISchema, ResourceSchema, EndpointSchema, HttpsSchema, InlineSchema, ClaimSchema, validate_json_schema, \
-    MDStudioClaimSchema
+    MDStudioClaimSchema, SchemaValidator, fastjsonschema
 from mdstudio.deferred.chainable import test_chainable
 from mdstudio.unittest.db import DBTestCase
 
@@ -980,6 +981,70 @@ class ValidateTests(TestCase):
         self.assertRaises(ValidationError, validate_json_schema, {'format': 'uri', 'type': 'string'}, 'example')
 
 
+class SchemaValidatorTests(TestCase):
+    schema = {
+        'type': 'object',
+        'properties': {
+            'test': {
+                'type': 'integer',
+                'default': 5
+            }
+        }
+    }
+
+    def test_validate(self):
+        validator = SchemaValidator(self.schema)
+        doc = {}
+        validator.validate(doc)
+        self.assertEqual(doc, {'test': 5})
+        self.assertRaises(ValidationError, validator.validate, {'test': 'nan'})
+
+    @unittest.skipUnless(fastjsonschema, 'fastjsonschema is an optional dependency')
+    def test_validate_compiled(self):
+        validator = SchemaValidator({'type': 'object', 'properties': {'test': {'type': 'integer'}}}, compiled=True)
+        self.assertIsNotNone(validator.compiled)
+
+        validator.validate({'test': 5})
+
+        with self.assertRaises(ValidationError) as context:
+            validator.validate({'test': 'nan'})
+        self.assertEqual(list(context.exception.path), ['test'])
+
+    def test_validate_compiled_default(self):
+        validator = SchemaValidator(self.schema, compiled=True)
+        self.assertIsNone(validator.compiled)
+
+        doc = {}
+        validator.validate(doc)
+        self.assertEqual(doc, {'test': 5})
+
+    def test_validate_compiled_format(self):
+        validator = SchemaValidator({'type': 'object', 'properties': {'time': {'anyOf': [{'type': 'string', 'format': 'date-time'}]}}},
+                                    compiled=True)
+        self.assertIsNone(validator.compiled)
+
+        self.assertRaises(ValidationError, validator.validate, {'time': 'yesterday'})
+
+    def test_validate_compiled_fallback(self):
+        validator = SchemaValidator({'$ref': 'resource://unknown'}, compiled=True)
+        self.assertIsNone(validator.compiled)
+
+    def test_use_compiled(self):
+        session = mock.MagicMock()
+        session.component_config.settings = {'compiledValidation': True}
+        self.assertTrue(SchemaValidator.use_compiled(session))
+        session.component_config.settings = {}
+        self.assertFalse(SchemaValidator.use_compiled(session))
+        self.assertFalse(SchemaValidator.use_compiled(None))
+
+    def test_schema_validator_cached(self):
+        schema = InlineSchema(self.schema)
+        schema.validate({})
+        validator = schema.validator
+        schema.validate({})
+        self.assertIs(schema.validator, validator)
+
+
 class MDStudioClaimSchemaTests(TestCase):
     def test_construction(self):
         with Patcher() as patcher:
@@ -0,0 +1,134 @@
+import datetime
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt import encode as jwt_encode
+from mock import mock
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from mdstudio.api.verifier import ClaimsVerifier
+from mdstudio.component.impl.common import CommonSession
+from mdstudio.deferred.chainable import test_chainable
+
+
+class TestClaimsVerifier(TestCase):
+    def setUp(self):
+        class TestSession(CommonSession):
+            load_settings = mock.MagicMock()
+            validate_settings = mock.MagicMock()
+
+        self.session = TestSession()
+        self.verifier = ClaimsVerifier(self.session)
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        self.published = [{
+            'kid': 'key-1',
+            'key': self.key.public_key().public_bytes(encoding=serialization.Encoding.PEM,
+                                                      format=serialization.PublicFormat.SubjectPublicKeyInfo).decode('ascii'),
+            'algorithm': 'RS256'
+        }]
+
+    def sign(self, claims, kid='key-1', minutes=1):
+        claims = dict(claims, exp=datetime.datetime.utcnow() + datetime.timedelta(minutes=minutes))
+        return jwt_encode(claims, self.key, algorithm='RS256', headers={'kid': kid})
+
+    @test_chainable
+    def test_refresh(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(self.published)) as call:
+            yield self.verifier.refresh()
+
+        call.assert_called_once_with(u'mdstudio.auth.endpoint.verification-keys')
+        self.assertEqual(list(self.verifier.keys.keys()), ['key-1'])
+
+    @test_chainable
+    def test_refresh_failure(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.fail(Exception('offline'))):
+            keys = yield self.verifier.refresh()
+
+        self.assertEqual(keys, {})
+
+    @test_chainable
+    def test_verify_local(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(self.published)):
+            yield self.verifier.refresh()
+
+        claims = self.verifier.verify_local(self.sign({'username': 'test'}))
+        self.assertEqual(claims['claims']['username'], 'test')
+
+    @test_chainable
+    def test_verify_local_expired(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(self.published)):
+            yield self.verifier.refresh()
+
+        self.assertEqual(self.verifier.verify_local(self.sign({'username': 'test'}, minutes=-1)),
+                         {'expired': 'Request token has expired'})
+
+    @test_chainable
+    def test_verify_local_tampered(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(self.published)):
+            yield self.verifier.refresh()
+
+        other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+        token = jwt_encode({'username': 'test'}, other_key, algorithm='RS256', headers={'kid': 'key-1'})
+        self.assertEqual(self.verifier.verify_local(token), {'error': 'Could not verify user'})
+        self.assertEqual(self.verifier.verify_local('garbage'), {'error': 'Could not verify user'})
+
+    def test_verify_local_unknown_key(self):
+        self.assertIsNone(self.verifier.verify_local(self.sign({'username': 'test'})))
+
+    @test_chainable
+    def test_verify_fallback(self):
+        token = self.sign({'username': 'test'})
+
+        def call(procedure, *args):
+            if procedure == u'mdstudio.auth.endpoint.verify':
+                return defer.succeed({'claims': {'username': 'remote'}})
+            return defer.succeed(self.published)
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=call) as m:
+            claims = yield self.verifier.verify(token)
+            self.assertEqual(claims, {'claims': {'username': 'remote'}})
+            self.assertEqual(m.call_count, 2)
+
+            claims = yield self.verifier.verify(token)
+            self.assertEqual(claims['claims']['username'], 'test')
+            self.assertEqual(m.call_count, 2)
+
+    @test_chainable
+    def test_verify_local_memoized(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(self.published)):
+            yield self.verifier.refresh()
+
+        token = self.sign({'username': 'test'})
+        self.verifier.verify_local(token)
+
+        with mock.patch('mdstudio.api.verifier.jwt_decode') as decode:
+            claims = self.verifier.verify_local(token)
+
+        decode.assert_not_called()
+        self.assertEqual(claims['claims']['username'], 'test')
+
+        claims['claims']['username'] = 'changed'
+        self.assertEqual(self.verifier.verify_local(token)['claims']['username'], 'test')
+
+    @test_chainable
+    def test_verify_local_memo_expired(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', return_value=defer.succeed(self.published)):
+            yield self.verifier.refresh()
+
+        token = self.sign({'username': 'test'})
+        expires = self.verifier.verify_local(token)['claims']['exp']
+
+        self.verifier.clock = lambda: expires
+        self.assertEqual(self.verifier.verify_local(token), {'expired': 'Request token has expired'})
+        self.assertEqual(len(self.verifier.memo), 0)
+
+    def test_verify_local_memo_bounded(self):
+        verifier = ClaimsVerifier(self.session, memo_size=2)
+        verifier.keys = dict((key['kid'], verifier._load_key(key)) for key in self.published)
+
+        for i in range(3):
+            verifier.verify_local(self.sign({'username': 'test{}'.format(i)}))
+
+        self.assertEqual(len(verifier.memo), 2)
@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from mock import mock
+
+from mdstudio.collection.lru_dict import LRUDict
+from mdstudio.util.exception import MDStudioException
+
+
+class TestLRUDict(TestCase):
+    def test_evict(self):
+        d = LRUDict(2)
+        d['a'] = 1
+        d['b'] = 2
+        d['c'] = 3
+
+        self.assertNotIn('a', d)
+        self.assertEqual(d['b'], 2)
+        self.assertEqual(d['c'], 3)
+        self.assertEqual(len(d), 2)
+
+    def test_evict_least_recently_used(self):
+        d = LRUDict(2)
+        d['a'] = 1
+        d['b'] = 2
+        self.assertEqual(d['a'], 1)
+        d['c'] = 3
+
+        self.assertIn('a', d)
+        self.assertNotIn('b', d)
+
+    def test_overwrite(self):
+        d = LRUDict(2)
+        d['a'] = 1
+        d['b'] = 2
+        d['a'] = 3
+        d['c'] = 4
+
+        self.assertEqual(d['a'], 3)
+        self.assertNotIn('b', d)
+
+    def test_expire(self):
+        d = LRUDict(2, max_age_seconds=10)
+        with mock.patch('time.time', return_value=100):
+            d['a'] = 1
+        with mock.patch('time.time', return_value=105):
+            self.assertEqual(d.get('a'), 1)
+        with mock.patch('time.time', return_value=110):
+            self.assertIsNone(d.get('a'))
+            self.assertEqual(len(d), 0)
+
+    def test_pop(self):
+        d = LRUDict(2)
+        d['a'] = 1
+
+        self.assertEqual(d.pop('a'), 1)
+        self.assertIsNone(d.pop('a', None))
+        self.assertRaises(KeyError, d.pop, 'a')
+
+    def test_invalid_size(self):
+        self.assertRaises(MDStudioException, LRUDict, 0)
+
+    def test_keys(self):
+        d = LRUDict(3)
+        d['a'] = 1
+        d['b'] = 2
+        d['a']
+
+        self.assertEqual(d.keys(), ['b', 'a'])
@@ -1,11 +1,18 @@
 import os
 from autobahn.wamp import ComponentConfig
+from autobahn.wamp.exception import ApplicationError
 from faker import Faker
 from jsonschema import ValidationError
 from mock import mock, call
+from twisted.internet import defer
+from twisted.trial import unittest as trial
 from pyfakefs.fake_filesystem_unittest import Patcher
 from unittest2 import TestCase
 
+from mdstudio.api.capability import CLAIMS_VERSION, ENDPOINT_ERROR, generate_request_key, public_request_key, verify_request_proof
+from mdstudio.api.request_hash import request_hash
+from mdstudio.api.schema import MDStudioClaimSchema
+from mdstudio.api.exception import CallException
 from mdstudio.component.impl.common import CommonSession
 from mdstudio.util.exception import MDStudioException
 
@@ -412,3 +419,291 @@ class TestCommonSession(TestCase):
 
         with Patcher() as patcher:
             TestSession()
+
+    def test_session_endpoints(self):
+        self.assertEqual(self.session.session_endpoints(), [])
+
+        self.session.component_config.settings['metricsEndpoint'] = True
+        endpoints = self.session.session_endpoints()
+
+        MDStudioClaimSchema._instance = None
+        self.assertEqual([e.uri_suffix for e in endpoints], ['metrics'])
+        self.assertEqual(endpoints[0].scope, 'read')
+        self.assertEqual(endpoints[0].input_schema.to_schema(), {'type': 'object'})
+
+        self.session.metrics.increment('uri', 'calls')
+        endpoints[0].instance = self.session
+        self.assertEqual(endpoints[0].call_wrapped({}, {}), {'uri': {'counters': {'calls': 1}, 'timings': {}, 'gauges': {}}})
+
+    def test_metrics_disabled(self):
+        class TestSession(CommonSession):
+            validate_settings = mock.MagicMock()
+
+            def load_settings(self):
+                self.component_config.settings['metrics'] = False
+
+        self.assertFalse(TestSession().metrics.enabled)
+
+    def test_log_metrics(self):
+        self.session.log = mock.MagicMock()
+        self.session.metrics.record('uri', 'handler', 0.001)
+        self.session.log_metrics()
+
+        self.session.log.info.assert_called_once_with('Metrics: {summary}', summary='uri handler: 1 calls, mean 1.00ms, p95 1.00ms, max 1.00ms')
+
+
+class TestCommonSessionCoalescing(trial.TestCase):
+    def setUp(self):
+        class TestSession(CommonSession):
+            load_settings = mock.MagicMock()
+            validate_settings = mock.MagicMock()
+
+        self.session = TestSession()
+
+    def test_coalesce_call(self):
+        self.session.coalesced_procedures = {'vendor.component.endpoint.get', 'mdstudio.schema.*'}
+
+        self.assertTrue(self.session.coalesce_call('vendor.component.endpoint.get'))
+        self.assertTrue(self.session.coalesce_call('mdstudio.schema.endpoint.get'))
+        self.assertFalse(self.session.coalesce_call('vendor.component.endpoint.put'))
+
+    def test_call_coalesced(self):
+        self.session.coalesced_procedures = {'vendor.component.endpoint.get'}
+        remote = defer.Deferred()
+        self.session._call = mock.MagicMock(return_value=remote)
+
+        first = self.session.call('vendor.component.endpoint.get', {'a': 1})
+        second = self.session.call('vendor.component.endpoint.get', {'a': 1})
+        other = self.session.call('vendor.component.endpoint.get', {'a': 2})
+        remote.callback({'result': [1]})
+
+        self.assertEqual(self.session._call.call_count, 2)
+        first_result = self.successResultOf(first)
+        second_result = self.successResultOf(second)
+        self.assertEqual(first_result, second_result)
+        self.assertIsNot(first_result, second_result)
+        self.successResultOf(other)
+        self.assertEqual(self.session._in_flight, {})
+        self.assertEqual(self.session.metrics.snapshot()['vendor.component.endpoint.get']['counters']['call.coalesced'], 1)
+
+    def test_call_coalesced_failure(self):
+        self.session.coalesced_procedures = {'vendor.component.endpoint.get'}
+        remote = defer.Deferred()
+        self.session._call = mock.MagicMock(return_value=remote)
+
+        first = self.session.call('vendor.component.endpoint.get', {'a': 1})
+        second = self.session.call('vendor.component.endpoint.get', {'a': 1})
+        remote.errback(ValueError('failed'))
+
+        self.failureResultOf(first, ValueError)
+        self.failureResultOf(second, ValueError)
+        self.assertEqual(self.session._in_flight, {})
+
+    def test_call_not_coalesced(self):
+        self.session._call = mock.MagicMock(side_effect=lambda *args, **kwargs: defer.Deferred())
+
+        self.session.call('vendor.component.endpoint.get', {'a': 1})
+        self.session.call('vendor.component.endpoint.get', {'a': 1})
+
+        self.assertEqual(self.session._call.call_count, 2)
+
+
+class TestCommonSessionCallMany(trial.TestCase):
+    def setUp(self):
+        class TestSession(CommonSession):
+            load_settings = mock.MagicMock()
+            validate_settings = mock.MagicMock()
+
+        self.session = TestSession()
+        self.session.capabilities.get = mock.MagicMock(return_value=defer.succeed({'token': 'token', 'key': 'key'}))
+        self.session.capabilities.supported = mock.MagicMock(return_value=True)
+        self.pending = []
+
+        def call(procedure, request, claims=None, context=None):
+            d = defer.Deferred()
+            self.pending.append((procedure, request, d))
+            return d
+
+        self.session.call = mock.MagicMock(side_effect=call)
+
+    def test_call_many(self):
+        results = self.session.call_many('vendor.component.endpoint.get', [{'a': 1}, {'a': 2}, {'a': 3}], window=2)
+
+        self.assertEqual(len(self.pending), 2)
+        self.session.capabilities.get.assert_called_once()
+
+        self.pending[1][2].callback({'b': 2})
+        self.pending[0][2].errback(CallException('failed'))
+        self.assertEqual(len(self.pending), 3)
+        self.pending[2][2].callback({'b': 3})
+
+        self.assertEqual(self.successResultOf(results), [{'error': 'failed'}, {'data': {'b': 2}}, {'data': {'b': 3}}])
+
+    def test_call_many_procedures(self):
+        results = self.session.call_many(['vendor.component.endpoint.get', 'vendor.component.endpoint.put'], [{'a': 1}, {'a': 2}])
+
+        self.assertEqual(self.session.capabilities.get.call_count, 2)
+        self.assertEqual([p[0] for p in self.pending], ['vendor.component.endpoint.get', 'vendor.component.endpoint.put'])
+
+        for _, _, d in self.pending:
+            d.callback(None)
+
+        self.assertEqual(self.successResultOf(results), [{}, {}])
+
+    def test_call_many_mismatch(self):
+        self.failureResultOf(self.session.call_many(['vendor.component.endpoint.get'], [{'a': 1}, {'a': 2}]), ValueError)
+
+    def test_call_many_unsupported(self):
+        self.session.capabilities.supported.return_value = False
+
+        self.session.call_many('vendor.component.endpoint.get', [{'a': 1}])
+
+        self.session.capabilities.get.assert_not_called()
+
+
+class TestCommonSessionCall(trial.TestCase):
+    def setUp(self):
+        class TestSession(CommonSession):
+            load_settings = mock.MagicMock()
+            validate_settings = mock.MagicMock()
+
+        self.session = TestSession()
+        self.key = generate_request_key()
+        self.session.capabilities.get = mock.MagicMock(side_effect=lambda claims: defer.succeed({'token': 'token', 'key': self.key}))
+        self.procedure = 'vendor.component.endpoint.get'
+        self.results = []
+
+    def remote(self, procedure, *args, **kwargs):
+        if procedure == 'mdstudio.auth.endpoint.sign':
+            return defer.succeed('signed')
+
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            return defer.fail(result)
+        return defer.succeed(result)
+
+    def test_call_legacy(self):
+        self.results = [{'data': 1}]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=self.remote) as remote:
+            self.assertEqual(self.successResultOf(self.session.call(self.procedure, {'a': 1})), 1)
+
+        sign = remote.call_args_list[0]
+        self.assertEqual(sign[0][0], 'mdstudio.auth.endpoint.sign')
+        self.assertEqual(sign[0][1]['requestHash'], request_hash({'a': 1}))
+        remote.assert_called_with(self.procedure, {'a': 1}, signed_claims='signed')
+        self.session.capabilities.get.assert_not_called()
+        self.assertFalse(self.session.capabilities.supported(self.procedure))
+
+    def test_call_capability(self):
+        self.results = [{'data': 1, 'claimsVersion': CLAIMS_VERSION}, {'data': 2, 'claimsVersion': CLAIMS_VERSION}]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=self.remote) as remote:
+            self.successResultOf(self.session.call(self.procedure, {'a': 1}))
+            self.assertEqual(self.successResultOf(self.session.call(self.procedure, {'a': 2})), 2)
+
+        kwargs = remote.call_args[1]
+        self.assertEqual(kwargs['signed_claims'], 'token')
+        self.assertTrue(verify_request_proof(public_request_key(self.key), request_hash({'a': 2}), kwargs['request_proof']))
+        self.session.capabilities.get.assert_called_once()
+
+    def test_call_older_instance(self):
+        self.session.capabilities.learn(self.procedure, {'claimsVersion': CLAIMS_VERSION})
+        self.results = [ApplicationError(u'wamp.error.runtime_error', "__call__() got an unexpected keyword argument 'request_proof'"),
+                        {'data': 1}]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=self.remote) as remote:
+            self.assertEqual(self.successResultOf(self.session.call(self.procedure, {'a': 1})), 1)
+
+        remote.assert_called_with(self.procedure, {'a': 1}, signed_claims='signed')
+        self.assertFalse(self.session.capabilities.supported(self.procedure))
+
+    def test_call_many(self):
+        # The calls go through the chainable call itself, and only return once a window slot is taken
+        pending = []
+
+        def remote(procedure, *args, **kwargs):
+            if procedure == 'mdstudio.auth.endpoint.sign':
+                return defer.succeed('signed')
+
+            pending.append(defer.Deferred())
+            return pending[-1]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=remote):
+            results = self.session.call_many(self.procedure, [{'a': 1}, {'a': 2}, {'a': 3}], window=2)
+
+            self.assertEqual(len(pending), 2)
+            pending[0].callback({'data': 1})
+            pending[1].callback({'error': 'failed'})
+            self.assertNoResult(results)
+            pending[2].callback({'data': 3})
+
+        self.assertEqual(self.successResultOf(results), [{'data': 1}, {'error': 'failed'}, {'data': 3}])
+
+    def test_call_many_capability(self):
+        self.session.capabilities.learn(self.procedure, {'claimsVersion': CLAIMS_VERSION})
+        self.results = [{'data': 1, 'claimsVersion': CLAIMS_VERSION}, {'data': 2, 'claimsVersion': CLAIMS_VERSION}]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=self.remote):
+            results = self.session.call_many(self.procedure, [{'a': 1}, {'a': 2}])
+
+        self.assertEqual(self.successResultOf(results), [{'data': 1}, {'data': 2}])
+
+    def test_call_failed(self):
+        self.session.capabilities.learn(self.procedure, {'claimsVersion': CLAIMS_VERSION})
+        self.results = [ApplicationError(ENDPOINT_ERROR, "unexpected keyword argument 'request_proof'", claimsVersion=CLAIMS_VERSION)]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=self.remote) as remote:
+            self.failureResultOf(self.session.call(self.procedure, {'a': 1}), CallException)
+
+        # The endpoint ran the call, so it is neither downgraded nor retried
+        self.assertEqual(remote.call_count, 1)
+        self.assertTrue(self.session.capabilities.supported(self.procedure))
+
+    def test_call_failed_other_error(self):
+        self.session.capabilities.learn(self.procedure, {'claimsVersion': CLAIMS_VERSION})
+        self.results = [ApplicationError(u'wamp.error.no_such_procedure', 'no callee')]
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call', side_effect=self.remote) as remote:
+            self.failureResultOf(self.session.call(self.procedure, {'a': 1}), CallException)
+
+        self.assertEqual(remote.call_count, 1)
+        self.assertTrue(self.session.capabilities.supported(self.procedure))
+
+
+class TestCommonSessionSubscribe(trial.TestCase):
+    def setUp(self):
+        class TestSession(CommonSession):
+            load_settings = mock.MagicMock()
+            validate_settings = mock.MagicMock()
+
+        self.session = TestSession()
+        self.session.authorize_request = mock.MagicMock(return_value=True)
+        self.session.claims_verifier.verify = mock.MagicMock(return_value=defer.succeed({'claims': {'username': 'test'}}))
+        self.handler = mock.MagicMock(return_value=defer.succeed('handled'))
+
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.subscribe') as subscribe:
+            self.session.subscribe(self.handler, 'vendor.component.events')
+        self.event = subscribe.call_args[0][0]
+
+    def test_subscribe(self):
+        with mock.patch('autobahn.twisted.wamp.ApplicationSession.call') as remote:
+            result = self.event({'a': 1}, signed_claims='token')
+
+        remote.assert_not_called()
+        self.session.claims_verifier.verify.assert_called_once_with('token')
+        self.session.authorize_request.assert_called_once_with('vendor.component.events', {'username': 'test'})
+        self.handler.assert_called_once_with({'a': 1}, claims={'username': 'test'})
+        self.assertEqual(self.successResultOf(result), 'handled')
+
+    def test_subscribe_unauthorized(self):
+        self.session.authorize_request.return_value = False
+
+        self.successResultOf(self.event({'a': 1}, signed_claims='token'))
+        self.handler.assert_not_called()
+
+    def test_subscribe_expired(self):
+        self.session.claims_verifier.verify.return_value = defer.succeed({'expired': 'Request token has expired'})
+
+        self.successResultOf(self.event({'a': 1}, signed_claims='token'))
+        self.handler.assert_not_called()
@@ -1 +1,116 @@
+from mock import MagicMock
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from mdstudio.api.exception import CallException
+from mdstudio.api.metrics import Metrics
 from mdstudio.component.impl.core import *
+
+
+class TestComponentWaiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.handlers = []
+        self.subscription = MagicMock()
+        self.subscription.unsubscribe.side_effect = lambda: defer.succeed(None)
+
+        def on_event(handler, topic):
+            self.handlers.append((topic, handler))
+            return defer.succeed(self.subscription)
+
+        self.session = MagicMock()
+        self.session.class_name.return_value = 'TestComponent'
+        self.session.on_event.side_effect = on_event
+        self.session.startup_timeline = []
+        self.session.metrics = Metrics()
+        self.statuses = []
+        self.session.call.side_effect = lambda *args, **kwargs: self._status()
+
+        self.waiter = CoreComponentSession.ComponentWaiter(self.session, 'db')
+        self.waiter.clock = self.clock
+
+    def _status(self):
+        status = self.statuses.pop(0) if self.statuses else False
+        if isinstance(status, Exception):
+            return defer.fail(status)
+        return defer.succeed(status)
+
+    def test_online(self):
+        self.statuses = [True]
+
+        d = self.waiter.wait()
+
+        self.successResultOf(d)
+        self.assertEqual(self.session.call.call_count, 1)
+        self.assertEqual(self.handlers[0][0], 'mdstudio.auth.endpoint.ring0.status')
+        self.subscription.unsubscribe.assert_called_once_with()
+        self.assertEqual(self.session.startup_timeline, [{'component': 'db', 'waited': 0, 'via': 'query'}])
+
+    def test_event(self):
+        d = self.waiter.wait()
+        self.assertNoResult(d)
+
+        self.clock.advance(1)
+        self.handlers[0][1]({'component': 'db', 'status': True})
+
+        self.successResultOf(d)
+        self.subscription.unsubscribe.assert_called_once_with()
+        self.assertEqual(self.session.startup_timeline, [{'component': 'db', 'waited': 1, 'via': 'event'}])
+        self.assertEqual(self.session.metrics.timings[('startup', 'wait.db')].count, 1)
+
+    def test_event_other_component(self):
+        d = self.waiter.wait()
+
+        self.handlers[0][1]({'component': 'schema', 'status': True})
+        self.handlers[0][1]({'component': 'db', 'status': False})
+
+        self.assertNoResult(d)
+
+        self.handlers[0][1]({'component': 'db', 'status': True})
+        self.successResultOf(d)
+
+    def test_poll(self):
+        self.statuses = [False, CallException('auth is not online'), False, True]
+
+        d = self.waiter.wait()
+        self.clock.advance(0.1)
+        self.clock.advance(0.2)
+        self.assertNoResult(d)
+        self.clock.advance(0.4)
+
+        self.successResultOf(d)
+        self.assertEqual(self.session.call.call_count, 4)
+        self.assertEqual(self.session.startup_timeline[0]['via'], 'query')
+
+    def test_subscription_refused(self):
+        self.session.on_event.side_effect = lambda handler, topic: defer.fail(Exception('not authorized'))
+        self.statuses = [False, True]
+
+        d = self.waiter.wait()
+        self.assertNoResult(d)
+        self.clock.advance(0.1)
+
+        self.successResultOf(d)
+        self.assertEqual(self.session.call.call_count, 2)
+        self.subscription.unsubscribe.assert_not_called()
+        self.assertEqual(self.session.startup_timeline[0]['via'], 'query')
+
+    def test_poll_interval_bounded(self):
+        self.waiter.max_poll_interval = 0.2
+
+        d = self.waiter.wait()
+        self.clock.pump([0.1, 0.2, 0.2, 0.2])
+
+        self.assertEqual(self.session.call.call_count, 5)
+        self.statuses = [True]
+        self.clock.advance(0.2)
+
+        self.successResultOf(d)
+
+    def test_startup_report(self):
+        session = MagicMock()
+        session.class_name.return_value = 'TestComponent'
+        session.startup_timeline = [{'component': 'db', 'waited': 1.5, 'via': 'event'}]
+
+        self.assertEqual(CoreComponentSession.startup_report(session), ['TestComponent waited 1.50s for db (event)'])
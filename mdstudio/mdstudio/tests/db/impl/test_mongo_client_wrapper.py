@@ -39,6 +39,82 @@ class TestMongoClientWrapper(DBTestCase):
         self.assertIsInstance(ldb, MongoDatabaseWrapper)
         self.assertEqual(ldb, self.d.get_database('database_name'))
 
+    def test_find_database(self):
+        self.assertIsNone(self.d.find_database('database_name'))
+
+        ldb = self.d.get_database('database_name')
+        self.d._client.database_names = mock.MagicMock()
+
+        self.assertIs(self.d.find_database('database_name'), ldb)
+        self.assertIs(self.d.get_database('database_name'), ldb)
+        self.d._client.database_names.assert_not_called()
+
+    def test_evict_max_databases(self):
+        self.d.max_databases = 2
+        self.d.clock = mock.MagicMock(side_effect=range(100))
+
+        first = self.d.get_database('database1')
+        first.close = mock.MagicMock()
+        self.d.get_database('database2')
+        self.d.get_database('database1')
+        self.d.get_database('database3')
+
+        self.assertEqual(sorted(self.d._databases.keys()), ['database1', 'database3'])
+        first.close.assert_not_called()
+
+    def test_evict_idle(self):
+        self.d.max_idle = 10
+        self.d.clock = mock.MagicMock(return_value=0)
+
+        ldb = self.d.get_database('database1')
+        ldb.close = mock.MagicMock()
+        self.d.clock.return_value = 5
+        self.d.get_database('database2')
+
+        self.d.clock.return_value = 10
+        self.assertEqual(self.d.evict_idle(), 1)
+        self.assertEqual(list(self.d._databases.keys()), ['database2'])
+        self.assertEqual(list(self.d._last_used.keys()), ['database2'])
+        ldb.close.assert_called_once_with()
+
+    def test_evict_open_cursors(self):
+        self.d.max_idle = 10
+        self.d.max_databases = 1
+        self.d.clock = mock.MagicMock(return_value=0)
+
+        ldb = self.d.get_database('database1')
+        ldb._cursors['cursor'] = (mock.MagicMock(), None)
+        self.d.get_database('database2')
+
+        self.d.clock.return_value = 10
+        self.assertEqual(self.d.evict_idle(), 1)
+        self.assertEqual(list(self.d._databases.keys()), ['database1'])
+
+        ldb._cursors.clear()
+        self.assertEqual(self.d.evict_idle(), 1)
+        self.assertEqual(self.d._databases, {})
+
+    def test_evict_pinned(self):
+        self.d.max_idle = 10
+        self.d.max_databases = 1
+        self.d.clock = mock.MagicMock(return_value=0)
+
+        ldb = self.d.get_database('database1', pinned=True)
+        self.d.get_database('database2')
+        self.d.get_database('database3')
+
+        self.d.clock.return_value = 10
+        self.assertEqual(self.d.evict_idle(), 1)
+        self.assertEqual(list(self.d._databases.keys()), ['database1'])
+        self.assertIs(self.d.get_database('database1'), ldb)
+
+    def test_collection_stats(self):
+        self.d.get_database('database1')._get_collection('test_collection')
+        self.d.get_database('database2')._get_collection('test_collection', create=True)
+        self.d.get_database('database2')._get_collection('test_collection')
+
+        self.assertEqual(self.d.collection_stats(), {'hits': 1, 'misses': 2, 'refreshes': 4})
+
     def test_create_mongo_client(self):
         db.create_mock_client = False
 
@@ -1,11 +1,13 @@
 # coding=utf-8
 
 import datetime
+from copy import deepcopy
 
 import mongomock
 import pytz
 import twisted
 from bson import ObjectId
+from cryptography.fernet import Fernet
 from faker import Faker
 from mock import mock, call
 from twisted.internet import reactor
@@ -14,6 +16,7 @@ from mdstudio.db.cursor import Cursor, query
 from mdstudio.db.exception import DatabaseException
 from mdstudio.db.fields import Fields
 from mdstudio.db.impl.mongo_client_wrapper import MongoClientWrapper
+from mdstudio.db.index import Index
 from mdstudio.service.model import Model
 from mdstudio.db.sort_mode import SortMode
 from mdstudio.deferred.chainable import test_chainable
@@ -180,6 +183,24 @@ class TestMongoDatabaseWrapper(DBTestCase):
 
         self.assertEqual(result, None)
 
+    def test_close(self):
+        cursor = mock.MagicMock()
+        self.db._cursors['cursor'] = (cursor, None)
+
+        self.db.close()
+
+        cursor.close.assert_called_once_with()
+        self.assertNotIn('cursor', self.db._cursors)
+
+    def test_open_cursors(self):
+        self.assertEqual(self.db.open_cursors(), 0)
+
+        self.db._cursors['cursor'] = (mock.MagicMock(), None)
+        self.assertEqual(self.db.open_cursors(), 1)
+
+        self.db._cursors.max_age = 0
+        self.assertEqual(self.db.open_cursors(), 0)
+
     def test_get_collection_dict(self):
 
         self.db._logger = mock.MagicMock()
@@ -216,6 +237,39 @@ class TestMongoDatabaseWrapper(DBTestCase):
         self.db._logger.info.assert_called_once_with('Creating collection {collection} in {database}',
                                                      collection='test_collection', database='users~userNameDatabase')
 
+    def test_get_collection_known(self):
+        self.db._db['test_collection'].insert_one({'test': 1})
+        self.db._db.collection_names = mock.MagicMock(wraps=self.db._db.collection_names)
+
+        self.assertIsNotNone(self.db._get_collection('test_collection'))
+        self.assertIsNotNone(self.db._get_collection('test_collection'))
+
+        self.db._db.collection_names.assert_called_once_with()
+        self.assertEqual(self.db.collection_stats, {'hits': 2, 'misses': 0, 'refreshes': 1})
+
+    def test_get_collection_miss(self):
+        self.db._get_collection('test_collection')
+        self.db._db['test_collection'].insert_one({'test': 1})
+
+        self.assertIsNotNone(self.db._get_collection('test_collection'))
+        self.assertEqual(self.db.collection_stats, {'hits': 0, 'misses': 2, 'refreshes': 3})
+
+    def test_get_collection_create_known(self):
+        self.db._get_collection('test_collection', create=True)
+        self.db._db.collection_names = mock.MagicMock(wraps=self.db._db.collection_names)
+
+        self.assertIsNotNone(self.db._get_collection('test_collection'))
+        self.db._db.collection_names.assert_not_called()
+
+    def test_get_collection_expired(self):
+        self.db.clock = mock.MagicMock(return_value=0)
+        self.db._get_collection('test_collection', create=True)
+        self.db._db.collection_names = mock.MagicMock(return_value=[])
+
+        self.db.clock.return_value = self.db.collection_refresh_interval
+        self.assertIsNone(self.db._get_collection('test_collection'))
+        self.assertEqual(self.db._db.collection_names.call_count, 2)
+
     @test_chainable
     def test_insert_one(self):
 
@@ -408,6 +462,46 @@ class TestMongoDatabaseWrapper(DBTestCase):
         self.assertEqual(result.modified, 0)
         self.assertEqual(result.upserted_id, '666f6f2d6261722d71757578')
 
+    @test_chainable
+    def test_replace_many(self):
+
+        ids = yield self.d.insert_many([
+            {'test': 2, '_id': '0123456789ab0123456789ab'},
+            {'test': 3, '_id': '59f1d9c57dd5d70043e74f8d'},
+        ])
+
+        result = yield self.db.replace_many('test_collection', [
+            {'filter': {'_id': ids[0]}, 'replacement': {'test': 4}},
+            {'filter': {'test': 5}, 'replacement': {'test': 5}}
+        ], upsert=True)
+
+        found = yield self.d.find_many({}).to_list()
+        self.assertEqual(found[0], {'test': 4, '_id': ids[0]})
+        self.assertEqual(found[1], {'test': 3, '_id': ids[1]})
+        self.assertEqual(result['matched'], 1)
+        self.assertEqual(result['modified'], 1)
+        self.assertEqual(result['upsertedIds'], [found[2]['_id']])
+
+    @test_chainable
+    def test_replace_many_date_time_fields(self):
+        datetime = self.faker.date_time(pytz.utc)
+        datetime2 = self.faker.date_time(pytz.utc)
+        yield self.d.insert_many([{'test': 2, 'datetime': datetime}], fields=Fields(date_times=['datetime']))
+
+        yield self.db.replace_many('test_collection', [
+            {'filter': {'datetime': datetime}, 'replacement': {'test': 3, 'datetime': datetime2}}
+        ], fields=Fields(date_times=['datetime']))
+
+        found = yield self.d.find_one({'test': 3}, {'_id': False}, fields=Fields(date_times=['datetime']))
+        self.assertEqual(found, {'test': 3, 'datetime': datetime2})
+
+    @test_chainable
+    def test_replace_many_no_collection(self):
+
+        result = yield self.db.replace_many('test_collection', [{'filter': {'test': 5}, 'replacement': {'test': 6}}])
+
+        self.assertEqual(result, {'matched': 0, 'modified': 0})
+
     @test_chainable
     def test_replace_one_no_collection(self):
 
@@ -871,6 +965,23 @@ class TestMongoDatabaseWrapper(DBTestCase):
 
         fields.parse_result.assert_has_calls([])
 
+    @test_chainable
+    def test_find_many_parse_results(self):
+        key_repository = mock.MagicMock()
+        key_repository.get_key = mock.MagicMock(return_value=Fernet.generate_key())
+        fields = Fields(encrypted=['secret'], key_repository=key_repository)
+
+        obs = [{'test': i, 'secret': 'value {}'.format(i)} for i in range(10)]
+        yield self.db.insert_many('test_collection', deepcopy(obs), fields=fields, claims={'user': 'test'})
+
+        fields.parse_result = mock.MagicMock(wraps=fields.parse_result)
+        fields.parse_results = mock.MagicMock(wraps=fields.parse_results)
+        found = yield self.db.find_many('test_collection', {}, {'_id': 0}, fields=fields, claims={'user': 'test'})
+
+        fields.parse_results.assert_called_once()
+        fields.parse_result.assert_not_called()
+        self.assertEqual(found['results'], obs)
+
     @test_chainable
     def test_find_many_projection(self):
 
@@ -1826,6 +1937,20 @@ class TestMongoDatabaseWrapper(DBTestCase):
         found = yield self.d.find_one({'test': 1})
         self.assertEqual(found, None)
 
+    @test_chainable
+    def test_create_indexes(self):
+        collection = mock.MagicMock()
+        collection.create_index.return_value = 'test_index'
+        self.db._get_collection = mock.MagicMock(return_value=collection)
+
+        names = yield self.d.create_indexes('test_collection', [Index(keys=[('test', SortMode.Asc), ('test2', SortMode.Desc)],
+                                                                      unique=True, name='test_index')])
+
+        self.db._get_collection.assert_called_once_with('test_collection', create=True)
+        collection.create_index.assert_called_once_with([['test', 1], ['test2', -1]], unique=True, name='test_index',
+                                                        background=True)
+        self.assertEqual(names, ['test_index'])
+
     @test_chainable
     def test_delete_many_no_collection(self):
 
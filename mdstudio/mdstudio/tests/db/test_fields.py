@@ -9,6 +9,7 @@ from unittest2 import TestCase
 
 from mdstudio.db.database import Fields
 from mdstudio.db.exception import DatabaseException
+from mdstudio.db.key_derivation import key_derivation
 from mdstudio.utc import now
 
 
@@ -1262,6 +1263,16 @@ class FieldsTests(TestCase):
         self.field.convert_call(obj3, None, {'username': 'user'})
         self.assertNotEqual(obj3, obj2)
 
+    def test_encryptor_shared(self):
+        self.field = Fields(encrypted=['test'])
+        self.field._key_repository = mock.MagicMock()
+        self.field._key_repository.get_key = mock.MagicMock(return_value=Fernet.generate_key())
+
+        encryptor = self.field.get_encryptor({'username': 'user'})
+
+        self.assertIs(Fields(encrypted=['test'], key_repository=self.field._key_repository).get_encryptor({'username': 'user'}),
+                      encryptor)
+
     def test_encryption_fields_none(self):
         self.field = Fields(encrypted=['test'])
         self.field._key_repository = mock.MagicMock()
@@ -1370,6 +1381,71 @@ class FieldsTests(TestCase):
         obj2 = deepcopy(obj)
         self.assertRaisesRegex(DatabaseException, "", self.field.parse_result, obj2, {'username': 'user'})
 
+    def test_parse_results(self):
+        self.field = Fields(encrypted=['test', 'sub.test'])
+        self.field._key_repository = mock.MagicMock()
+        self.field._key_repository.get_key = mock.MagicMock(return_value=Fernet.generate_key())
+        objs = [{
+            'test': 'hello world',
+            'sub': [{'test': 'first'}, {'test': 'second'}]
+        }, {
+            'test': 'hello world'
+        }, {
+            'other': 'value'
+        }]
+        objs2 = deepcopy(objs)
+        self.field.convert_call(objs2, None, {'username': 'user'})
+
+        self.assertRegex(objs2[1]['test'], '__encrypted__:')
+        encryptor = self.field.get_encryptor({'username': 'user'})
+        with mock.patch.object(encryptor, 'decrypt', wraps=encryptor.decrypt) as decrypt:
+            self.field.parse_results(objs2, {'username': 'user'})
+
+        self.assertEqual(objs, objs2)
+        self.assertEqual(decrypt.call_count, 4)
+
+    def test_parse_results_none(self):
+        self.field = Fields(encrypted=['test'])
+        objs = [{'test': '__encrypted__:abc'}, {'test': '__encrypted__:def'}]
+        objs2 = deepcopy(objs)
+
+        self.field.parse_results(objs2)
+        self.field.parse_results([], {'username': 'user'})
+
+        self.assertEqual(objs, objs2)
+
+    def test_parse_results_decrypt_fails(self):
+        self.field = Fields(encrypted=['test'])
+        self.field._key_repository = mock.MagicMock()
+        self.field._key_repository.get_key = mock.MagicMock(return_value=Fernet.generate_key())
+        objs = [{'test': 'hello world'}, {'test': 'hello world'}]
+
+        self.assertRaisesRegex(DatabaseException, 'Trying to decrypt an unencrypted field with key "test", '
+                                                  'please check your insert statements!', self.field.parse_results, objs,
+                               {'username': 'user'})
+        self.assertRaisesRegex(DatabaseException, "Failed to decrypt field '2'", self.field.parse_results,
+                               [{'test': 2}, {'test': 3}], {'username': 'user'})
+        self.assertRaisesRegex(DatabaseException, "Failed to decrypt field test", self.field.parse_results,
+                               [{'test': '__encrypted__:wefwefewf'}, {'test': '__encrypted__:wefwefewf'}],
+                               {'username': 'user'})
+
+    def test_parse_results_parallel(self):
+        self.field = Fields(encrypted=['test'])
+        self.field._key_repository = mock.MagicMock()
+        self.field._key_repository.get_key = mock.MagicMock(return_value=Fernet.generate_key())
+        objs = [{'test': 'value {}'.format(i)} for i in range(Fields.parallel_decryption_threshold)]
+        objs2 = deepcopy(objs)
+        self.field.convert_call(objs2, None, {'username': 'user'})
+
+        Fields.configure_decryption(2)
+        try:
+            self.field.parse_results(objs2, {'username': 'user'})
+        finally:
+            Fields.configure_decryption()
+
+        self.assertEqual(objs, objs2)
+        self.assertIsNone(Fields._decryption_pool)
+
     def test_to_dict(self):
         fields = Fields(date_times=['test'], dates=['test2'], encrypted=['test3'])
         self.assertEqual(fields.to_dict(), {
@@ -1449,3 +1525,16 @@ class FieldsTests(TestCase):
                 'date': b'2017-10-26',
                 '__hashed__:date': 'OLiaieIaRIW2tk3SwD9zGAE4TGk-yxifRdI8xElZ7j8='
             })
+
+    def test_convert_call_hashed_batch(self):
+        documents = [{'date': '2017-10-26'}, {'date': '2017-10-27'}, {'other': 'value'}]
+        f = Fields(hashed=['date'])
+
+        with mock.patch('mdstudio.db.fields.key_derivation.derive_many', wraps=key_derivation.derive_many) as derive_many:
+            f.convert_call(documents)
+
+        derive_many.assert_called_once()
+        self.assertEqual(len(derive_many.call_args[0][0]), 2)
+        self.assertEqual(documents[0]['__hashed__:date'], 'OLiaieIaRIW2tk3SwD9zGAE4TGk-yxifRdI8xElZ7j8=')
+        self.assertIn('__hashed__:date', documents[1])
+        self.assertEqual(documents[2], {'other': 'value'})
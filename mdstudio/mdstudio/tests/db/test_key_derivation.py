@@ -0,0 +1,74 @@
+import hashlib
+from threading import Thread
+
+from unittest2 import TestCase
+
+from mdstudio.db.key_derivation import KeyDerivation, pbkdf2
+
+
+class KeyDerivationTests(TestCase):
+    hash = b'OLiaieIaRIW2tk3SwD9zGAE4TGk-yxifRdI8xElZ7j8='
+
+    def setUp(self):
+        self.password = b'2017-10-26'
+        self.salt = hashlib.sha512(self.password).digest()
+        self.derivation = KeyDerivation()
+
+    def tearDown(self):
+        self.derivation.shutdown()
+
+    def test_pbkdf2(self):
+        self.assertEqual(pbkdf2(self.password, self.salt, 50000), self.hash)
+
+    def test_derive(self):
+        self.assertEqual(self.derivation.derive(self.password, self.salt, 50000), self.hash)
+        self.assertIsNone(self.derivation._pool)
+
+    def test_derive_many_empty(self):
+        self.assertEqual(self.derivation.derive_many([]), [])
+        self.assertEqual(self.derivation.derived, 0)
+        self.assertEqual(self.derivation.rate(), 0.0)
+
+    def test_derive_many_pool(self):
+        self.derivation.configure(processes=1, batch_size=2)
+
+        keys = self.derivation.derive_many([(self.password, self.salt, 50000), (b'other', b'salt', 1000),
+                                            (self.password, self.salt, 50000)])
+
+        self.assertEqual(keys[0], self.hash)
+        self.assertEqual(keys[1], pbkdf2(b'other', b'salt', 1000))
+        self.assertEqual(keys[2], self.hash)
+        self.assertIsNotNone(self.derivation._pool)
+
+    def test_rate(self):
+        self.derivation.derive_many([(self.password, self.salt, 1000)] * 3)
+
+        self.assertEqual(self.derivation.derived, 3)
+        self.assertGreater(self.derivation.seconds, 0)
+        self.assertGreater(self.derivation.rate(), 0)
+
+    def test_configure(self):
+        self.derivation.configure(processes=1, batch_size=4)
+        self.derivation.derive(self.password, self.salt, 1000)
+
+        self.derivation.configure()
+
+        self.assertIsNone(self.derivation._pool)
+        self.assertIsNone(self.derivation.processes)
+        self.assertEqual(self.derivation.batch_size, 4)
+
+    def test_configure_running(self):
+        self.derivation.configure(processes=1)
+        results = []
+
+        thread = Thread(target=lambda: results.append(self.derivation.derive(self.password, self.salt, 50000)))
+        thread.start()
+        while not self.derivation._running and thread.is_alive():
+            pass
+
+        self.derivation.configure()
+        thread.join(30)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [self.hash])
+        self.assertIsNone(self.derivation._pool)
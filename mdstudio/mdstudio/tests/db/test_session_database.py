@@ -7,6 +7,7 @@ from twisted.trial.unittest import TestCase
 from mdstudio.api.context import UserContext
 from mdstudio.db.cursor import Cursor
 from mdstudio.db.fields import Fields
+from mdstudio.db.index import Index
 from mdstudio.db.session_database import SessionDatabaseWrapper
 from mdstudio.db.sort_mode import SortMode
 from mdstudio.deferred.chainable import chainable
@@ -109,6 +110,19 @@ class SessionDatabaseWrapperTests(TestCase):
             }
         }, claims={'connectionType': 'user'})
 
+    def test_replace_many(self):
+        self.wrapper.replace_many('col', [{'filter': {'_id': 5}, 'replacement': {'test': 8}}], upsert=True,
+                                  fields=Fields(date_times=['field1']))
+
+        self.session.call.assert_called_once_with('mdstudio.db.endpoint.replace_many', {
+            'collection': 'col',
+            'replacements': [{'filter': {'_id': 5}, 'replacement': {'test': 8}}],
+            'upsert': True,
+            'fields': {
+                'datetime': ['field1']
+            }
+        }, claims={'connectionType': 'user'})
+
     def test_count(self):
         self.wrapper.count('col')
 
@@ -590,6 +604,17 @@ class SessionDatabaseWrapperTests(TestCase):
             }
         }, claims={'connectionType': 'user'})
 
+    def test_create_indexes(self):
+        self.wrapper.create_indexes('col', [Index(keys=[('field', SortMode.Desc)], unique=True)])
+
+        self.session.call.assert_called_once_with('mdstudio.db.endpoint.create_indexes', {
+            'collection': 'col',
+            'indexes': [{
+                'keys': [['field', 'desc']],
+                'unique': True
+            }]
+        }, claims={'connectionType': 'user'})
+
 
 # noinspection PyPep8
 class TestSessionDatabaseWrapperDeferred(TestCase):
@@ -19,3 +19,10 @@ class SortModeTests(unittest.TestCase):
 
     def test_neq(self):
         self.assertNotEqual(SortMode.Desc, SortMode.Asc)
+
+    def test_from_string(self):
+        self.assertEqual(SortMode.from_string('asc'), SortMode.Asc)
+        self.assertEqual(SortMode.from_string('desc'), SortMode.Desc)
+
+    def test_from_string_invalid(self):
+        self.assertRaises(ValueError, SortMode.from_string, 'up')
@@ -0,0 +1,103 @@
+from twisted.internet import task
+from twisted.internet.defer import Deferred, CancelledError
+from twisted.trial.unittest import TestCase
+
+from mdstudio.deferred.chainable import chainable
+from mdstudio.deferred.limiter import ConcurrencyLimiter, LimitExceeded
+from mdstudio.deferred.return_value import return_value
+
+
+class TestConcurrencyLimiter(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def test_acquire(self):
+        limiter = ConcurrencyLimiter(2, clock=self.clock)
+
+        self.assertTrue(limiter.acquire().called)
+        self.assertTrue(limiter.acquire().called)
+        self.assertEqual(limiter.running, 2)
+        self.failureResultOf(limiter.acquire(), LimitExceeded)
+
+        limiter.release()
+        self.assertEqual(limiter.running, 1)
+
+    def test_queue(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, clock=self.clock)
+
+        limiter.acquire()
+        waiter = limiter.acquire()
+        self.assertFalse(waiter.called)
+        self.assertEqual(limiter.queued, 1)
+        self.failureResultOf(limiter.acquire(), LimitExceeded)
+
+        limiter.release()
+        self.assertTrue(waiter.called)
+        self.assertEqual(limiter.running, 1)
+        self.assertEqual(limiter.queued, 0)
+
+    def test_queue_timeout(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=5, clock=self.clock)
+
+        limiter.acquire()
+        waiter = limiter.acquire()
+        self.clock.advance(5)
+
+        self.failureResultOf(waiter, LimitExceeded)
+        self.assertEqual(limiter.queued, 0)
+
+        limiter.release()
+        self.assertEqual(limiter.running, 0)
+
+    def test_queue_cancel(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=5, clock=self.clock)
+
+        limiter.acquire()
+        waiter = limiter.acquire()
+        waiter.cancel()
+
+        self.failureResultOf(waiter, CancelledError)
+        self.assertEqual(limiter.queued, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_run(self):
+        limiter = ConcurrencyLimiter(1, max_queue=1, clock=self.clock)
+
+        first = Deferred()
+        result1 = limiter.run(lambda: first)
+        result2 = limiter.run(lambda x: x * 2, 21)
+        self.assertFalse(result2.called)
+
+        first.callback(1)
+        self.assertEqual(self.successResultOf(result1), 1)
+        self.assertEqual(self.successResultOf(result2), 42)
+        self.assertEqual(limiter.running, 0)
+
+    def test_run_chainable(self):
+        limiter = ConcurrencyLimiter(1, clock=self.clock)
+        first = Deferred()
+
+        @chainable
+        def f():
+            result = yield first
+            return_value(result * 2)
+
+        result = limiter.run(f)
+        self.assertNoResult(result)
+        self.assertEqual(limiter.running, 1)
+
+        first.callback(21)
+        self.assertEqual(self.successResultOf(result), 42)
+        self.assertEqual(limiter.running, 0)
+
+    def test_run_failure(self):
+        limiter = ConcurrencyLimiter(1, clock=self.clock)
+
+        def fail():
+            raise ValueError()
+
+        self.failureResultOf(limiter.run(fail), ValueError)
+        self.assertEqual(limiter.running, 0)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, ConcurrencyLimiter, 0)
@@ -11,7 +11,7 @@ from mdstudio.db.cursor import Cursor
 from mdstudio.db.database import IDatabase
 from mdstudio.db.fields import Fields
 from mdstudio.service.model import Model
-from mdstudio.db.response import ReplaceOneResponse, UpdateOneResponse, UpdateManyResponse
+from mdstudio.db.response import ReplaceOneResponse, ReplaceManyResponse, UpdateOneResponse, UpdateManyResponse
 from mdstudio.db.session_database import SessionDatabaseWrapper
 from mdstudio.db.sort_mode import SortMode
 from mdstudio.deferred.chainable import chainable
@@ -473,6 +473,27 @@ class ModelTests(TestCase):
                                                         upsert=False,
                                                         fields=Fields(date_times=['test', 'test2']))
 
+    @chainable
+    def test_replace_many(self):
+        self.wrapper.replace_many.return_value = {
+            'matched': 1,
+            'modified': 1,
+            'upsertedIds': ['test_id2']
+        }
+        self.wrapper.transform = IDatabase.transform
+        replacements = [{'filter': {'_id': 'test_id'}, 'replacement': self.document}]
+        result = yield self.model.replace_many(replacements, upsert=True)
+
+        self.assertIsInstance(result, ReplaceManyResponse)
+        self.assertEqual(result.matched, 1)
+        self.assertEqual(result.modified, 1)
+        self.assertEqual(result.upserted_ids, ['test_id2'])
+
+        self.wrapper.replace_many.assert_called_once_with(self.collection,
+                                                          replacements=replacements,
+                                                          upsert=True,
+                                                          fields=None)
+
     @chainable
     def test_update_many(self):
         self.wrapper.update_many.return_value = {
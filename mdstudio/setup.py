@@ -51,12 +51,15 @@ setup(
         'node-semver',
         'passlib',
         'argon2-cffi',
+        'cryptography',
+        'pyjwt',
         'service_identity',  # For Twisted host TLS verification
         'argon2-cffi',
         'pypiwin32 >= 1.0;platform_system=="Windows"',
         'functools32 >= 0.0;python_version<"3.4"'
     ],
     extras_require={
+        'fast': ['fastjsonschema'],
         'test': ['coverage', 'dictdiffer', 'faker', 'mock', 'mongomock',
                  'pyfakefs', 'pymongo', 'unittest2']
     },